@@ -1,13 +1,91 @@
+from functools import partial
+from typing import Iterable, Set
+
 from django import forms
 from django.contrib import admin
+from django.db.transaction import on_commit
+
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, PRODUCTS_SCOPE, view_cache
+from receipt_tracker.models import FoodProduct, NonFoodProduct, OperatorState, PendingReceipt, Product, ProductAlias, \
+    Receipt, ReceiptItem, Seller
+from receipt_tracker.repositories import daily_product_stats_repository, product_alias_repository, \
+    product_repository, product_summary_repository, receipt_item_repository
+
+
+class ViewCacheInvalidatingAdmin(admin.ModelAdmin):
+
+    def save_model(self, request, obj, form, change):
+        super(ViewCacheInvalidatingAdmin, self).save_model(request, obj, form, change)
+        self._invalidate_view_cache()
+
+    def delete_model(self, request, obj):
+        super(ViewCacheInvalidatingAdmin, self).delete_model(request, obj)
+        self._invalidate_view_cache()
+
+    def delete_queryset(self, request, queryset):
+        super(ViewCacheInvalidatingAdmin, self).delete_queryset(request, queryset)
+        self._invalidate_view_cache()
+
+    def _invalidate_view_cache(self):
+        # Правки в админке редки, поэтому сбрасываем все страницы, а не выясняем, каких пользователей они касаются
+        on_commit(partial(view_cache.invalidate, LISTINGS_SCOPE, PRODUCTS_SCOPE))
+
+
+class StatsUpdatingAdmin(ViewCacheInvalidatingAdmin):
+
+    # Путь от модели к продуктам, чья статистика зависит от её строк
+    product_path: str
+
+    def save_model(self, request, obj, form, change):
+        # Правка может перенести позиции к другому продукту, поэтому пересчитываем и прежние продукты, и новые
+        product_ids = self._get_product_ids([obj.pk]) if change else set()
+        super(StatsUpdatingAdmin, self).save_model(request, obj, form, change)
+        product_repository.update_stats(product_ids | self._get_product_ids([obj.pk]))
+
+    def delete_model(self, request, obj):
+        product_ids = self._get_product_ids([obj.pk])
+        super(StatsUpdatingAdmin, self).delete_model(request, obj)
+        product_repository.update_stats(product_ids)
+
+    def delete_queryset(self, request, queryset):
+        product_ids = self._get_product_ids(queryset.values_list('pk', flat=True))
+        super(StatsUpdatingAdmin, self).delete_queryset(request, queryset)
+        product_repository.update_stats(product_ids)
+
+    def _get_product_ids(self, pks: Iterable[int]) -> Set[int]:
+        return set(self.model.objects
+                   .filter(pk__in=list(pks))
+                   .exclude(**{self.product_path: None})
+                   .values_list(self.product_path, flat=True))
+
+
+@admin.register(ProductAlias)
+class ProductAliasAdmin(StatsUpdatingAdmin):
+
+    product_path = 'product'
+
+    def _invalidate_view_cache(self):
+        super(ProductAliasAdmin, self)._invalidate_view_cache()
+        # Псевдонимы закэшированы вместе с продуктами, поэтому правка любого из них сбрасывает кэш всех продавцов
+        on_commit(product_alias_repository.invalidate_cache)
+
+
+@admin.register(Receipt)
+class ReceiptAdmin(StatsUpdatingAdmin):
+
+    product_path = 'receiptitem__product_alias__product'
+
+
+@admin.register(ReceiptItem)
+class ReceiptItemAdmin(StatsUpdatingAdmin):
+
+    product_path = 'product_alias__product'
 
-from receipt_tracker.models import FoodProduct, NonFoodProduct, Product, ProductAlias, Receipt, ReceiptItem, Seller
-from receipt_tracker.repositories import product_repository
 
-admin.site.register(Seller)
-admin.site.register(ProductAlias)
-admin.site.register(Receipt)
-admin.site.register(ReceiptItem)
+admin.site.register(Seller, ViewCacheInvalidatingAdmin)
+admin.site.register(PendingReceipt)
+admin.site.register(OperatorState)
 
 
 class FoodProductInlineAdmin(admin.StackedInline):
@@ -21,7 +99,7 @@ class NonFoodProductInlineAdmin(admin.StackedInline):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(ViewCacheInvalidatingAdmin):
 
     class ProductModelForm(forms.ModelForm):
         class Meta:
@@ -46,3 +124,11 @@ class ProductAdmin(admin.ModelAdmin):
         if form.cleaned_data['make_non_food']:
             product_repository.set_non_food(obj.id)
         super(ProductAdmin, self).save_model(request, obj, form, change)
+        product_summary_repository.update([obj.id])
+        if 'user_friendly_name' in form.changed_data:
+            on_commit(partial(similar_product_index.add, obj.id, obj.name))
+
+    def save_related(self, request, form, formsets, change):
+        super(ProductAdmin, self).save_related(request, form, formsets, change)
+        receipt_item_repository.update_food_values_by_product_ids([form.instance.id])
+        daily_product_stats_repository.update_by_product_ids([form.instance.id])
@@ -1,10 +1,68 @@
 from datetime import datetime
 
+from django.apps import apps
+from django.core.cache import cache
+from django.db import connection
 from mixer.backend.django import mixer as default_mixer
 from pytest import fixture
 
+from receipt_tracker.lib.retrievers.cached import receipt_cache
+from receipt_tracker.lib.retrievers.guard import MemoryOperatorStateStore, operator_guard
+from receipt_tracker.lib.similar import similar_product_index
 from receipt_tracker.models import FoodProduct, NonFoodProduct, Product, ProductAlias, Receipt, ReceiptItem, Seller, \
     User
+from receipt_tracker.repositories import daily_product_stats_repository, price_stats_repository, \
+    product_alias_repository, receipt_item_repository, seller_price_repository
+
+
+@fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker):
+    # Тестовая база создаётся пустой, и без статистики планы запросов в test_query_plans от запуска к запуску
+    # не меняются. Автоматический ANALYZE посреди прогона их бы переключал
+    with django_db_blocker.unblock(), connection.cursor() as cursor:
+        for model in apps.get_app_config('receipt_tracker').get_models():
+            cursor.execute(f'ALTER TABLE {connection.ops.quote_name(model._meta.db_table)} '
+                           f'SET (autovacuum_enabled = false)')
+
+
+@fixture(autouse=True)
+def similar_product_index_path(mocker, tmp_path):
+    path = str(tmp_path / 'similar_products.pickle')
+    mocker.patch.object(similar_product_index, 'path', path)
+    return path
+
+
+@fixture(autouse=True)
+def receipt_cache_path(mocker, tmp_path):
+    path = str(tmp_path / 'receipts')
+    mocker.patch.object(receipt_cache, 'path', path)
+    return path
+
+
+@fixture(autouse=True)
+def view_cache_backend(settings):
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@fixture(autouse=True)
+def product_alias_cache(view_cache_backend):
+    product_alias_repository.invalidate_cache()
+    yield
+    product_alias_repository.invalidate_cache()
+
+
+@fixture(autouse=True)
+def operator_state_store(mocker):
+    store = MemoryOperatorStateStore()
+    mocker.patch.object(operator_guard, '_store', store)
+    return store
 
 
 @fixture
@@ -78,4 +136,10 @@ def receipt(mixer, seller, user):
 
 @fixture
 def receipt_item(mixer, receipt, product_alias):
-    return mixer.blend(ReceiptItem, receipt=receipt, product_alias=product_alias)
+    receipt_item = mixer.blend(ReceiptItem, receipt=receipt, product_alias=product_alias)
+    receipt_item_repository.update_food_values_by_receipt_ids([receipt.id])
+    daily_product_stats_repository.update_by_buyer_id_and_days(receipt.buyer_id, [receipt.created.date()])
+    price_stats_repository.update_by_product_ids([product_alias.product_id])
+    seller_price_repository.update_by_product_ids([product_alias.product_id])
+    receipt_item.refresh_from_db()
+    return receipt_item
@@ -1,4 +1,4 @@
-from _pydecimal import Decimal
+from decimal import Decimal
 from dataclasses import dataclass
 from datetime import datetime
 
@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from logging import getLogger
+from threading import Lock
+from typing import Dict
+from urllib.parse import urlsplit
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+logger = getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PoolStats:
+
+    requests: int
+    connections: int
+    idle_connections: int
+
+
+class HttpClient:
+
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 30
+    POOL_SIZE = 4
+    MAX_RETRIES = 2
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self):
+        self._sessions: Dict[str, Session] = {}
+        self._requests: Dict[str, int] = {}
+        self._lock = Lock()
+
+    def get(self, url: str, **kwargs) -> Response:
+        host = self._get_host(url)
+        session = self._get_session(host)
+        kwargs.setdefault('timeout', (self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+        with self._lock:
+            self._requests[host] += 1
+        return session.get(url, **kwargs)
+
+    def get_stats(self) -> Dict[str, PoolStats]:
+        stats = {}
+        with self._lock:
+            sessions = dict(self._sessions)
+        for host, session in sessions.items():
+            connections = idle_connections = 0
+            pools = session.get_adapter(host).poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                connections += pool.num_connections
+                idle_connections += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+            stats[host] = PoolStats(self._requests[host], connections, idle_connections)
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions, self._requests = self._sessions, {}, {}
+        for session in sessions.values():
+            session.close()
+
+    def _get_session(self, host: str) -> Session:
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                logger.debug('Opening HTTP session for %s', host)
+                session = self._create_session()
+                self._sessions[host] = session
+                self._requests[host] = 0
+            return session
+
+    def _create_session(self) -> Session:
+        # Зависший ответ не повторяем, иначе медленный оператор задержит нас вдвое
+        retry = Retry(total=self.MAX_RETRIES, read=False, backoff_factor=self.BACKOFF_FACTOR,
+                      status_forcelist=self.RETRY_STATUSES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE, pool_block=True, max_retries=retry)
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _get_host(self, url: str) -> str:
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+
+http_client = HttpClient()
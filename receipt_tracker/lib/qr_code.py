@@ -1,39 +1,80 @@
+import re
 from datetime import datetime
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 from logging import getLogger
-from typing import Callable, List, Optional
+from typing import Dict, Iterable, Iterator, Optional
 
 from receipt_tracker.errors import BadParameter
 from receipt_tracker.lib import ReceiptParams
 
 logger = getLogger(__name__)
 
+FIELDS = frozenset(('fn', 'i', 'fp', 't', 's'))
+DIGITS = re.compile(r'[0-9]+')
+CREATED = re.compile(r'[0-9]{8}T[0-9]{4}')
+
 
 def decode(text: str) -> Optional[ReceiptParams]:
     try:
-        parts = [part.split('=', 1) for part in text.split('&')]
+        fields = _split_fields(text)
         return ReceiptParams(
-            _get_field(parts, 'fn', str, str.isdigit),
-            _get_field(parts, 'i', str, str.isdigit),
-            _get_field(parts, 'fp', str, str.isdigit),
-            _get_field(parts, 't', lambda value: datetime.strptime(value, '%Y%m%dT%H%M')),
-            _get_field(parts, 's', Decimal),
+            _get_digits(fields, 'fn'),
+            _get_digits(fields, 'i'),
+            _get_digits(fields, 'fp'),
+            _get_created(fields, 't'),
+            _get_amount(fields, 's'),
         )
-    except Exception as e:
+    except BadParameter as e:
         logger.warning('Cannot parse QR code: %s', e)
         return None
 
 
-def _get_field(parts: List[List[str]], name: str, mapper: Callable, validator: Optional[Callable] = None):
-    for key, value in parts:
-        if key != name:
-            continue
-        try:
-            mapped = mapper(value)
-            if validator and not validator(mapped):
-                raise Exception('invalid value')
-            return mapped
-        except Exception as e:
-            logger.debug('Cannot parse field %s: %s', name, e)
-            raise BadParameter(f'cannot parse field "{name}"')
-    raise BadParameter(f'no field "{name}" found')
+def decode_many(lines: Iterable[str]) -> Iterator[Optional[ReceiptParams]]:
+    for line in lines:
+        yield decode(line.strip())
+
+
+def _split_fields(text: str) -> Dict[str, str]:
+    # Как и раньше, учитываем только первое вхождение поля
+    fields = {}
+    for part in text.split('&'):
+        name, separator, value = part.partition('=')
+        if not separator:
+            raise BadParameter(f'cannot parse part "{part}"')
+        if name in FIELDS and name not in fields:
+            fields[name] = value
+    return fields
+
+
+def _get_value(fields: Dict[str, str], name: str) -> str:
+    try:
+        return fields[name]
+    except KeyError:
+        raise BadParameter(f'no field "{name}" found')
+
+
+def _get_digits(fields: Dict[str, str], name: str) -> str:
+    value = _get_value(fields, name)
+    if not DIGITS.fullmatch(value):
+        raise BadParameter(f'cannot parse field "{name}"')
+    return value
+
+
+def _get_created(fields: Dict[str, str], name: str) -> datetime:
+    value = _get_value(fields, name)
+    try:
+        # Формат фиксированный (ГГГГММДДTЧЧММ), поэтому режем строку сами вместо strptime
+        if not CREATED.fullmatch(value):
+            raise ValueError('unexpected format')
+        return datetime(int(value[:4]), int(value[4:6]), int(value[6:8]), int(value[9:11]), int(value[11:]))
+    except ValueError as e:
+        logger.debug('Cannot parse field %s: %s', name, e)
+        raise BadParameter(f'cannot parse field "{name}"')
+
+
+def _get_amount(fields: Dict[str, str], name: str) -> Decimal:
+    try:
+        return Decimal(_get_value(fields, name))
+    except InvalidOperation as e:
+        logger.debug('Cannot parse field %s: %s', name, e)
+        raise BadParameter(f'cannot parse field "{name}"')
@@ -1,10 +1,16 @@
+import asyncio
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
-from typing import List, Optional
+from logging import getLogger
+from typing import Iterable, List, Optional, Union
 
 from receipt_tracker.lib import ReceiptParams
+from receipt_tracker.lib.retrievers.limits import HostLimiters, host_limiters, limit_host
+
+logger = getLogger(__name__)
 
 
 @dataclass(frozen=True)
@@ -28,24 +34,117 @@ class ParsedReceiptItem:
     total: Decimal
 
 
+ReceiptResult = Union[ParsedReceipt, None, Exception]
+
+
 class ReceiptRetriever(ABC):
 
+    MAX_CONCURRENCY = 32
+    PER_HOST_CONCURRENCY = 4
+    PER_HOST_INTERVAL = timedelta(milliseconds=100)
+
+    @property
+    def name(self) -> str:
+        return type(self).__name__
+
     @abstractmethod
     def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
         raise NotImplementedError()
 
+    async def get_receipt_async(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_receipt, params)
+
+    def get_receipts(self, params: Iterable[ReceiptParams], concurrency: Optional[int] = None) -> List[ReceiptResult]:
+        concurrency = concurrency or self.MAX_CONCURRENCY
+        # Загрузка и разбор идут в потоках, поэтому пул потоков под стать числу одновременных запросов
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='retriever')
+
+        async def get_receipts():
+            asyncio.get_running_loop().set_default_executor(executor)
+            return await self.get_receipts_async(params, concurrency)
+
+        try:
+            return asyncio.run(get_receipts())
+        finally:
+            executor.shutdown()
+
+    async def get_receipts_async(self, params: Iterable[ReceiptParams],
+                                 concurrency: Optional[int] = None) -> List[ReceiptResult]:
+        semaphore = asyncio.Semaphore(concurrency or self.MAX_CONCURRENCY)
+
+        async def get_receipt(receipt_params: ReceiptParams) -> ReceiptResult:
+            async with semaphore:
+                try:
+                    return await self.get_receipt_async(receipt_params)
+                except Exception as e:
+                    logger.warning('Cannot retrieve receipt %s: %s', receipt_params, e)
+                    return e
+
+        token = None
+        if host_limiters.get() is None:
+            token = host_limiters.set(HostLimiters(self.PER_HOST_CONCURRENCY, self.PER_HOST_INTERVAL))
+        try:
+            return list(await asyncio.gather(*map(get_receipt, params)))
+        finally:
+            if token is not None:
+                host_limiters.reset(token)
+
+
+class OperatorReceiptRetriever(ReceiptRetriever):
+
+    HOST: str
+
+    def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        return self.parse(self.download(params))
+
+    async def get_receipt_async(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        payload = await self.download_async(params)
+        return await asyncio.get_running_loop().run_in_executor(None, self.parse, payload)
+
+    async def download_async(self, params: ReceiptParams) -> bytes:
+        async with limit_host(self.HOST):
+            return await asyncio.get_running_loop().run_in_executor(None, self.download, params)
+
+    @abstractmethod
+    def download(self, params: ReceiptParams) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def parse(self, payload: bytes) -> Optional[ParsedReceipt]:
+        raise NotImplementedError()
+
 
 class BadResponse(Exception):
+
+    def __init__(self, message: str = '', status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ReceiptNotReady(Exception):
     pass
 
 
+class OperatorUnavailable(Exception):
+
+    def __init__(self, message: str, retry_after: timedelta):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 def get_receipt_retriever() -> ReceiptRetriever:
-    from receipt_tracker.lib.retrievers.nalog_ru import NalogRuReceiptRetriever
-    return NalogRuReceiptRetriever()
+    from receipt_tracker.lib.retrievers.cached import CachedReceiptRetriever
+    from receipt_tracker.lib.retrievers.combined import CombinedReceiptRetriever
+    retrievers = [CachedReceiptRetriever(retriever) for retriever in get_available_receipt_retrievers()]
+    return CombinedReceiptRetriever(retrievers, concurrent=True)
 
 
 def get_available_receipt_retrievers() -> List[ReceiptRetriever]:
     from receipt_tracker.lib.retrievers.nalog_ru import NalogRuReceiptRetriever
+    from receipt_tracker.lib.retrievers.platforma_ofd import PlatformaOfdOperatorReceiptRetriever
+    from receipt_tracker.lib.retrievers.taxcom import TaxcomOperatorReceiptRetriever
     return [
         NalogRuReceiptRetriever(),
+        TaxcomOperatorReceiptRetriever(),
+        PlatformaOfdOperatorReceiptRetriever(),
     ]
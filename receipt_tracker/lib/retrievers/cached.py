@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import os
+import pickle
+import zlib
+from dataclasses import dataclass
+from datetime import timedelta
+from logging import getLogger
+from tempfile import NamedTemporaryFile
+from time import time
+from typing import Callable, Optional, Tuple
+
+from django.conf import settings
+
+from receipt_tracker.lib import ReceiptParams
+from receipt_tracker.lib.retrievers import OperatorReceiptRetriever, ParsedReceipt, ReceiptRetriever
+
+logger = getLogger(__name__)
+
+ReceiptKey = Tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class CacheEntry:
+
+    created: float
+    payload: Optional[bytes]
+    receipt: Optional[ParsedReceipt]
+
+
+class ReceiptCache:
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def get(self, namespace: str, key: ReceiptKey) -> Optional[CacheEntry]:
+        return self._read(self._get_file_path(namespace, key))
+
+    def set(self, namespace: str, key: ReceiptKey, entry: CacheEntry):
+        file_path = self._get_file_path(namespace, key)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with NamedTemporaryFile('wb', dir=os.path.dirname(file_path), delete=False) as f:
+            f.write(zlib.compress(pickle.dumps(entry)))
+        os.replace(f.name, file_path)
+
+    def delete(self, namespace: str, key: ReceiptKey):
+        self._delete(self._get_file_path(namespace, key))
+
+    def purge(self, is_expired: Callable[[CacheEntry], bool]) -> int:
+        count = 0
+        for dir_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if not file_name.endswith('.gz'):
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                entry = self._read(file_path)
+                if entry is None or is_expired(entry):
+                    self._delete(file_path)
+                    count += 1
+        return count
+
+    def _read(self, file_path: str) -> Optional[CacheEntry]:
+        try:
+            with open(file_path, 'rb') as f:
+                return pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return None
+        except (zlib.error, pickle.UnpicklingError, EOFError) as e:
+            logger.warning('Cannot read cached receipt %s: %s', file_path, e)
+            return None
+
+    def _delete(self, file_path: str):
+        # Запись могли удалить параллельно, например при чтении устаревшего чека
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+    def _get_file_path(self, namespace: str, key: ReceiptKey) -> str:
+        name = hashlib.sha1('\0'.join(key).encode()).hexdigest()
+        return os.path.join(self.path, namespace, name[:2], f'{name}.gz')
+
+
+class CachedReceiptRetriever(ReceiptRetriever):
+
+    TTL = timedelta(days=30)
+    # Оператор может получить чек позже, поэтому отрицательный ответ храним недолго
+    NEGATIVE_TTL = timedelta(hours=1)
+
+    def __init__(self, retriever: ReceiptRetriever, cache: Optional[ReceiptCache] = None):
+        self._retriever = retriever
+        self._cache = cache or receipt_cache
+        self._namespace = retriever.name
+
+    def __str__(self):
+        return f'CachedReceiptRetriever({self._namespace})'
+
+    @property
+    def name(self) -> str:
+        return self._retriever.name
+
+    def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        key = self._get_key(params)
+        entry = self._get_fresh_entry(key)
+        if entry:
+            return entry.receipt
+
+        if isinstance(self._retriever, OperatorReceiptRetriever):
+            payload = self._retriever.download(params)
+            receipt = self._retriever.parse(payload)
+        else:
+            payload = None
+            receipt = self._retriever.get_receipt(params)
+        self._cache.set(self._namespace, key, CacheEntry(time(), payload, receipt))
+        return receipt
+
+    async def get_receipt_async(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        loop = asyncio.get_running_loop()
+        key = self._get_key(params)
+        entry = await loop.run_in_executor(None, self._get_fresh_entry, key)
+        if entry:
+            return entry.receipt
+
+        if isinstance(self._retriever, OperatorReceiptRetriever):
+            payload = await self._retriever.download_async(params)
+            receipt = await loop.run_in_executor(None, self._retriever.parse, payload)
+        else:
+            payload = None
+            receipt = await self._retriever.get_receipt_async(params)
+        await loop.run_in_executor(None, self._cache.set, self._namespace, key, CacheEntry(time(), payload, receipt))
+        return receipt
+
+    def _get_key(self, params: ReceiptParams) -> ReceiptKey:
+        return params.fiscal_drive_number, params.fiscal_document_number, params.fiscal_sign
+
+    @classmethod
+    def is_expired(cls, entry: CacheEntry) -> bool:
+        ttl = cls.TTL if entry.receipt else cls.NEGATIVE_TTL
+        return time() - entry.created > ttl.total_seconds()
+
+    def _get_fresh_entry(self, key: ReceiptKey) -> Optional[CacheEntry]:
+        entry = self._cache.get(self._namespace, key)
+        if entry is None:
+            return None
+        if self.is_expired(entry):
+            self._cache.delete(self._namespace, key)
+            return None
+        logger.debug('Receipt %s found in %s cache', key, self._namespace)
+        return entry
+
+
+receipt_cache = ReceiptCache(settings.RECEIPT_CACHE_PATH)
@@ -1,25 +1,200 @@
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial
+from http import HTTPStatus
 from logging import getLogger
-from typing import List, Optional
+from time import monotonic
+from typing import Callable, Dict, Iterable, List, Optional, Union
+
+from requests import RequestException
 
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import ParsedReceipt, ReceiptRetriever
+from receipt_tracker.lib.retrievers import BadResponse, OperatorUnavailable, ParsedReceipt, ReceiptNotReady, \
+    ReceiptResult, ReceiptRetriever
+from receipt_tracker.lib.retrievers.guard import operator_guard
 
 logger = getLogger(__name__)
 
+AnyFuture = Union[Future, asyncio.Future]
+
+# При пакетной загрузке операторов не пропускаем, а ждём, пока у них освободятся токены
+is_waiting_for_operators: 'ContextVar[bool]' = ContextVar('is_waiting_for_operators', default=False)
+
 
 class CombinedReceiptRetriever(ReceiptRetriever):
 
-    def __init__(self, retrievers: List[ReceiptRetriever]):
+    TIMEOUT = timedelta(seconds=30)
+    # Дольше не ждём: оператор, скорее всего, отключён после серии ошибок
+    MAX_OPERATOR_WAIT = timedelta(minutes=1)
+
+    def __init__(self, retrievers: List[ReceiptRetriever], concurrent: bool = False,
+                 timeout: Optional[timedelta] = None):
+        # Порядок ретриверов задаёт приоритет: при одновременном ответе выигрывает тот, что стоит раньше
         self._retrievers = retrievers
+        self._concurrent = concurrent
+        self._timeout = timeout or self.TIMEOUT
 
     def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        if self._concurrent:
+            return self._get_receipt_concurrently(params)
+        attempt = _Attempt()
+        for retriever in self._retrievers:
+            if not self._acquire(retriever, attempt):
+                continue
+            data = self._get_result(retriever, attempt, partial(retriever.get_receipt, params))
+            if data:
+                return data
+        return self._get_nothing(attempt)
+
+    async def get_receipt_async(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        if self._concurrent:
+            return await self._get_receipt_concurrently_async(params)
+        attempt = _Attempt()
         for retriever in self._retrievers:
+            if not await self._acquire_async(retriever, attempt):
+                continue
+            task = asyncio.ensure_future(retriever.get_receipt_async(params))
             try:
-                logger.debug('Retrieving receipt via %s', retriever)
-                data = retriever.get_receipt(params)
+                await asyncio.wait({task})
+            finally:
+                task.cancel()
+            data = self._get_result(retriever, attempt, task.result)
+            if data:
+                return data
+        return self._get_nothing(attempt)
+
+    async def get_receipts_async(self, params: Iterable[ReceiptParams],
+                                 concurrency: Optional[int] = None) -> List[ReceiptResult]:
+        token = is_waiting_for_operators.set(True)
+        try:
+            return await super().get_receipts_async(params, concurrency)
+        finally:
+            is_waiting_for_operators.reset(token)
+
+    def _get_receipt_concurrently(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        attempt = _Attempt()
+        retrievers = [retriever for retriever in self._retrievers if self._acquire(retriever, attempt)]
+        if not retrievers:
+            return self._get_nothing(attempt)
+        executor = ThreadPoolExecutor(max_workers=len(retrievers), thread_name_prefix='retriever')
+        futures: Dict[Future, ReceiptRetriever] = {executor.submit(retriever.get_receipt, params): retriever
+                                                   for retriever in retrievers}
+        try:
+            deadline = monotonic() + self._timeout.total_seconds()
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=max(deadline - monotonic(), 0), return_when=FIRST_COMPLETED)
+                if not done:
+                    self._record_timeout(pending, futures)
+                    break
+                data = self._get_first_found(done, futures, attempt)
+                if data:
+                    return data
+            return self._get_nothing(attempt)
+        finally:
+            # Запросы, которые уже выполняются, прервать нельзя, поэтому просто не ждём их
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    async def _get_receipt_concurrently_async(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+        attempt = _Attempt()
+        is_acquired = await asyncio.gather(*(self._acquire_async(retriever, attempt) for retriever in self._retrievers))
+        tasks: Dict[asyncio.Future, ReceiptRetriever] = {
+            asyncio.ensure_future(retriever.get_receipt_async(params)): retriever
+            for retriever, is_retriever_acquired in zip(self._retrievers, is_acquired) if is_retriever_acquired}
+        try:
+            deadline = monotonic() + self._timeout.total_seconds()
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(deadline - monotonic(), 0),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self._record_timeout(pending, tasks)
+                    break
+                data = self._get_first_found(done, tasks, attempt)
                 if data:
-                    logger.debug('Receipt found via %s', retriever)
                     return data
-            except Exception as e:
-                logger.warning('Cannot retrieve receipt: %s', e)
+            return self._get_nothing(attempt)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _acquire(self, retriever: ReceiptRetriever, attempt: '_Attempt') -> bool:
+        # Состояние операторов меняем только в вызывающем потоке, чтобы не плодить соединения с базой
+        return self._start(retriever, attempt, operator_guard.acquire(retriever.name))
+
+    async def _acquire_async(self, retriever: ReceiptRetriever, attempt: '_Attempt') -> bool:
+        retry_after = operator_guard.acquire(retriever.name)
+        while retry_after is not None and is_waiting_for_operators.get() and retry_after <= self.MAX_OPERATOR_WAIT:
+            logger.debug('Waiting %s for %s', retry_after, retriever)
+            await asyncio.sleep(retry_after.total_seconds())
+            retry_after = operator_guard.acquire(retriever.name)
+        return self._start(retriever, attempt, retry_after)
+
+    def _start(self, retriever: ReceiptRetriever, attempt: '_Attempt', retry_after: Optional[timedelta]) -> bool:
+        if retry_after is not None:
+            logger.info('Skipping %s, it is unavailable for %s', retriever, retry_after)
+            attempt.retry_after = min(retry_after, attempt.retry_after or retry_after)
+            return False
+        logger.debug('Retrieving receipt via %s', retriever)
+        attempt.is_started = True
+        return True
+
+    def _get_first_found(self, done: Iterable[AnyFuture], retrievers: Dict[AnyFuture, ReceiptRetriever],
+                         attempt: '_Attempt') -> Optional[ParsedReceipt]:
+        order = list(retrievers)
+        found = None
+        for future in sorted(done, key=order.index):
+            data = self._get_result(retrievers[future], attempt, future.result)
+            found = found or data
+        return found
+
+    def _get_result(self, retriever: ReceiptRetriever, attempt: '_Attempt',
+                    get_data: Callable[[], Optional[ParsedReceipt]]) -> Optional[ParsedReceipt]:
+        try:
+            data = get_data()
+        except ReceiptNotReady as e:
+            logger.debug('Receipt is not ready via %s: %s', retriever, e)
+            operator_guard.record_success(retriever.name)
+            attempt.is_pending = True
+            return None
+        except Exception as e:
+            logger.warning('Cannot retrieve receipt via %s: %s', retriever, e)
+            if self._is_operator_failure(e):
+                operator_guard.record_failure(retriever.name)
+            else:
+                operator_guard.record_success(retriever.name)
+            return None
+        operator_guard.record_success(retriever.name)
+        if data:
+            logger.debug('Receipt found via %s', retriever)
+        return data
+
+    def _is_operator_failure(self, e: Exception) -> bool:
+        # Ответы 4xx и ошибки разбора относятся к конкретному чеку: оператор при этом работает, и отключать его нельзя
+        if isinstance(e, BadResponse):
+            return e.status_code is None or e.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+        return isinstance(e, (RequestException, TimeoutError))
+
+    def _record_timeout(self, pending: Iterable[AnyFuture], retrievers: Dict[AnyFuture, ReceiptRetriever]):
+        for future in pending:
+            logger.warning('%s did not respond in %s', retrievers[future], self._timeout)
+            operator_guard.record_failure(retrievers[future].name)
+
+    def _get_nothing(self, attempt: '_Attempt') -> None:
+        if attempt.is_pending:
+            raise ReceiptNotReady('receipt is not ready yet at any of operators')
+        if not attempt.is_started and attempt.retry_after is not None:
+            raise OperatorUnavailable('all operators are unavailable', attempt.retry_after)
         return None
+
+
+class _Attempt:
+
+    def __init__(self):
+        self.is_started = False
+        self.is_pending = False
+        self.retry_after: Optional[timedelta] = None
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+from logging import getLogger
+from threading import Lock
+from typing import Callable, Dict, Optional, TypeVar
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.transaction import atomic
+
+from receipt_tracker.models import OperatorState
+from receipt_tracker.repositories import operator_state_repository
+
+logger = getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class MemoryOperatorStateStore:
+
+    def __init__(self):
+        self._states: Dict[str, OperatorState] = {}
+        self._lock = Lock()
+
+    def update(self, name: str, func: Callable[[OperatorState], T]) -> T:
+        with self._lock:
+            state = self._states.get(name)
+            if state is None:
+                state = self._states[name] = OperatorState(name=name)
+            return func(state)
+
+
+class DatabaseOperatorStateStore:
+
+    def __init__(self, fallback: Optional[MemoryOperatorStateStore] = None):
+        self._fallback = fallback or MemoryOperatorStateStore()
+
+    def update(self, name: str, func: Callable[[OperatorState], T]) -> T:
+        try:
+            with atomic():
+                state = operator_state_repository.get_for_update(name)
+                result = func(state)
+                state.save()
+                return result
+        except DatabaseError as e:
+            # Без базы ограничиваем хотя бы в пределах процесса
+            logger.warning('Cannot update operator %s state in database, using memory: %s', name, e)
+            return self._fallback.update(name, func)
+
+
+class OperatorGuard:
+
+    # Токены на запрос к оператору: в среднем RATE в секунду, но не больше BURST подряд
+    RATE = 1.0
+    BURST = 10
+    FAILURE_THRESHOLD = 5
+    OPEN_DURATION = timedelta(minutes=10)
+
+    def __init__(self, store):
+        self._store = store
+
+    def acquire(self, name: str) -> Optional[timedelta]:
+        return self._store.update(name, self._acquire)
+
+    def record_success(self, name: str):
+        self._store.update(name, self._record_success)
+
+    def record_failure(self, name: str):
+        self._store.update(name, self._record_failure)
+
+    def _acquire(self, state: OperatorState) -> Optional[timedelta]:
+        now = datetime.utcnow()
+        if state.opened_until and state.opened_until > now:
+            return state.opened_until - now
+        tokens = self.BURST if state.tokens is None else state.tokens
+        if state.tokens_updated:
+            tokens = min(self.BURST, tokens + (now - state.tokens_updated).total_seconds() * self.RATE)
+        state.tokens_updated = now
+        if tokens < 1:
+            state.tokens = tokens
+            return timedelta(seconds=(1 - tokens) / self.RATE)
+        state.tokens = tokens - 1
+        return None
+
+    def _record_success(self, state: OperatorState):
+        state.failures = 0
+        state.opened_until = None
+
+    def _record_failure(self, state: OperatorState):
+        state.failures += 1
+        # После паузы пропускаем пробный запрос, и его неудача снова размыкает цепь
+        if state.failures >= self.FAILURE_THRESHOLD:
+            logger.warning('Operator %s failed %s times in a row, pausing it for %s', state.name, state.failures,
+                           self.OPEN_DURATION)
+            state.opened_until = datetime.utcnow() + self.OPEN_DURATION
+
+
+def _get_operator_state_store():
+    if settings.OPERATOR_STATE_BACKEND == 'memory':
+        return MemoryOperatorStateStore()
+    return DatabaseOperatorStateStore()
+
+
+operator_guard = OperatorGuard(_get_operator_state_store())
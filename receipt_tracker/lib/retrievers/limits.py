@@ -0,0 +1,53 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from time import monotonic
+from typing import Dict, Optional
+
+
+class HostLimiter:
+
+    def __init__(self, concurrency: int, interval: timedelta):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._interval = interval.total_seconds()
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._semaphore:
+            async with self._lock:
+                delay = self._next_start - monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._next_start = monotonic() + self._interval
+            yield
+
+
+class HostLimiters:
+
+    def __init__(self, concurrency: int, interval: timedelta):
+        self._concurrency = concurrency
+        self._interval = interval
+        self._limiters: Dict[str, HostLimiter] = {}
+
+    def get(self, host: str) -> HostLimiter:
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = self._limiters[host] = HostLimiter(self._concurrency, self._interval)
+        return limiter
+
+
+# Лимиты привязаны к циклу событий, поэтому живут в контексте пакетной загрузки, а не в модуле
+host_limiters: 'ContextVar[Optional[HostLimiters]]' = ContextVar('host_limiters', default=None)
+
+
+@asynccontextmanager
+async def limit_host(host: str):
+    limiters = host_limiters.get()
+    if limiters is None:
+        yield
+        return
+    async with limiters.get(host).acquire():
+        yield
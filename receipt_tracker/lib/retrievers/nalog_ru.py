@@ -1,31 +1,31 @@
-import time
-from datetime import datetime, timedelta
+import json
+from datetime import datetime
 from decimal import Decimal
 from http import HTTPStatus
 from logging import getLogger
 from typing import Optional
 
-import requests
 from django.conf import settings
 from requests import Response
 
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import BadResponse, ParsedReceipt, ParsedReceiptItem, ReceiptRetriever
+from receipt_tracker.lib.http_client import http_client
+from receipt_tracker.lib.retrievers import BadResponse, OperatorReceiptRetriever, ParsedReceipt, ParsedReceiptItem, \
+    ReceiptNotReady
 
 logger = getLogger(__name__)
 
 
-class NalogRuReceiptRetriever(ReceiptRetriever):
+class NalogRuReceiptRetriever(OperatorReceiptRetriever):
 
-    MAX_TRIES = 3
-    RETRY_DELAY = timedelta(seconds=5)
+    HOST = 'proverkacheka.nalog.ru:9999'
 
-    def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+    def download(self, params: ReceiptParams) -> bytes:
         self._check_if_receipt_exists(params)
         return self._get_receipt(params)
 
     def _make_request(self, url: str) -> Response:
-        return requests.get(
+        return http_client.get(
             url,
             auth=(settings.CHECKER_LOGIN, settings.CHECKER_PASSWORD),
             headers={
@@ -36,7 +36,7 @@ class NalogRuReceiptRetriever(ReceiptRetriever):
     def _check_if_receipt_exists(self, params: ReceiptParams):
         logger.debug('Checking if receipt exists')
         url = (
-            f'https://proverkacheka.nalog.ru:9999/v1/ofds/*/inns/*/fss/{params.fiscal_drive_number}/operations'
+            f'https://{self.HOST}/v1/ofds/*/inns/*/fss/{params.fiscal_drive_number}/operations'
             f'/1/tickets/{params.fiscal_document_number}?fiscalSign={params.fiscal_sign}'
             f'&date={params.created.strftime("%Y-%m-%dT%H:%M:%S")}&sum={(params.amount * 100).quantize(Decimal(1))}'
         )
@@ -44,31 +44,32 @@ class NalogRuReceiptRetriever(ReceiptRetriever):
         response = self._make_request(url)
 
         if response.status_code != HTTPStatus.NO_CONTENT:
-            raise BadResponse(f'cannot check receipt, server response was {response.status_code} ({response.text})')
+            raise BadResponse(f'cannot check receipt, server response was {response.status_code} ({response.text})',
+                              response.status_code)
 
         logger.debug('It looks like receipt does exist')
 
-    def _get_receipt(self, params: ReceiptParams, try_number: int = 1) -> Optional[ParsedReceipt]:
+    def _get_receipt(self, params: ReceiptParams) -> bytes:
         logger.debug('Retrieving receipt JSON')
         url = (
-            f'https://proverkacheka.nalog.ru:9999/v1/inns/*/kkts/*/fss/{params.fiscal_drive_number}/tickets'
+            f'https://{self.HOST}/v1/inns/*/kkts/*/fss/{params.fiscal_drive_number}/tickets'
             f'/{params.fiscal_document_number}?fiscalSign={params.fiscal_sign}&sendToEmail=no'
         )
         logger.debug('Downloading receipt from %s', url)
         response = self._make_request(url)
 
         if response.status_code == HTTPStatus.ACCEPTED:
-            if try_number == self.MAX_TRIES:
-                raise BadResponse(f'no result after {try_number} tries')
-            else:
-                logger.debug('Server response was %s, retrying in several seconds', response.status_code)
-                time.sleep(self.RETRY_DELAY.total_seconds())
-                return self._get_receipt(params, try_number + 1)
+            # Сервер ещё готовит чек, повторный запрос делает вызывающий код, а не спящий поток
+            raise ReceiptNotReady(f'receipt is not ready yet, server response was {response.status_code}')
 
         if response.status_code != HTTPStatus.OK:
-            raise BadResponse(f'cannot get receipt, server response was {response.status_code} ({response.text})')
+            raise BadResponse(f'cannot get receipt, server response was {response.status_code} ({response.text})',
+                              response.status_code)
 
-        receipt = response.json()['document']['receipt']
+        return response.content
+
+    def parse(self, payload: bytes) -> Optional[ParsedReceipt]:
+        receipt = json.loads(payload)['document']['receipt']
         return ParsedReceipt(
             str(receipt['fiscalDriveNumber']),
             str(receipt['fiscalDocumentNumber']),
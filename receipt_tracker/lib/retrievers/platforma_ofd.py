@@ -4,55 +4,64 @@ from http import HTTPStatus
 from logging import getLogger
 from typing import List, Optional
 
-import requests
 from lxml import etree
 
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import BadResponse, ParsedReceipt, ParsedReceiptItem, ReceiptRetriever
+from receipt_tracker.lib.http_client import http_client
+from receipt_tracker.lib.retrievers import BadResponse, OperatorReceiptRetriever, ParsedReceipt, ParsedReceiptItem
 
 logger = getLogger(__name__)
 
 
-class PlatformaOfdOperatorReceiptRetriever(ReceiptRetriever):
+class PlatformaOfdOperatorReceiptRetriever(OperatorReceiptRetriever):
 
-    def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
-        url = f'https://lk.platformaofd.ru/web/noauth/cheque?fn={params.fiscal_drive_number}&fp={params.fiscal_sign}'
+    HOST = 'lk.platformaofd.ru'
+
+    def download(self, params: ReceiptParams) -> bytes:
+        url = f'https://{self.HOST}/web/noauth/cheque?fn={params.fiscal_drive_number}&fp={params.fiscal_sign}'
         logger.debug('Downloading receipt from %s', url)
-        response = requests.get(url)
+        response = http_client.get(url)
         if response.status_code != HTTPStatus.OK:
-            raise BadResponse(f'server response was {response.status_code} ({response.content})')
-        return Parser().parse(response.content)
+            raise BadResponse(f'server response was {response.status_code} ({response.content})', response.status_code)
+        return response.content
+
+    def parse(self, payload: bytes) -> Optional[ParsedReceipt]:
+        return Parser().parse(payload)
 
 
 class Parser:
 
+    DOWNLOAD_ICON = etree.XPath('//i[contains(@class, "ofdicon-download")]')
+    LABEL_VALUE = etree.XPath('ancestor::div[@class="check-row"][1]/div[contains(@class, "check-col-right")]')
+    ITEM_STRINGS = etree.XPath('.//div[contains(@class, "check-product-name") or contains(@class, "check-col")]'
+                               '/text()')
+    ITEM_NAME = etree.XPath('.//div[@class="check-product-name"]')
+    ITEM_VALUES = etree.XPath('.//div[contains(@class, "check-col-right")]')
+
     def parse(self, html: str) -> Optional[ParsedReceipt]:
         tree = etree.XML(html, etree.HTMLParser())
-        if not tree.xpath('//i[contains(@class, "ofdicon-download")]'):
+        if not self.DOWNLOAD_ICON(tree):
             return None
+        document = _Document(tree)
         return ParsedReceipt(
-            self._get_second_column_text(tree, 'N ФН'),
-            self._get_second_column_text(tree, 'N ФД'),
-            self._get_second_column_text(tree, 'ФП'),
-            tree.xpath('//div[@class="check-top"]/div')[0].text,
-            tree.xpath('//div[@class="check-top"]/div')[2].text[4:],
-            self._get_created(tree),
-            list(self._get_items(tree) if self._has_barcodes(tree) else self._get_items_with_no_barcodes(tree)),
+            self._get_second_column_text(document, 'N ФН'),
+            self._get_second_column_text(document, 'N ФД'),
+            self._get_second_column_text(document, 'ФП'),
+            document.seller[0].text,
+            document.seller[2].text[4:],
+            self._get_created(document),
+            list(self._get_items(document) if self._has_barcodes(document)
+                 else self._get_items_with_no_barcodes(document)),
         )
 
-    def _get_created(self, tree) -> datetime:
-        return datetime.strptime(self._get_second_column_text(tree, 'Приход'), '%d.%m.%Y %H:%M')
+    def _get_created(self, document: '_Document') -> datetime:
+        return datetime.strptime(self._get_second_column_text(document, 'Приход'), '%d.%m.%Y %H:%M')
 
-    def _has_barcodes(self, tree) -> bool:
-        return tree.xpath('//div[text()="штриховой код EAN13"]')
+    def _has_barcodes(self, document: '_Document') -> bool:
+        return 'штриховой код EAN13' in document.labels
 
-    def _get_items(self, tree) -> List[ParsedReceiptItem]:
-        strings = tree.xpath('''
-            //div[@class='check-product-name']
-            /ancestor::div[@class='check-section']
-            //div[contains(@class, 'check-product-name') or contains(@class, 'check-col')]
-            /text()
-        ''')
+    def _get_items(self, document: '_Document') -> List[ParsedReceiptItem]:
+        strings = [string for section in document.item_sections for string in self.ITEM_STRINGS(section)]
         for i in range(0, len(strings), 8):
             yield ParsedReceiptItem(
                 strings[i].strip(),
@@ -61,21 +70,39 @@ class Parser:
                 Decimal(strings[i + 7]),
             )
 
-    def _get_items_with_no_barcodes(self, tree) -> List[ParsedReceiptItem]:
-        sections = tree.xpath('''
-            //div[@class='check-product-name']
-            /ancestor::div[@class='check-section']
-        ''')
-        for section in sections:
-            name = section.xpath('.//div[@class="check-product-name"]')[0].text.strip()
-            nodes = section.xpath('.//div[contains(@class, "check-col-right")]')
+    def _get_items_with_no_barcodes(self, document: '_Document') -> List[ParsedReceiptItem]:
+        for section in document.item_sections:
+            name = self.ITEM_NAME(section)[0].text.strip()
+            nodes = self.ITEM_VALUES(section)
             quantity, price = nodes[0].text.split(' х ')
             total = nodes[-1].text
             yield ParsedReceiptItem(name, Decimal(quantity), Decimal(price), Decimal(total))
 
-    def _get_second_column_text(self, tree, first_column_text: str) -> str:
-        return tree.xpath(f'''
-            //div[text()="{first_column_text}"]
-            /ancestor::div[@class="check-row"][1]
-            /div[contains(@class, "check-col-right")]
-        ''')[0].text
+    def _get_second_column_text(self, document: '_Document', first_column_text: str) -> str:
+        return self.LABEL_VALUE(document.labels[first_column_text])[0].text
+
+
+class _Document:
+
+    LABELS = {'N ФН', 'N ФД', 'ФП', 'Приход', 'штриховой код EAN13'}
+
+    # Один проход по дереву вместо поиска по всему документу для каждого поля
+    def __init__(self, tree):
+        self.seller = []
+        self.labels = {}
+        self.item_sections = []
+        for node in tree.iter('div'):
+            classes = node.get('class')
+            if classes == 'check-top' and not self.seller:
+                self.seller = list(node.iterchildren('div'))
+            elif classes == 'check-product-name':
+                self._add_item_section(node)
+            elif node.text in self.LABELS:
+                self.labels.setdefault(node.text, node)
+
+    def _add_item_section(self, node):
+        for section in node.iterancestors('div'):
+            if section.get('class') == 'check-section':
+                if section not in self.item_sections:
+                    self.item_sections.append(section)
+                return
@@ -3,57 +3,110 @@ from decimal import Decimal
 from http import HTTPStatus
 from typing import List, Optional, Union
 
-import requests
 from lxml import etree
 
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import BadResponse, ParsedReceipt, ParsedReceiptItem, ReceiptRetriever
+from receipt_tracker.lib.http_client import http_client
+from receipt_tracker.lib.retrievers import BadResponse, OperatorReceiptRetriever, ParsedReceipt, ParsedReceiptItem
 
 
-class TaxcomOperatorReceiptRetriever(ReceiptRetriever):
+class TaxcomOperatorReceiptRetriever(OperatorReceiptRetriever):
 
-    def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
-        response = requests.get(f'http://receipt.taxcom.ru/v01/show?fp={params.fiscal_sign}&s={params.amount}')
+    HOST = 'receipt.taxcom.ru'
+
+    def download(self, params: ReceiptParams) -> bytes:
+        response = http_client.get(f'http://{self.HOST}/v01/show?fp={params.fiscal_sign}&s={params.amount}')
         if response.status_code != HTTPStatus.OK:
-            raise BadResponse(f'server response was {response.status_code} ({response.content})')
-        return Parser().parse(response.content)
+            raise BadResponse(f'server response was {response.status_code} ({response.content})', response.status_code)
+        return response.content
+
+    def parse(self, payload: bytes) -> Optional[ParsedReceipt]:
+        return Parser().parse(payload)
 
 
 class Parser:
 
+    TITLE = etree.XPath('//h1[@id="receipt_title"]')
+
     def parse(self, html) -> Optional[ParsedReceipt]:
         tree = etree.XML(html, etree.HTMLParser())
-        if not tree.xpath('//h1[@id="receipt_title"]'):
+        if not self.TITLE(tree):
             return None
-        parser = self._get_parser(tree)
+        document = _Document(tree)
+        parser = self._get_parser(document)
         return ParsedReceipt(
-            parser.get_second_column_text(tree, 'Зав.№ ФН'),
-            parser.get_second_column_text(tree, '№ ФД'),
-            parser.get_second_column_text(tree, 'ФПД'),
-            parser.get_seller_name(tree),
-            parser.get_seller_individual_number(tree),
-            parser.get_created(tree),
-            list(parser.get_items(tree))
+            parser.get_second_column_text(document, 'Зав.№ ФН'),
+            parser.get_second_column_text(document, '№ ФД'),
+            parser.get_second_column_text(document, 'ФПД'),
+            parser.get_seller_name(document),
+            parser.get_seller_individual_number(document),
+            parser.get_created(document),
+            list(parser.get_items(document))
         )
 
-    def _get_parser(self, tree) -> Union['ParserV1', 'ParserV2']:
-        return ParserV1() if tree.xpath('//td[text()="№ смены"]') else ParserV2()
+    def _get_parser(self, document: '_Document') -> Union['ParserV1', 'ParserV2']:
+        return ParserV1() if '№ смены' in document.cell_labels else ParserV2()
+
+
+class _Document:
+
+    CELL_LABELS = {'Зав.№ ФН', '№ ФД', 'ФПД', '№ смены'}
+    SPAN_LABELS = {'Зав.№ ФН', '№ ФД', 'ФПД', 'Приход'}
+    ITEM_STRINGS = etree.XPath('.//span/text()')
+
+    # Один проход по дереву вместо поиска по всему документу для каждого поля
+    def __init__(self, tree):
+        self.report_spans = []
+        self.cell_labels = {}
+        self.span_labels = {}
+        self.item_tables = []
+        report_divs = []
+        for node in tree.iter('div', 'td', 'span', 'table'):
+            if node.tag == 'div':
+                # Вложенные блоки уже обойдены вместе с внешним, иначе их узлы попали бы в список дважды
+                if node.get('class') == 'receipt_report' and not self._is_nested(node, report_divs):
+                    report_divs.append(node)
+                    self.report_spans.extend(node.iter('span'))
+            elif node.tag == 'table':
+                if node.get('class') == 'verticalBlock' and not self._is_nested(node, self.item_tables):
+                    self.item_tables.append(node)
+            elif node.text in self.CELL_LABELS and node.tag == 'td':
+                self.cell_labels.setdefault(node.text, []).append(node)
+            elif node.text in self.SPAN_LABELS and node.tag == 'span':
+                self.span_labels.setdefault(node.text, []).append(node)
+
+    def get_item_strings(self) -> List[str]:
+        return [string for table in self.item_tables for string in self.ITEM_STRINGS(table)]
+
+    def find(self, path: etree.XPath, anchors: List) -> Optional[etree._Element]:
+        # Как и [0] у исходного XPath по всему документу: первый найденный узел среди всех меток
+        for anchor in anchors:
+            nodes = path(anchor)
+            if nodes:
+                return nodes[0]
+        return None
+
+    def _is_nested(self, node, containers: List) -> bool:
+        return any(ancestor in containers for ancestor in node.iterancestors(node.tag))
 
 
 class ParserV1:
 
-    def get_seller_name(self, tree) -> str:
-        return tree.xpath('(//div[@class="receipt_report"]//span)[1]')[0].text.strip()
+    CREATED = etree.XPath('parent::td/following-sibling::td[1]//span[2]')
+    SECOND_COLUMN = etree.XPath('following-sibling::td[1]/span')
 
-    def get_seller_individual_number(self, tree) -> str:
-        return tree.xpath('(//div[@class="receipt_report"]//span)[2]')[0].text.strip()
+    def get_seller_name(self, document: _Document) -> str:
+        return document.report_spans[0].text.strip()
 
-    def get_created(self, tree) -> datetime:
-        value = tree.xpath('//span[text()="Приход"]/parent::td/following-sibling::td[1]//span[2]')[0].text
+    def get_seller_individual_number(self, document: _Document) -> str:
+        return document.report_spans[1].text.strip()
+
+    def get_created(self, document: _Document) -> datetime:
+        value = document.find(self.CREATED, document.span_labels['Приход']).text
         return datetime.strptime(value, '%d.%m.%Y %H:%M') - timedelta(hours=7)
 
-    def get_items(self, tree) -> List[ParsedReceiptItem]:
-        strings = tree.xpath('//table[@class="verticalBlock"]//span/text()')
+    def get_items(self, document: _Document) -> List[ParsedReceiptItem]:
+        strings = document.get_item_strings()
         for i in range(0, len(strings) - 8, 9):
             yield ParsedReceiptItem(
                 strings[i],
@@ -62,24 +115,26 @@ class ParserV1:
                 Decimal(strings[i + 3]),
             )
 
-    def get_second_column_text(self, tree, first_column_text) -> str:
-        return tree.xpath(f'//td[text()="{first_column_text}"]/following-sibling::td[1]/span')[0].text.strip()
+    def get_second_column_text(self, document: _Document, first_column_text) -> str:
+        return document.find(self.SECOND_COLUMN, document.cell_labels[first_column_text]).text.strip()
 
 
 class ParserV2:
 
-    def get_seller_name(self, tree) -> str:
-        return tree.xpath('(//div[@class="receipt_report"]//span)[1]')[0].text.strip()
+    SECOND_COLUMN = etree.XPath('parent::td/following-sibling::td[1]/span')
+
+    def get_seller_name(self, document: _Document) -> str:
+        return document.report_spans[0].text.strip()
 
-    def get_seller_individual_number(self, tree) -> str:
-        return tree.xpath('(//div[@class="receipt_report"]//span)[2]')[0].text.strip()
+    def get_seller_individual_number(self, document: _Document) -> str:
+        return document.report_spans[1].text.strip()
 
-    def get_created(self, tree) -> datetime:
-        value = tree.xpath('(//div[@class="receipt_report"]//span)[9]')[0].text.strip()
+    def get_created(self, document: _Document) -> datetime:
+        value = document.report_spans[8].text.strip()
         return datetime.strptime(value,'%d.%m.%Y %H:%M') - timedelta(hours=7)
 
-    def get_items(self, tree) -> List[ParsedReceiptItem]:
-        strings = tree.xpath('//table[@class="verticalBlock"]//span/text()')
+    def get_items(self, document: _Document) -> List[ParsedReceiptItem]:
+        strings = document.get_item_strings()
         for i in range(0, len(strings), 12):
             yield ParsedReceiptItem(
                 strings[i],
@@ -88,10 +143,5 @@ class ParserV2:
                 Decimal(strings[i + 4]),
             )
 
-    def get_second_column_text(self, tree, first_column_text) -> str:
-        return tree.xpath(f'''
-            //span[text()="{first_column_text}"]
-            /parent::td
-            /following-sibling::td[1]
-            /span
-        ''')[0].text.strip()
+    def get_second_column_text(self, document: _Document, first_column_text) -> str:
+        return document.find(self.SECOND_COLUMN, document.span_labels[first_column_text]).text.strip()
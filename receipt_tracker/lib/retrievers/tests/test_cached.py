@@ -0,0 +1,126 @@
+from datetime import timedelta
+from time import time
+
+from pytest import fixture, raises
+
+from receipt_tracker.lib import ReceiptParams
+from receipt_tracker.lib.retrievers import BadResponse, OperatorReceiptRetriever, ParsedReceipt, ReceiptRetriever
+from receipt_tracker.lib.retrievers.cached import CacheEntry, CachedReceiptRetriever, receipt_cache
+
+
+@fixture
+def parsed_receipt(receipt_params):
+    return ParsedReceipt(receipt_params.fiscal_drive_number, receipt_params.fiscal_document_number,
+                         receipt_params.fiscal_sign, 'foo', '1', receipt_params.created, [])
+
+
+@fixture
+def operator_retriever(mocker, parsed_receipt):
+    class CustomReceiptRetriever(OperatorReceiptRetriever):
+        HOST = 'example.com'
+        download = mocker.Mock(return_value=b'payload')
+        parse = mocker.Mock(return_value=parsed_receipt)
+    return CustomReceiptRetriever()
+
+
+@fixture
+def silent_retriever(mocker):
+    class CustomReceiptRetriever(ReceiptRetriever):
+        get_receipt = mocker.Mock(return_value=None)
+    return CustomReceiptRetriever()
+
+
+class TestCachedReceiptRetriever:
+
+    def test_get_receipt(self, receipt_params, parsed_receipt, operator_retriever):
+        result = CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        assert result == parsed_receipt
+        operator_retriever.parse.assert_called_once_with(b'payload')
+
+    def test_get_receipt_if_cached(self, receipt_params, parsed_receipt, operator_retriever):
+        CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        result = CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        assert result == parsed_receipt
+        assert operator_retriever.download.call_count == 1
+
+    def test_get_receipt_if_cached_payload(self, receipt_params, operator_retriever):
+        CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        key = (receipt_params.fiscal_drive_number, receipt_params.fiscal_document_number, receipt_params.fiscal_sign)
+        assert receipt_cache.get(type(operator_retriever).__name__, key).payload == b'payload'
+
+    def test_get_receipt_if_expired(self, mocker, receipt_params, operator_retriever):
+        CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        mocker.patch.object(CachedReceiptRetriever, 'TTL', timedelta(seconds=-1))
+        CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        assert operator_retriever.download.call_count == 2
+
+    def test_get_receipt_if_expired_and_failed(self, mocker, receipt_params, operator_retriever):
+        CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        mocker.patch.object(CachedReceiptRetriever, 'TTL', timedelta(seconds=-1))
+        operator_retriever.download.side_effect = BadResponse()
+        with raises(BadResponse):
+            CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        key = (receipt_params.fiscal_drive_number, receipt_params.fiscal_document_number, receipt_params.fiscal_sign)
+        assert receipt_cache.get(type(operator_retriever).__name__, key) is None
+
+    def test_get_receipt_if_not_found(self, receipt_params, silent_retriever):
+        CachedReceiptRetriever(silent_retriever).get_receipt(receipt_params)
+        result = CachedReceiptRetriever(silent_retriever).get_receipt(receipt_params)
+        assert result is None
+        assert silent_retriever.get_receipt.call_count == 1
+
+    def test_get_receipt_if_not_found_expired(self, mocker, receipt_params, silent_retriever):
+        mocker.patch.object(CachedReceiptRetriever, 'NEGATIVE_TTL', timedelta(seconds=-1))
+        CachedReceiptRetriever(silent_retriever).get_receipt(receipt_params)
+        CachedReceiptRetriever(silent_retriever).get_receipt(receipt_params)
+        assert silent_retriever.get_receipt.call_count == 2
+
+    def test_get_receipt_if_failed(self, receipt_params, operator_retriever):
+        operator_retriever.download.side_effect = BadResponse()
+        for _ in range(2):
+            with raises(BadResponse):
+                CachedReceiptRetriever(operator_retriever).get_receipt(receipt_params)
+        assert operator_retriever.download.call_count == 2
+
+    def test_get_receipt_if_cache_corrupted(self, receipt_params, parsed_receipt, operator_retriever):
+        retriever = CachedReceiptRetriever(operator_retriever)
+        retriever.get_receipt(receipt_params)
+        key = (receipt_params.fiscal_drive_number, receipt_params.fiscal_document_number, receipt_params.fiscal_sign)
+        with open(receipt_cache._get_file_path(type(operator_retriever).__name__, key), 'wb') as f:
+            f.write(b'foo')
+        result = retriever.get_receipt(receipt_params)
+        assert result == parsed_receipt
+        assert operator_retriever.download.call_count == 2
+
+    def test_get_receipts(self, receipt_params, parsed_receipt, operator_retriever):
+        retriever = CachedReceiptRetriever(operator_retriever)
+        result = retriever.get_receipts([receipt_params])
+        assert result == [parsed_receipt]
+        assert retriever.get_receipts([receipt_params]) == [parsed_receipt]
+        assert operator_retriever.download.call_count == 1
+
+
+class TestReceiptCache:
+
+    @fixture
+    def entries(self, parsed_receipt):
+        receipt_cache.set('foo', ('1', '1', '1'), CacheEntry(time(), None, parsed_receipt))
+        receipt_cache.set('foo', ('1', '1', '2'), CacheEntry(time() - 7200, None, None))
+        receipt_cache.set('bar', ('1', '1', '3'), CacheEntry(time(), None, None))
+
+    def test_delete(self, entries):
+        receipt_cache.delete('foo', ('1', '1', '1'))
+        receipt_cache.delete('foo', ('1', '1', '1'))
+        assert receipt_cache.get('foo', ('1', '1', '1')) is None
+
+    def test_purge(self, entries):
+        receipt_cache.set('bar', ('1', '1', '4'), CacheEntry(time(), None, None))
+        with open(receipt_cache._get_file_path('bar', ('1', '1', '4')), 'wb') as f:
+            f.write(b'foo')
+        assert receipt_cache.purge(CachedReceiptRetriever.is_expired) == 2
+        assert receipt_cache.get('foo', ('1', '1', '1')) is not None
+        assert receipt_cache.get('foo', ('1', '1', '2')) is None
+        assert receipt_cache.get('bar', ('1', '1', '3')) is not None
+
+    def test_purge_if_empty(self):
+        assert receipt_cache.purge(CachedReceiptRetriever.is_expired) == 0
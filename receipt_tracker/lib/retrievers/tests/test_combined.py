@@ -1,10 +1,17 @@
+import asyncio
+from datetime import timedelta
+from http import HTTPStatus
+from threading import Event
 from typing import Optional
 
-from pytest import fixture
+from pytest import fixture, raises
+from requests import ConnectionError
 
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import ParsedReceipt, ReceiptRetriever
+from receipt_tracker.lib.retrievers import BadResponse, OperatorUnavailable, ParsedReceipt, ReceiptNotReady, \
+    ReceiptRetriever
 from receipt_tracker.lib.retrievers.combined import CombinedReceiptRetriever
+from receipt_tracker.lib.retrievers.guard import OperatorGuard, operator_guard
 
 
 @fixture
@@ -19,7 +26,54 @@ def successful_retriever():
 def failing_retriever():
     class CustomReceiptRetriever(ReceiptRetriever):
         def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
-            raise Exception()
+            raise ConnectionError()
+    return CustomReceiptRetriever()
+
+
+def _get_responding_retriever(status_code: int):
+    class CustomReceiptRetriever(ReceiptRetriever):
+        def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+            raise BadResponse('', status_code)
+    return CustomReceiptRetriever()
+
+
+@fixture
+def pending_retriever():
+    class CustomReceiptRetriever(ReceiptRetriever):
+        def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+            raise ReceiptNotReady()
+    return CustomReceiptRetriever()
+
+
+@fixture
+def hanging_retriever():
+    class CustomReceiptRetriever(ReceiptRetriever):
+        def __init__(self):
+            self.released = Event()
+
+        def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+            self.released.wait(5)
+            return 'hanging'
+    retriever = CustomReceiptRetriever()
+    yield retriever
+    retriever.released.set()
+
+
+@fixture
+def paused_retriever():
+    class PausedReceiptRetriever(ReceiptRetriever):
+        def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+            raise AssertionError('paused retriever is called')
+    retriever = PausedReceiptRetriever()
+    for _ in range(operator_guard.FAILURE_THRESHOLD):
+        operator_guard.record_failure(retriever.name)
+    return retriever
+
+
+def _get_named_retriever(name):
+    class CustomReceiptRetriever(ReceiptRetriever):
+        def get_receipt(self, params: ReceiptParams) -> Optional[ParsedReceipt]:
+            return name
     return CustomReceiptRetriever()
 
 
@@ -37,3 +91,154 @@ class TestCombinedReceiptRetriever:
             successful_retriever,
         ]).get_receipt(receipt_params)
         assert result
+
+    def test_get_receipt_if_concurrent(self, receipt_params, successful_retriever, failing_retriever):
+        result = CombinedReceiptRetriever([
+            failing_retriever,
+            successful_retriever,
+        ], concurrent=True).get_receipt(receipt_params)
+        assert result
+
+    def test_get_receipt_if_concurrent_and_cannot_retrieve(self, receipt_params, failing_retriever):
+        result = CombinedReceiptRetriever([
+            failing_retriever,
+            failing_retriever,
+        ], concurrent=True).get_receipt(receipt_params)
+        assert result is None
+
+    def test_get_receipt_if_concurrent_and_one_hangs(self, receipt_params, hanging_retriever, successful_retriever):
+        result = CombinedReceiptRetriever([
+            hanging_retriever,
+            successful_retriever,
+        ], concurrent=True).get_receipt(receipt_params)
+        assert result is True
+
+    def test_get_receipt_if_concurrent_and_deadline_passed(self, receipt_params, hanging_retriever):
+        result = CombinedReceiptRetriever([
+            hanging_retriever,
+        ], concurrent=True, timeout=timedelta(milliseconds=50)).get_receipt(receipt_params)
+        assert result is None
+
+    def test_get_receipt_if_concurrent_keeps_priority(self, mocker, receipt_params):
+        mocker.patch('receipt_tracker.lib.retrievers.combined.wait',
+                     side_effect=lambda futures, **kwargs: (set(futures), set()))
+        result = CombinedReceiptRetriever([
+            _get_named_retriever('first'),
+            _get_named_retriever('second'),
+        ], concurrent=True).get_receipt(receipt_params)
+        assert result == 'first'
+
+    def test_get_receipt_if_pending(self, receipt_params, pending_retriever, failing_retriever):
+        with raises(ReceiptNotReady):
+            CombinedReceiptRetriever([
+                pending_retriever,
+                failing_retriever,
+            ]).get_receipt(receipt_params)
+
+    def test_get_receipt_if_pending_and_another_successful(self, receipt_params, pending_retriever,
+                                                           successful_retriever):
+        result = CombinedReceiptRetriever([
+            pending_retriever,
+            successful_retriever,
+        ]).get_receipt(receipt_params)
+        assert result
+
+    def test_get_receipt_if_concurrent_and_pending(self, receipt_params, pending_retriever, failing_retriever):
+        with raises(ReceiptNotReady):
+            CombinedReceiptRetriever([
+                pending_retriever,
+                failing_retriever,
+            ], concurrent=True).get_receipt(receipt_params)
+
+    def test_get_receipt_if_operator_paused(self, receipt_params, paused_retriever, successful_retriever):
+        result = CombinedReceiptRetriever([
+            paused_retriever,
+            successful_retriever,
+        ]).get_receipt(receipt_params)
+        assert result
+
+    def test_get_receipt_if_concurrent_and_operator_paused(self, receipt_params, paused_retriever,
+                                                           successful_retriever):
+        result = CombinedReceiptRetriever([
+            paused_retriever,
+            successful_retriever,
+        ], concurrent=True).get_receipt(receipt_params)
+        assert result
+
+    def test_get_receipt_if_all_operators_paused(self, receipt_params, paused_retriever):
+        with raises(OperatorUnavailable) as e:
+            CombinedReceiptRetriever([
+                paused_retriever,
+            ], concurrent=True).get_receipt(receipt_params)
+        assert timedelta(0) < e.value.retry_after <= operator_guard.OPEN_DURATION
+
+    def test_get_receipt_if_operator_fails_repeatedly(self, receipt_params, failing_retriever):
+        retriever = CombinedReceiptRetriever([
+            failing_retriever,
+        ])
+        for _ in range(operator_guard.FAILURE_THRESHOLD):
+            assert retriever.get_receipt(receipt_params) is None
+        with raises(OperatorUnavailable):
+            retriever.get_receipt(receipt_params)
+
+    def test_get_receipt_if_not_found_repeatedly(self, receipt_params):
+        retriever = CombinedReceiptRetriever([
+            _get_responding_retriever(HTTPStatus.NOT_ACCEPTABLE),
+        ])
+        for _ in range(operator_guard.FAILURE_THRESHOLD + 1):
+            assert retriever.get_receipt(receipt_params) is None
+
+    def test_get_receipt_if_server_error_repeatedly(self, receipt_params):
+        retriever = CombinedReceiptRetriever([
+            _get_responding_retriever(HTTPStatus.BAD_GATEWAY),
+        ])
+        for _ in range(operator_guard.FAILURE_THRESHOLD):
+            assert retriever.get_receipt(receipt_params) is None
+        with raises(OperatorUnavailable):
+            retriever.get_receipt(receipt_params)
+
+    def test_get_receipt_if_operator_recovers(self, mocker, receipt_params, successful_retriever):
+        mocker.patch.object(operator_guard, 'OPEN_DURATION', timedelta(0))
+        for _ in range(operator_guard.FAILURE_THRESHOLD):
+            operator_guard.record_failure(successful_retriever.name)
+        result = CombinedReceiptRetriever([
+            successful_retriever,
+        ]).get_receipt(receipt_params)
+        assert result
+        assert operator_guard.acquire(successful_retriever.name) is None
+
+    def test_get_receipt_if_concurrent_and_deadline_passed_repeatedly(self, receipt_params, hanging_retriever):
+        retriever = CombinedReceiptRetriever([
+            hanging_retriever,
+        ], concurrent=True, timeout=timedelta(milliseconds=10))
+        for _ in range(operator_guard.FAILURE_THRESHOLD):
+            assert retriever.get_receipt(receipt_params) is None
+        with raises(OperatorUnavailable):
+            retriever.get_receipt(receipt_params)
+
+    def test_get_receipt_async_if_operator_paused(self, receipt_params, paused_retriever, successful_retriever):
+        result = asyncio.run(CombinedReceiptRetriever([
+            paused_retriever,
+            successful_retriever,
+        ]).get_receipt_async(receipt_params))
+        assert result
+
+    def test_get_receipt_async_if_all_operators_paused(self, receipt_params, paused_retriever):
+        with raises(OperatorUnavailable):
+            asyncio.run(CombinedReceiptRetriever([
+                paused_retriever,
+            ], concurrent=True).get_receipt_async(receipt_params))
+
+    def test_get_receipts_if_tokens_exhausted(self, mocker, receipt_params, successful_retriever):
+        mocker.patch.object(OperatorGuard, 'BURST', 2)
+        mocker.patch.object(OperatorGuard, 'RATE', 100.0)
+        results = CombinedReceiptRetriever([
+            successful_retriever,
+        ], concurrent=True).get_receipts([receipt_params] * 10)
+        assert results == [True] * 10
+
+    def test_get_receipts_if_operator_paused(self, receipt_params, paused_retriever):
+        results = CombinedReceiptRetriever([
+            paused_retriever,
+        ], concurrent=True).get_receipts([receipt_params] * 2)
+        assert all(isinstance(result, OperatorUnavailable) for result in results)
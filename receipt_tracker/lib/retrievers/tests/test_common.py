@@ -1,4 +1,15 @@
-from receipt_tracker.lib.retrievers import ReceiptRetriever, get_available_receipt_retrievers, get_receipt_retriever
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from threading import Lock
+from typing import Optional
+
+from pytest import fixture
+
+from receipt_tracker.lib import ReceiptParams
+from receipt_tracker.lib.retrievers import BadResponse, OperatorReceiptRetriever, ParsedReceipt, ReceiptRetriever, \
+    get_available_receipt_retrievers, get_receipt_retriever
+from receipt_tracker.lib.retrievers.combined import CombinedReceiptRetriever
 
 
 def test_get_receipt_retriever():
@@ -10,3 +21,59 @@ def test_get_available_receipt_retrievers():
     result = get_available_receipt_retrievers()
     assert isinstance(result, list)
     assert isinstance(result[0], ReceiptRetriever)
+
+
+class _SlowOperatorReceiptRetriever(OperatorReceiptRetriever):
+
+    HOST = 'example.com'
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+        self.lock = Lock()
+
+    def download(self, params: ReceiptParams) -> bytes:
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.02)
+        with self.lock:
+            self.active -= 1
+        if params.fiscal_sign == 'bad':
+            raise BadResponse()
+        return params.fiscal_document_number.encode()
+
+    def parse(self, payload: bytes) -> Optional[ParsedReceipt]:
+        return payload.decode()
+
+
+class TestReceiptRetriever:
+
+    @fixture
+    def params(self):
+        return [ReceiptParams('1', str(i), 'bad' if i == 3 else '1', datetime.utcnow(), Decimal(1)) for i in range(12)]
+
+    def test_get_receipts(self, mocker, params):
+        mocker.patch.object(ReceiptRetriever, 'PER_HOST_INTERVAL', timedelta())
+        result = _SlowOperatorReceiptRetriever().get_receipts(params)
+        assert result[:3] == ['0', '1', '2']
+        assert isinstance(result[3], BadResponse)
+        assert result[4:] == [str(i) for i in range(4, 12)]
+
+    def test_get_receipts_if_host_limited(self, mocker, params):
+        mocker.patch.object(ReceiptRetriever, 'PER_HOST_INTERVAL', timedelta())
+        retriever = _SlowOperatorReceiptRetriever()
+        retriever.get_receipts(params)
+        assert 1 < retriever.max_active <= ReceiptRetriever.PER_HOST_CONCURRENCY
+
+    def test_get_receipts_if_concurrency_limited(self, mocker, params):
+        mocker.patch.object(ReceiptRetriever, 'PER_HOST_INTERVAL', timedelta())
+        retriever = _SlowOperatorReceiptRetriever()
+        retriever.get_receipts(params, concurrency=1)
+        assert retriever.max_active == 1
+
+    def test_get_receipts_if_combined(self, mocker, params):
+        mocker.patch.object(ReceiptRetriever, 'PER_HOST_INTERVAL', timedelta())
+        retriever = CombinedReceiptRetriever([_SlowOperatorReceiptRetriever()], concurrent=True)
+        result = retriever.get_receipts(params)
+        assert result[:4] == ['0', '1', '2', None]
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+from django.db import DatabaseError
+from pytest import fixture
+
+from receipt_tracker.lib.retrievers.guard import DatabaseOperatorStateStore, MemoryOperatorStateStore, \
+    OperatorGuard
+from receipt_tracker.models import OperatorState
+from receipt_tracker.repositories import operator_state_repository
+
+
+@fixture
+def guard():
+    return OperatorGuard(MemoryOperatorStateStore())
+
+
+class TestOperatorGuard:
+
+    def test_acquire(self, guard):
+        assert guard.acquire('foo') is None
+
+    def test_acquire_if_tokens_exhausted(self, mocker, guard):
+        mocker.patch.object(guard, 'BURST', 2)
+        mocker.patch.object(guard, 'RATE', 0.5)
+        assert guard.acquire('foo') is None
+        assert guard.acquire('foo') is None
+        assert timedelta(seconds=1) < guard.acquire('foo') <= timedelta(seconds=2)
+        assert guard.acquire('bar') is None
+
+    def test_acquire_if_tokens_refilled(self, mocker, guard):
+        mocker.patch.object(guard, 'BURST', 1)
+        guard.acquire('foo')
+        guard._store.update('foo', lambda state: setattr(state, 'tokens_updated',
+                                                         datetime.utcnow() - timedelta(seconds=1)))
+        assert guard.acquire('foo') is None
+
+    def test_acquire_if_failed_too_many_times(self, guard):
+        for _ in range(guard.FAILURE_THRESHOLD - 1):
+            guard.record_failure('foo')
+        assert guard.acquire('foo') is None
+        guard.record_failure('foo')
+        assert timedelta(0) < guard.acquire('foo') <= guard.OPEN_DURATION
+
+    def test_acquire_if_succeeded_between_failures(self, guard):
+        for _ in range(guard.FAILURE_THRESHOLD - 1):
+            guard.record_failure('foo')
+        guard.record_success('foo')
+        guard.record_failure('foo')
+        assert guard.acquire('foo') is None
+
+    def test_acquire_if_pause_passed(self, mocker, guard):
+        mocker.patch.object(guard, 'OPEN_DURATION', timedelta(0))
+        for _ in range(guard.FAILURE_THRESHOLD):
+            guard.record_failure('foo')
+        assert guard.acquire('foo') is None
+
+    def test_acquire_if_trial_request_failed(self, mocker, guard):
+        mocker.patch.object(guard, 'OPEN_DURATION', timedelta(0))
+        for _ in range(guard.FAILURE_THRESHOLD):
+            guard.record_failure('foo')
+        mocker.patch.object(guard, 'OPEN_DURATION', timedelta(minutes=1))
+        guard.record_failure('foo')
+        assert guard.acquire('foo') is not None
+
+
+@pytest.mark.django_db
+class TestDatabaseOperatorStateStore:
+
+    def test_update(self):
+        guard = OperatorGuard(DatabaseOperatorStateStore())
+        guard.acquire('foo')
+        guard.record_failure('foo')
+        state = OperatorState.objects.get(name='foo')
+        assert state.tokens == guard.BURST - 1
+        assert state.failures == 1
+
+    def test_update_if_shared(self):
+        for _ in range(OperatorGuard.FAILURE_THRESHOLD):
+            OperatorGuard(DatabaseOperatorStateStore()).record_failure('foo')
+        assert OperatorGuard(DatabaseOperatorStateStore()).acquire('foo') is not None
+
+    def test_update_if_database_unavailable(self, mocker):
+        mocker.patch.object(operator_state_repository, 'get_for_update', side_effect=DatabaseError)
+        fallback = MemoryOperatorStateStore()
+        guard = OperatorGuard(DatabaseOperatorStateStore(fallback))
+        guard.record_failure('foo')
+        assert fallback.update('foo', lambda state: state.failures) == 1
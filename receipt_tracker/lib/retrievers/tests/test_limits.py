@@ -0,0 +1,40 @@
+import asyncio
+from datetime import timedelta
+from time import monotonic
+
+from receipt_tracker.lib.retrievers.limits import HostLimiters, host_limiters, limit_host
+
+
+def _run(limiters: HostLimiters, hosts):
+    starts = []
+
+    async def request(host: str):
+        async with limit_host(host):
+            starts.append((host, monotonic()))
+
+    async def main():
+        host_limiters.set(limiters)
+        await asyncio.gather(*map(request, hosts))
+
+    asyncio.run(main())
+    return starts
+
+
+class TestHostLimiters:
+
+    def test_limit_host_if_same_host(self):
+        starts = _run(HostLimiters(4, timedelta(milliseconds=50)), ['foo', 'foo', 'foo'])
+        times = [start for _, start in starts]
+        assert times[2] - times[0] >= 0.1
+
+    def test_limit_host_if_different_hosts(self):
+        starts = _run(HostLimiters(4, timedelta(seconds=1)), ['foo', 'bar'])
+        times = [start for _, start in starts]
+        assert times[1] - times[0] < 0.5
+
+    def test_limit_host_if_no_limiters(self):
+        async def main():
+            async with limit_host('foo'):
+                return True
+
+        assert asyncio.run(main())
@@ -1,13 +1,12 @@
-import json
 import time
 from datetime import datetime
 from decimal import Decimal
 from http import HTTPStatus
 
-import requests
 from pytest import fixture, raises
 
-from receipt_tracker.lib.retrievers import BadResponse
+from receipt_tracker.lib.http_client import http_client
+from receipt_tracker.lib.retrievers import BadResponse, ReceiptNotReady
 from receipt_tracker.lib.retrievers.nalog_ru import NalogRuReceiptRetriever
 from receipt_tracker.lib.retrievers.tests import get_file_content
 
@@ -16,7 +15,7 @@ from receipt_tracker.lib.retrievers.tests import get_file_content
 def good_response(mocker):
     response = mocker.MagicMock()
     response.status_code = HTTPStatus.OK
-    response.json.return_value = json.loads(get_file_content('nalog_ru_receipt_found.json'))
+    response.content = get_file_content('nalog_ru_receipt_found.json').encode()
     return response
 
 
@@ -37,25 +36,25 @@ def accepted_response(mocker):
 class TestNalogRuReceiptRetriever:
 
     def test_get_receipt_if_cannot_check_receipt(self, mocker, receipt_params, bad_response):
-        mocker.patch.object(requests, 'get', return_value=bad_response)
+        mocker.patch.object(http_client, 'get', return_value=bad_response)
         with raises(BadResponse):
             NalogRuReceiptRetriever().get_receipt(receipt_params)
 
     def test_get_receipt_if_accepted_response(self, mocker, receipt_params, no_content_response, accepted_response):
-        mocker.patch.object(NalogRuReceiptRetriever, 'MAX_TRIES', 2)
-        mocker.patch.object(requests, 'get', side_effect=[no_content_response, accepted_response, accepted_response])
-        mocker.patch.object(time, 'sleep')
-        with raises(BadResponse):
+        mocker.patch.object(http_client, 'get', side_effect=[no_content_response, accepted_response])
+        sleep = mocker.patch.object(time, 'sleep')
+        with raises(ReceiptNotReady):
             NalogRuReceiptRetriever().get_receipt(receipt_params)
+        assert not sleep.called
 
     def test_get_receipt_if_bad_response(self, mocker, receipt_params, no_content_response, bad_response):
-        mocker.patch.object(requests, 'get', side_effect=[no_content_response, bad_response])
+        mocker.patch.object(http_client, 'get', side_effect=[no_content_response, bad_response])
         mocker.patch.object(time, 'sleep')
         with raises(BadResponse):
             NalogRuReceiptRetriever().get_receipt(receipt_params)
 
     def test_get_receipt_if_good_response(self, mocker, receipt_params, no_content_response, good_response):
-        mocker.patch.object(requests, 'get', side_effect=[no_content_response, good_response])
+        mocker.patch.object(http_client, 'get', side_effect=[no_content_response, good_response])
         result = NalogRuReceiptRetriever().get_receipt(receipt_params)
 
         assert result.fiscal_drive_number == '9288000100020178'
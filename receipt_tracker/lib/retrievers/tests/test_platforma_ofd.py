@@ -1,9 +1,9 @@
 from datetime import datetime
 from decimal import Decimal
 
-import requests
 from pytest import raises
 
+from receipt_tracker.lib.http_client import http_client
 from receipt_tracker.lib.retrievers import BadResponse
 from receipt_tracker.lib.retrievers.platforma_ofd import Parser, PlatformaOfdOperatorReceiptRetriever
 from receipt_tracker.lib.retrievers.tests import get_file_content
@@ -12,12 +12,12 @@ from receipt_tracker.lib.retrievers.tests import get_file_content
 class TestPlatformaOfdOperatorReceiptRetriever:
 
     def test_get_receipt_if_bad_response(self, mocker, receipt_params, bad_response):
-        mocker.patch.object(requests, 'get', return_value=bad_response)
+        mocker.patch.object(http_client, 'get', return_value=bad_response)
         with raises(BadResponse):
             PlatformaOfdOperatorReceiptRetriever().get_receipt(receipt_params)
 
     def test_get_receipt(self, mocker, receipt_params, good_response):
-        mocker.patch.object(requests, 'get', return_value=good_response)
+        mocker.patch.object(http_client, 'get', return_value=good_response)
         mocker.patch.object(Parser, 'parse', return_value=True)
         result = PlatformaOfdOperatorReceiptRetriever().get_receipt(receipt_params)
         assert result
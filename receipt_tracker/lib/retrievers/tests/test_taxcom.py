@@ -1,9 +1,9 @@
 from datetime import datetime
 from decimal import Decimal
 
-import requests
 from pytest import raises
 
+from receipt_tracker.lib.http_client import http_client
 from receipt_tracker.lib.retrievers import BadResponse
 from receipt_tracker.lib.retrievers.taxcom import Parser, TaxcomOperatorReceiptRetriever
 from receipt_tracker.lib.retrievers.tests import get_file_content
@@ -12,12 +12,12 @@ from receipt_tracker.lib.retrievers.tests import get_file_content
 class TestTaxcomOperatorReceiptRetriever:
 
     def test_get_receipt_if_bad_response(self, mocker, receipt_params, bad_response):
-        mocker.patch.object(requests, 'get', return_value=bad_response)
+        mocker.patch.object(http_client, 'get', return_value=bad_response)
         with raises(BadResponse):
             TaxcomOperatorReceiptRetriever().get_receipt(receipt_params)
 
     def test_get_receipt(self, mocker, receipt_params, good_response):
-        mocker.patch.object(requests, 'get', return_value=good_response)
+        mocker.patch.object(http_client, 'get', return_value=good_response)
         mocker.patch.object(Parser, 'parse', return_value=True)
         result = TaxcomOperatorReceiptRetriever().get_receipt(receipt_params)
         assert result
@@ -52,6 +52,13 @@ class TestParser:
         assert result.items[12].price == Decimal('56.89')
         assert result.items[12].total == Decimal('17.98')
 
+    def test_parse_if_receipt_found_v1_with_nested_spans(self):
+        result = Parser().parse(get_file_content('taxcom_receipt_found_v1_with_nested_spans.html'))
+
+        assert result.created == datetime(2017, 8, 6, 13, 8)
+        assert len(result.items) == 13
+        assert result.items[12].name == 'Томаты вес 1 кг'
+
     def test_parse_if_receipt_found_v2(self):
         result = Parser().parse(get_file_content('taxcom_receipt_found_v2.html'))
 
@@ -1,8 +1,15 @@
+import fcntl
+import os
+import pickle
+from contextlib import contextmanager
 from dataclasses import dataclass
 from logging import getLogger
-from typing import Sequence
+from tempfile import NamedTemporaryFile
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+from django.conf import settings
 from numpy import nonzero
+from scipy.sparse import csr_matrix
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 from receipt_tracker.models import Product
@@ -21,22 +28,186 @@ class SimilarProduct:
     confidence: float
 
 
-class SimilarProductFinder:
+@dataclass
+class _IndexState:
+
+    vectorizer: Optional[TfidfVectorizer]
+    product_ids: List[int]
+    names: List[str]
+    vectors: Optional[csr_matrix]
+
+
+class _IndexDelta:
+
+    def __init__(self):
+        # Продукты, добавленные после обучения, и продукты, строки которых в основном индексе больше не действуют
+        self.names: Dict[int, str] = {}
+        self.hidden_ids: Set[int] = set()
+        self.offset = 0
+        self._vectors: Optional[Tuple[List[int], List[str], Optional[csr_matrix]]] = None
+
+    def apply(self, added: Dict[int, str], removed: Set[int]):
+        for product_id in removed:
+            self.names.pop(product_id, None)
+        self.names.update(added)
+        self.hidden_ids |= removed | added.keys()
+        self._vectors = None
+
+    def get_vectors(self, vectorizer: TfidfVectorizer) -> Tuple[List[int], List[str], Optional[csr_matrix]]:
+        if self._vectors is None:
+            product_ids, names = list(self.names), list(self.names.values())
+            self._vectors = product_ids, names, vectorizer.transform(names) if names else None
+        return self._vectors
+
+
+class SimilarProductIndex:
 
     MIN_CONFIDENCE = 0.3
     RESULT_COUNT = 10
+    # Изменения дописываются в журнал рядом с индексом, а переобучение на всех продуктах (новые слова попадают в
+    # словарь только так) идёт, когда журнал затронул заметную долю индекса
+    REFIT_RATIO = 0.2
+
+    def __init__(self, path: str):
+        self.path = path
+        self._state: Optional[_IndexState] = None
+        self._state_key: Optional[Tuple[str, int, int]] = None
+        self._delta = _IndexDelta()
+
+    def is_built(self) -> bool:
+        return os.path.exists(self.path)
+
+    def build(self, products: Iterable[Tuple[int, str]]):
+        with self._lock():
+            self._build(products)
+
+    def build_if_not_built(self, get_products: Callable[[], Iterable[Tuple[int, str]]]) -> bool:
+        # Проверяем под блокировкой, чтобы одновременно запущенные сборки не повторяли друг друга
+        with self._lock():
+            if self.is_built():
+                return False
+            self._build(get_products())
+            return True
 
-    def __init__(self, products: Sequence[Product]):
-        self._products = products
-        self._vectorizer = TfidfVectorizer()
-        self._vectors = self._vectorizer.fit_transform(normalize(product.name) for product in products)
+    def add(self, product_id: int, name: str):
+        self.add_many([(product_id, name)])
 
-    def find(self, name: str) -> Sequence[SimilarProduct]:
-        vector = self._vectorizer.transform([normalize(name)])
-        dot = self._vectors.dot(vector.toarray()[0])
+    def add_many(self, products: Iterable[Tuple[int, str]]):
+        products = {product_id: normalize(name) for product_id, name in products}
+        if products:
+            self._change(products, set())
 
-        similars = [SimilarProduct(self._products[index], round(dot[index], 6)) for index in nonzero(dot)[0]
-                    if self._products[index].name != name and dot[index] >= self.MIN_CONFIDENCE]
-        similars.sort(key=lambda item: item.confidence, reverse=True)
+    def remove(self, product_id: int):
+        self._change({}, {product_id})
+
+    def find(self, name: str) -> List[Tuple[int, float]]:
+        if not self.is_built():
+            return []
+        with self._lock(fcntl.LOCK_SH):
+            state, delta = self._load(), self._delta
+        if state is None or state.vectorizer is None:
+            return []
+        name = normalize(name)
+        vector = state.vectorizer.transform([name]).T
+
+        similars = []
+        for product_ids, names, vectors, hidden_ids in ((state.product_ids, state.names, state.vectors,
+                                                         delta.hidden_ids),
+                                                        (*delta.get_vectors(state.vectorizer), set())):
+            if not product_ids:
+                continue
+            dot = vectors.dot(vector).toarray()[:, 0]
+            similars += [(product_ids[row], round(dot[row], 6)) for row in nonzero(dot)[0]
+                         if product_ids[row] not in hidden_ids and names[row] != name
+                         and dot[row] >= self.MIN_CONFIDENCE]
+        similars.sort(key=lambda item: item[1], reverse=True)
 
         return similars[:self.RESULT_COUNT]
+
+    def _change(self, added: Dict[int, str], removed: Set[int]):
+        with self._lock():
+            state = self._load()
+            if state is None:
+                logger.debug('Similar product index is not built yet, skipping %s products', len(added) + len(removed))
+                return
+            with open(self._get_delta_path(), 'ab') as f:
+                pickle.dump((added, removed), f)
+            self._read_delta()
+            if state.vectorizer is None or len(self._delta.hidden_ids) > len(state.product_ids) * self.REFIT_RATIO:
+                products = [(product_id, name) for product_id, name in zip(state.product_ids, state.names)
+                            if product_id not in self._delta.hidden_ids]
+                self._save(self._fit(products + list(self._delta.names.items())))
+
+    def _build(self, products: Iterable[Tuple[int, str]]):
+        state = self._fit([(product_id, normalize(name)) for product_id, name in products])
+        self._save(state)
+        logger.info('Similar product index built with %s products', len(state.product_ids))
+
+    def _fit(self, products: List[Tuple[int, str]]) -> _IndexState:
+        product_ids = [product_id for product_id, _ in products]
+        names = [name for _, name in products]
+        vectorizer = TfidfVectorizer()
+        try:
+            vectors = vectorizer.fit_transform(names).tocsr()
+        except ValueError as e:
+            logger.debug('Cannot fit similar product index: %s', e)
+            return _IndexState(None, product_ids, names, None)
+        return _IndexState(vectorizer, product_ids, names, vectors)
+
+    def _load(self) -> Optional[_IndexState]:
+        try:
+            key = self._get_state_key()
+        except FileNotFoundError:
+            return None
+        if key != self._state_key:
+            with open(self.path, 'rb') as f:
+                self._state = pickle.load(f)
+            self._state_key = key
+            self._delta = _IndexDelta()
+        self._read_delta()
+        return self._state
+
+    def _read_delta(self):
+        # Журнал только растёт до следующего переобучения, поэтому дочитываем его с места, где остановились
+        try:
+            with open(self._get_delta_path(), 'rb') as f:
+                f.seek(self._delta.offset)
+                while True:
+                    try:
+                        added, removed = pickle.load(f)
+                    except EOFError:
+                        break
+                    self._delta.apply(added, removed)
+                self._delta.offset = f.tell()
+        except FileNotFoundError:
+            pass
+
+    def _save(self, state: _IndexState):
+        with NamedTemporaryFile('wb', dir=os.path.dirname(self.path), delete=False) as f:
+            pickle.dump(state, f)
+        os.replace(f.name, self.path)
+        # Журнал вошёл в новый индекс
+        open(self._get_delta_path(), 'wb').close()
+        self._state = state
+        self._state_key = self._get_state_key()
+        self._delta = _IndexDelta()
+
+    def _get_state_key(self) -> Tuple[str, int, int]:
+        stat = os.stat(self.path)
+        return self.path, stat.st_ino, stat.st_mtime_ns
+
+    def _get_delta_path(self) -> str:
+        return f'{self.path}.delta'
+
+    @contextmanager
+    def _lock(self, operation: int = fcntl.LOCK_EX):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f'{self.path}.lock', 'w') as f:
+            fcntl.flock(f, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+similar_product_index = SimilarProductIndex(settings.SIMILAR_PRODUCT_INDEX_PATH)
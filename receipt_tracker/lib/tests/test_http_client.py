@@ -0,0 +1,88 @@
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from pytest import fixture, raises
+from requests import Timeout
+
+from receipt_tracker.lib.http_client import HttpClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/flaky':
+            self.server.flaky_requests += 1
+            if self.server.flaky_requests == 1:
+                return self._respond(HTTPStatus.SERVICE_UNAVAILABLE)
+        self._respond(HTTPStatus.OK)
+
+    def _respond(self, status: HTTPStatus):
+        body = status.phrase.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.flaky_requests = 0
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+@fixture
+def client():
+    client = HttpClient()
+    yield client
+    client.close()
+
+
+class TestHttpClient:
+
+    def test_get(self, server, client):
+        response = client.get(f'{server}/ok')
+        assert response.status_code == HTTPStatus.OK
+        assert response.text == 'OK'
+
+    def test_get_if_keep_alive(self, server, client):
+        for _ in range(3):
+            client.get(f'{server}/ok')
+        stats = client.get_stats()[server]
+        assert stats.requests == 3
+        assert stats.connections == 1
+        assert stats.idle_connections == 1
+
+    def test_get_if_timeout(self, mocker, server, client):
+        mocker.patch.object(client, 'READ_TIMEOUT', 0.1)
+        mocker.patch.object(client, 'MAX_RETRIES', 0)
+        with raises(Timeout):
+            client.get(f'{server}/slow')
+
+    def test_get_if_server_unavailable_once(self, mocker, server, client):
+        mocker.patch.object(client, 'BACKOFF_FACTOR', 0)
+        response = client.get(f'{server}/flaky')
+        assert response.status_code == HTTPStatus.OK
+
+    def test_get_stats_if_several_hosts(self, server, client):
+        client.get(f'{server}/ok')
+        client.get(f'{server.replace("127.0.0.1", "localhost")}/ok')
+        assert len(client.get_stats()) == 2
+
+    def test_close(self, server, client):
+        client.get(f'{server}/ok')
+        client.close()
+        assert client.get_stats() == {}
@@ -1,7 +1,7 @@
 from datetime import datetime
 from decimal import Decimal
 
-from receipt_tracker.lib.qr_code import decode
+from receipt_tracker.lib.qr_code import decode, decode_many
 
 
 def test_decode():
@@ -21,3 +21,33 @@ def test_decode_if_no_field():
 def test_decode_if_bad_field():
     result = decode('fn=foo')
     assert result is None
+
+
+def test_decode_if_field_repeated():
+    result = decode('t=20170615T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793&fn=1')
+    assert result.fiscal_drive_number == '8710000100036875'
+
+
+def test_decode_if_no_separator():
+    result = decode('t=20170615T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793&foo')
+    assert result is None
+
+
+def test_decode_if_bad_created():
+    assert decode('t=20171315T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793') is None
+    assert decode('t=2017615T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793') is None
+
+
+def test_decode_if_bad_amount():
+    result = decode('t=20170615T1411&s=foo&fn=8710000100036875&i=78337&fp=255743793')
+    assert result is None
+
+
+def test_decode_many():
+    result = list(decode_many([
+        't=20170615T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793&n=1\n',
+        'foo=bar\n',
+    ]))
+    assert len(result) == 2
+    assert result[0].fiscal_document_number == '78337'
+    assert result[1] is None
@@ -1,26 +1,101 @@
 import pytest
 from pytest import fixture
 
-from receipt_tracker.lib.similar import SimilarProductFinder
-from receipt_tracker.models import Product
+from receipt_tracker.lib.similar import SimilarProductIndex
 
 pytestmark = pytest.mark.django_db
 
 
-@fixture
-def product_foo(mixer):
-    return mixer.blend(Product, user_friendly_name='foo foo')
+class TestSimilarProductIndex:
 
+    @fixture
+    def index(self, tmp_path):
+        index = SimilarProductIndex(str(tmp_path / 'index.pickle'))
+        index.build([(1, 'foo foo'), (2, 'bar bar'), (3, 'baz baz')])
+        return index
 
-@fixture
-def product_bar(mixer):
-    return mixer.blend(Product, user_friendly_name='bar bar')
+    def test_find_if_not_built(self, tmp_path):
+        result = SimilarProductIndex(str(tmp_path / 'index.pickle')).find('foo')
+        assert result == []
 
+    def test_find(self, index):
+        result = index.find('foo')
+        assert result == [(1, 1)]
 
-class TestSimilarProductFinder:
+    def test_find_if_loaded_from_disk(self, index):
+        result = SimilarProductIndex(index.path).find('foo')
+        assert result == [(1, 1)]
 
-    def test_find(self, product_foo, product_bar):
-        result = SimilarProductFinder([product_foo, product_bar]).find('foo')
-        assert len(result) == 1
-        assert result[0].product.id == product_foo.id
-        assert result[0].confidence == 1
+    def test_add(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 1)
+        index.add(4, 'foo bar')
+        result = index.find('foo')
+        assert [product_id for product_id, _ in result] == [1, 4]
+
+    def test_add_if_not_built(self, tmp_path):
+        index = SimilarProductIndex(str(tmp_path / 'index.pickle'))
+        index.add(1, 'foo')
+        assert not index.is_built()
+
+    def test_add_if_exists(self, index):
+        index.add(1, 'qux')
+        result = index.find('foo')
+        assert result == []
+
+    def test_add_if_refit_not_needed(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 1)
+        index.add(4, 'qux qux')
+        result = index.find('qux')
+        assert result == []
+
+    def test_add_if_refit_needed(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 0)
+        index.add(4, 'qux qux')
+        result = index.find('qux')
+        assert result == [(4, 1)]
+
+    def test_add_many(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 1)
+        index.add_many([(1, 'qux'), (4, 'foo bar'), (5, 'foo baz')])
+        result = index.find('foo')
+        assert sorted(product_id for product_id, _ in result) == [4, 5]
+
+    def test_add_many_if_refit_not_needed(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 1)
+        mocker.patch.object(index, '_save')
+        index.add_many([(4, 'foo bar'), (5, 'foo baz')])
+        assert not index._save.called
+
+    def test_add_many_if_loaded_from_disk(self, mocker, index):
+        mocker.patch.object(SimilarProductIndex, 'REFIT_RATIO', 1)
+        another_index = SimilarProductIndex(index.path)
+        assert another_index.find('foo') == [(1, 1)]
+        index.add_many([(1, 'qux'), (4, 'foo bar')])
+        index.remove(2)
+        assert [product_id for product_id, _ in another_index.find('foo')] == [4]
+        assert another_index.find('bar') == [(4, 0.707107)]
+
+    def test_add_many_if_empty(self, mocker, index):
+        mocker.patch.object(index, '_load')
+        index.add_many([])
+        assert not index._load.called
+
+    def test_build_if_not_built(self, tmp_path):
+        index = SimilarProductIndex(str(tmp_path / 'index.pickle'))
+        assert index.build_if_not_built(lambda: [(1, 'foo foo')])
+        assert index.find('foo') == [(1, 1)]
+
+    def test_build_if_not_built_and_already_built(self, mocker, index):
+        get_products = mocker.Mock()
+        assert not index.build_if_not_built(get_products)
+        assert not get_products.called
+
+    def test_remove(self, index):
+        index.remove(1)
+        result = index.find('foo')
+        assert result == []
+
+    def test_remove_if_not_exists(self, index):
+        index.remove(100)
+        result = index.find('foo')
+        assert result == [(1, 1)]
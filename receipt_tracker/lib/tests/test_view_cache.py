@@ -0,0 +1,62 @@
+from itertools import count
+
+from django.core.cache import cache
+
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, PRODUCTS_SCOPE, get_user_scope, view_cache
+
+
+class TestViewCache:
+
+    def test_get_or_set(self, mocker):
+        func = mocker.Mock(return_value=['foo'])
+        assert view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func, 1)[0] == ['foo']
+        assert view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func, 1)[0] == ['foo']
+        assert func.call_count == 1
+
+    def test_get_or_set_if_params_differ(self, mocker):
+        func = mocker.Mock(return_value=['foo'])
+        view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func, 1)
+        view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func, 2)
+        assert func.call_count == 2
+
+    def test_get_or_set_if_invalidated(self, mocker):
+        func = mocker.Mock(return_value=['foo'])
+        _, version = view_cache.get_or_set('foo', (PRODUCTS_SCOPE, get_user_scope(1)), func)
+        view_cache.invalidate(get_user_scope(1))
+        _, new_version = view_cache.get_or_set('foo', (PRODUCTS_SCOPE, get_user_scope(1)), func)
+        assert func.call_count == 2
+        assert new_version != version
+
+    def test_get_or_set_if_another_scope_invalidated(self, mocker):
+        func = mocker.Mock(return_value=['foo'])
+        view_cache.get_or_set('foo', (PRODUCTS_SCOPE, get_user_scope(1)), func)
+        view_cache.invalidate(LISTINGS_SCOPE, get_user_scope(2))
+        view_cache.get_or_set('foo', (PRODUCTS_SCOPE, get_user_scope(1)), func)
+        assert func.call_count == 1
+
+    def test_get_or_set_if_version_evicted(self, mocker):
+        mocker.patch.object(view_cache, '_get_new_version', side_effect=map(str, count(1)))
+        func = mocker.Mock(return_value=['foo'])
+        _, version = view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func)
+        cache.delete(view_cache._get_version_key(LISTINGS_SCOPE))
+        _, new_version = view_cache.get_or_set('foo', (LISTINGS_SCOPE,), func)
+        assert func.call_count == 2
+        assert (version, new_version) == ('1', '2')
+
+    def test_invalidate(self):
+        versions = [view_cache.get_version((LISTINGS_SCOPE,))]
+        for _ in range(2):
+            view_cache.invalidate(LISTINGS_SCOPE)
+            versions.append(view_cache.get_version((LISTINGS_SCOPE,)))
+        assert len(set(versions)) == 3
+
+    def test_invalidate_if_many_scopes(self):
+        version = view_cache.get_version((LISTINGS_SCOPE, PRODUCTS_SCOPE))
+        view_cache.invalidate(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+        new_version = view_cache.get_version((LISTINGS_SCOPE, PRODUCTS_SCOPE))
+        assert all(old != new for old, new in zip(version.split('.'), new_version.split('.')))
+
+    def test_invalidate_if_version_evicted(self, mocker):
+        mocker.patch.object(view_cache, '_get_new_version', return_value='10')
+        view_cache.invalidate(LISTINGS_SCOPE)
+        assert view_cache.get_version((LISTINGS_SCOPE,)) == '10'
@@ -0,0 +1,56 @@
+from datetime import timedelta
+from hashlib import md5
+from typing import Callable, Sequence, Tuple, TypeVar
+from uuid import uuid4
+
+from django.core.cache import cache
+
+T = TypeVar('T')
+
+# Списки, видимые всем: последние покупки и каталог продуктов
+LISTINGS_SCOPE = 'listings'
+# Названия и пищевая ценность продуктов, которые попадают в отчёты всех пользователей
+PRODUCTS_SCOPE = 'products'
+# Кэш псевдонимов продуктов внутри процессов, у каждого продавца ещё и своя версия
+PRODUCT_ALIASES_SCOPE = 'product-aliases'
+
+
+def get_user_scope(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+class ViewCache:
+
+    TIMEOUT = timedelta(hours=1)
+
+    def get_version(self, scopes: Sequence[str]) -> str:
+        keys = [self._get_version_key(scope) for scope in scopes]
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # Версия могла вытесниться из кеша, новая случайная не совпадёт ни с одной, под которой лежат данные
+                versions[key] = cache.get_or_set(key, self._get_new_version(), None)
+        return '.'.join(str(versions[key]) for key in keys)
+
+    def get_or_set(self, name: str, scopes: Sequence[str], func: Callable[[], T], *params) -> Tuple[T, str]:
+        version = self.get_version(scopes)
+        key = f'view:{name}:{version}:{md5(repr(params).encode()).hexdigest()}'
+        value = cache.get(key)
+        if value is None:
+            value = func()
+            cache.set(key, value, self.TIMEOUT.total_seconds())
+        return value, version
+
+    def invalidate(self, *scopes: str):
+        # В файловом кеше incr читает и записывает значение раздельно, и одновременные сбросы могли дать одну версию.
+        # Случайная версия отличается от прежней при любом порядке записей, поэтому сброс не теряется
+        cache.set_many({self._get_version_key(scope): self._get_new_version() for scope in scopes}, None)
+
+    def _get_version_key(self, scope: str) -> str:
+        return f'view-version:{scope}'
+
+    def _get_new_version(self) -> str:
+        return uuid4().hex
+
+
+view_cache = ViewCache()
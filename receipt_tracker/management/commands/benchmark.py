@@ -0,0 +1,49 @@
+import os
+from timeit import repeat
+from typing import Callable, Dict, Iterator, Tuple
+
+from django.core.management import BaseCommand
+
+from receipt_tracker.lib.qr_code import decode, decode_many
+from receipt_tracker.lib.retrievers import platforma_ofd, taxcom
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'lib', 'retrievers', 'tests')
+
+QR_CODE = 't=20170615T1411&s=67.20&fn=8710000100036875&i=78337&fp=255743793&n=1'
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def get_parser_cases() -> Iterator[Case]:
+    parsers = {'taxcom_': taxcom.Parser, 'platforma_ofd_': platforma_ofd.Parser}
+    for name in sorted(os.listdir(FIXTURES_PATH)):
+        for prefix, parser in parsers.items():
+            if name.startswith(prefix) and name.endswith('.html'):
+                with open(os.path.join(FIXTURES_PATH, name), 'rb') as f:
+                    html = f.read()
+                yield name, lambda parser=parser, html=html: parser().parse(html)
+
+
+def get_qr_code_cases() -> Iterator[Case]:
+    lines = [f'{QR_CODE}{i}\n' for i in range(1000)]
+    yield 'decode', lambda: decode(QR_CODE)
+    yield 'decode_many (1000 lines)', lambda: list(decode_many(lines))
+
+
+class Command(BaseCommand):
+
+    SUITES: Dict[str, Callable[[], Iterator[Case]]] = {
+        'parsers': get_parser_cases,
+        'qr': get_qr_code_cases,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=self.SUITES.keys())
+        parser.add_argument('--number', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        for name, func in self.SUITES[options['suite']]():
+            # Минимум по повторам меньше всего зависит от фоновой нагрузки
+            elapsed = min(repeat(func, number=options['number'], repeat=options['repeat'])) / options['number']
+            self.stdout.write(f'{name:60} {elapsed * 1e6:10.1f} µs')
@@ -0,0 +1,15 @@
+from logging import getLogger
+
+from django.core.management import BaseCommand
+
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.repositories import product_repository
+
+logger = getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        similar_product_index.build((product.id, product.name) for product in product_repository.get_all_with_aliases())
+        logger.info('Similar product index saved to %s', similar_product_index.path)
@@ -0,0 +1,193 @@
+import csv
+import json
+import os
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from itertools import islice
+from logging import getLogger
+from tempfile import NamedTemporaryFile
+from time import monotonic, sleep
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO, Tuple
+
+from django.core.management import BaseCommand, CommandError
+
+from receipt_tracker.lib import ReceiptParams
+from receipt_tracker.lib.qr_code import decode_many
+from receipt_tracker.lib.retrievers import OperatorUnavailable, ParsedReceipt, ReceiptRetriever, get_receipt_retriever
+from receipt_tracker.repositories import receipt_repository, user_repository
+from receipt_tracker.tasks import store_receipts
+
+logger = getLogger(__name__)
+
+ReceiptKey = Tuple[str, str, str]
+
+
+@dataclass
+class Progress:
+
+    rows: int = 0
+    imported: int = 0
+    existing: int = 0
+    invalid: int = 0
+    failed: int = 0
+
+
+class Command(BaseCommand):
+
+    BATCH_SIZE = 100
+    # Сколько раз подряд ждать операторов, прежде чем прервать загрузку
+    MAX_UNAVAILABLE_RETRIES = 3
+    UNAVAILABLE_DELAY = timedelta(minutes=1)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True)
+        parser.add_argument('--batch-size', type=int, default=self.BATCH_SIZE)
+        parser.add_argument('--concurrency', type=int)
+        parser.add_argument('--restart', action='store_true', help='ignore saved progress')
+        parser.add_argument('path', help='file with QR codes, one per line, or CSV export with codes in any column')
+
+    def handle(self, *args, **options):
+        user = user_repository.get_by_name(options['user'])
+        if not user:
+            raise CommandError(f'no user "{options["user"]}" found')
+        progress_path = f'{options["path"]}.progress'
+        failed_path = f'{options["path"]}.failed'
+        if options['restart']:
+            progress = Progress()
+            self._save_codes(failed_path, [])
+        else:
+            progress = self._load_progress(progress_path)
+        if progress.rows:
+            logger.info('Resuming import after %s rows', progress.rows)
+
+        retriever = get_receipt_retriever()
+        seen: Set[ReceiptKey] = set()
+        started = monotonic()
+        with open(options['path'], newline='') as f:
+            rows = islice(self._read_codes(f), progress.rows, None)
+            while True:
+                codes = list(islice(rows, options['batch_size']))
+                if not codes:
+                    break
+                failed = self._import(user.id, codes, retriever, options['concurrency'], seen, progress)
+                # Коды неудачных чеков сохраняем до сдвига позиции, чтобы после перезапуска их можно было повторить
+                self._append_codes(failed_path, failed)
+                progress.rows += len(codes)
+                self._save_progress(progress_path, progress)
+                logger.info('%s rows processed: %s imported, %s already existed, %s invalid, %s failed (%.1f rows/s)',
+                            progress.rows, progress.imported, progress.existing, progress.invalid, progress.failed,
+                            len(codes) / max(monotonic() - started, 1e-6))
+                started = monotonic()
+        self._retry_failed(user.id, failed_path, retriever, options, progress)
+        self._save_progress(progress_path, progress)
+        logger.info('Import finished')
+
+    def _retry_failed(self, user_id: int, failed_path: str, retriever: ReceiptRetriever, options: Dict,
+                      progress: Progress):
+        codes = list(dict.fromkeys(self._load_codes(failed_path)))
+        if not codes:
+            return
+        logger.info('Retrying %s failed receipts', len(codes))
+        progress.failed = max(progress.failed - len(codes), 0)
+        seen: Set[ReceiptKey] = set()
+        failed = []
+        for i in range(0, len(codes), options['batch_size']):
+            failed += self._import(user_id, codes[i:i + options['batch_size']], retriever, options['concurrency'],
+                                   seen, progress)
+        # Файл переписываем только в конце: если загрузку прервут, повтор начнётся заново
+        self._save_codes(failed_path, failed)
+        if failed:
+            logger.info('%s receipts still failed, run the command again later to retry them', len(failed))
+
+    def _import(self, user_id: int, codes: List[Optional[str]], retriever: ReceiptRetriever,
+                concurrency: Optional[int], seen: Set[ReceiptKey], progress: Progress) -> List[str]:
+        params: Dict[ReceiptKey, ReceiptParams] = {}
+        params_codes: Dict[ReceiptKey, str] = {}
+        # Строки без кода (заголовок CSV, пустые строки) просто пропускаем
+        codes = [code for code in codes if code]
+        for code, receipt_params in zip(codes, decode_many(codes)):
+            if not receipt_params:
+                progress.invalid += 1
+                continue
+            key = self._get_key(receipt_params)
+            if key in seen:
+                progress.existing += 1
+                continue
+            seen.add(key)
+            params[key] = receipt_params
+            params_codes[key] = code
+
+        existing = receipt_repository.get_existing_triples(params)
+        progress.existing += len(existing)
+        pending = [receipt_params for key, receipt_params in params.items() if key not in existing]
+        failed: List[str] = []
+        retries = 0
+        while pending:
+            parsed_receipts: List[ParsedReceipt] = []
+            unavailable: List[ReceiptParams] = []
+            retry_after = None
+            for receipt_params, result in zip(pending, retriever.get_receipts(pending, concurrency)):
+                if isinstance(result, ParsedReceipt):
+                    parsed_receipts.append(result)
+                elif isinstance(result, OperatorUnavailable):
+                    unavailable.append(receipt_params)
+                    delay = result.retry_after or self.UNAVAILABLE_DELAY
+                    retry_after = min(retry_after or delay, delay)
+                else:
+                    logger.debug('Receipt %s not retrieved: %s', receipt_params, result)
+                    failed.append(params_codes[self._get_key(receipt_params)])
+                    progress.failed += 1
+            if parsed_receipts:
+                imported = len(store_receipts(user_id, parsed_receipts))
+                progress.imported += imported
+                progress.existing += len(parsed_receipts) - imported
+            pending = unavailable
+            if pending:
+                retries += 1
+                if retries > self.MAX_UNAVAILABLE_RETRIES:
+                    # Прогресс этой пачки не сохраняем: при повторном запуске добавленные чеки отсеются как существующие
+                    raise CommandError('operators are unavailable, run the command again later to resume')
+                logger.info('Operators are unavailable for %s receipts, retrying in %s', len(pending), retry_after)
+                sleep(retry_after.total_seconds())
+        return failed
+
+    def _read_codes(self, f: TextIO) -> Iterator[Optional[str]]:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.reader(f, dialect):
+            yield next((cell.strip() for cell in row if 'fn=' in cell), None)
+
+    def _get_key(self, params: ReceiptParams) -> ReceiptKey:
+        return params.fiscal_drive_number, params.fiscal_document_number, params.fiscal_sign
+
+    def _load_codes(self, path: str) -> List[str]:
+        try:
+            with open(path) as f:
+                return [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _append_codes(self, path: str, codes: Iterable[str]):
+        with open(path, 'a') as f:
+            f.writelines(f'{code}\n' for code in codes)
+
+    def _save_codes(self, path: str, codes: Iterable[str]):
+        with NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(path)), delete=False) as f:
+            f.writelines(f'{code}\n' for code in codes)
+        os.replace(f.name, path)
+
+    def _load_progress(self, path: str) -> Progress:
+        try:
+            with open(path) as f:
+                return Progress(**json.load(f))
+        except FileNotFoundError:
+            return Progress()
+
+    def _save_progress(self, path: str, progress: Progress):
+        with NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(path)), delete=False) as f:
+            json.dump(asdict(progress), f)
+        os.replace(f.name, path)
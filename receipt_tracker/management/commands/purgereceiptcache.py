@@ -0,0 +1,14 @@
+from logging import getLogger
+
+from django.core.management import BaseCommand
+
+from receipt_tracker.lib.retrievers.cached import CachedReceiptRetriever, receipt_cache
+
+logger = getLogger(__name__)
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        count = receipt_cache.purge(CachedReceiptRetriever.is_expired)
+        logger.info('%s expired receipts removed from %s', count, receipt_cache.path)
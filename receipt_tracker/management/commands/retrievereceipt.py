@@ -5,6 +5,7 @@ from django.core.management import BaseCommand, CommandError
 
 from receipt_tracker.lib.qr_code import decode
 from receipt_tracker.lib.retrievers import ReceiptRetriever, get_available_receipt_retrievers
+from receipt_tracker.lib.retrievers.cached import CachedReceiptRetriever
 
 logger = getLogger(__name__)
 
@@ -15,6 +16,7 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--retriever', choices=self.RECEIPT_RETRIEVERS.keys(), required=True)
+        parser.add_argument('--no-cache', action='store_true')
         parser.add_argument('code')
 
     def handle(self, *args, **options):
@@ -22,6 +24,8 @@ class Command(BaseCommand):
         if not params:
             raise CommandError('cannot parse code')
         receipt_retriever = self.RECEIPT_RETRIEVERS.get(options['retriever'])
+        if not options['no_cache']:
+            receipt_retriever = CachedReceiptRetriever(receipt_retriever)
         parsed_receipt = receipt_retriever.get_receipt(params)
         if not parsed_receipt:
             raise CommandError('no receipt found')
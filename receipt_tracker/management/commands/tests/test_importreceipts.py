@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from django.core.management import CommandError, call_command
+from pytest import fixture, raises
+
+from receipt_tracker.lib.retrievers import OperatorUnavailable, ParsedReceipt, ParsedReceiptItem
+from receipt_tracker.management.commands import importreceipts
+from receipt_tracker.models import Receipt
+
+pytestmark = pytest.mark.django_db
+
+
+def _get_code(fiscal_document_number: int) -> str:
+    return f't=20170615T1411&s=67.20&fn=8710000100036875&i={fiscal_document_number}&fp=255743793&n=1'
+
+
+def _get_parsed_receipt(params) -> ParsedReceipt:
+    return ParsedReceipt(params.fiscal_drive_number, params.fiscal_document_number, params.fiscal_sign, 'foo', '1',
+                         params.created, [ParsedReceiptItem('bar', Decimal(1), Decimal(2), Decimal(2))])
+
+
+@fixture
+def retriever(mocker):
+    mock = mocker.Mock()
+    mock.get_receipts.side_effect = lambda params, concurrency: [_get_parsed_receipt(p) for p in params]
+    mocker.patch.object(importreceipts, 'get_receipt_retriever', return_value=mock)
+    return mock
+
+
+@fixture
+def codes_path(tmp_path):
+    path = tmp_path / 'codes.txt'
+    path.write_text('\n'.join([_get_code(1), _get_code(2), 'fn=foo', _get_code(1), '', _get_code(3)]) + '\n')
+    return path
+
+
+class TestImportReceiptsCommand:
+
+    def test_handle(self, user, retriever, codes_path):
+        call_command('importreceipts', str(codes_path), user=user.username, batch_size=2)
+        assert sorted(Receipt.objects.values_list('fiscal_document_number', flat=True)) == ['1', '2', '3']
+        assert json.loads(codes_path.with_name('codes.txt.progress').read_text()) == {
+            'rows': 6, 'imported': 3, 'existing': 1, 'invalid': 1, 'failed': 0,
+        }
+
+    def test_handle_if_receipt_exists(self, mixer, user, seller, retriever, codes_path):
+        mixer.blend(Receipt, seller=seller, buyer=user, created=datetime.utcnow(),
+                    fiscal_drive_number='8710000100036875', fiscal_document_number='2', fiscal_sign='255743793')
+        call_command('importreceipts', str(codes_path), user=user.username)
+        assert len(retriever.get_receipts.call_args[0][0]) == 2
+        assert Receipt.objects.count() == 3
+
+    def test_handle_if_resumed(self, user, retriever, codes_path):
+        codes_path.with_name('codes.txt.progress').write_text(json.dumps({'rows': 4}))
+        call_command('importreceipts', str(codes_path), user=user.username)
+        assert list(Receipt.objects.values_list('fiscal_document_number', flat=True)) == ['3']
+
+    def test_handle_if_restarted(self, user, retriever, codes_path):
+        codes_path.with_name('codes.txt.progress').write_text(json.dumps({'rows': 4}))
+        call_command('importreceipts', str(codes_path), user=user.username, restart=True)
+        assert Receipt.objects.count() == 3
+
+    def test_handle_if_csv(self, tmp_path, user, retriever):
+        path = tmp_path / 'codes.csv'
+        path.write_text(f'date;code\n2017-06-15;"{_get_code(1)}"\n2017-06-15;"{_get_code(2)}"\n')
+        call_command('importreceipts', str(path), user=user.username)
+        assert Receipt.objects.count() == 2
+
+    def test_handle_if_operators_unavailable(self, mocker, user, retriever, codes_path):
+        sleep = mocker.patch.object(importreceipts, 'sleep')
+        retriever.get_receipts.side_effect = lambda params, concurrency: [
+            _get_parsed_receipt(p) if p.fiscal_document_number == '1' else OperatorUnavailable('unavailable', None)
+            for p in params]
+        with raises(CommandError):
+            call_command('importreceipts', str(codes_path), user=user.username, batch_size=2)
+        assert Receipt.objects.count() == 1
+        assert sleep.call_count == importreceipts.Command.MAX_UNAVAILABLE_RETRIES
+        assert not codes_path.with_name('codes.txt.progress').exists()
+
+    def test_handle_if_operators_unavailable_temporarily(self, mocker, user, retriever, codes_path):
+        sleep = mocker.patch.object(importreceipts, 'sleep')
+        def get_receipts(params, concurrency):
+            if retriever.get_receipts.call_count == 1:
+                return [_get_parsed_receipt(params[0]), OperatorUnavailable('unavailable', timedelta(seconds=5))]
+            return [_get_parsed_receipt(p) for p in params]
+        retriever.get_receipts.side_effect = get_receipts
+        call_command('importreceipts', str(codes_path), user=user.username, batch_size=2)
+        assert Receipt.objects.count() == 3
+        sleep.assert_called_once_with(5)
+
+    def test_handle_if_receipt_failed(self, user, retriever, codes_path):
+        retriever.get_receipts.side_effect = lambda params, concurrency: [
+            None if p.fiscal_document_number == '2' else _get_parsed_receipt(p) for p in params]
+        call_command('importreceipts', str(codes_path), user=user.username, batch_size=2)
+        assert Receipt.objects.count() == 2
+        assert codes_path.with_name('codes.txt.failed').read_text() == f'{_get_code(2)}\n'
+        assert json.loads(codes_path.with_name('codes.txt.progress').read_text())['failed'] == 1
+
+    def test_handle_if_failed_receipts_retried(self, user, retriever, codes_path):
+        codes_path.with_name('codes.txt.progress').write_text(json.dumps({'rows': 6, 'failed': 1}))
+        codes_path.with_name('codes.txt.failed').write_text(f'{_get_code(2)}\n{_get_code(2)}\n')
+        call_command('importreceipts', str(codes_path), user=user.username)
+        assert list(Receipt.objects.values_list('fiscal_document_number', flat=True)) == ['2']
+        assert codes_path.with_name('codes.txt.failed').read_text() == ''
+        assert json.loads(codes_path.with_name('codes.txt.progress').read_text())['failed'] == 0
+
+    def test_handle_if_no_user(self, codes_path):
+        with raises(CommandError):
+            call_command('importreceipts', str(codes_path), user='foo')
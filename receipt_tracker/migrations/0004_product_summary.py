@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:05
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_product_summaries(apps, schema_editor):
+    Product = apps.get_model('receipt_tracker', 'Product')
+    ProductAlias = apps.get_model('receipt_tracker', 'ProductAlias')
+    ProductSummary = apps.get_model('receipt_tracker', 'ProductSummary')
+    ReceiptItem = apps.get_model('receipt_tracker', 'ReceiptItem')
+
+    aliases = ProductAlias.objects.filter(product=models.OuterRef('pk')).order_by('id')
+    items = ReceiptItem.objects.filter(product_alias__product=models.OuterRef('pk')) \
+        .order_by('-receipt__created', '-id')
+    rows = Product.objects \
+        .annotate(alias_name=models.Subquery(aliases.values('name')[:1]),
+                  last_buy=models.Max('productalias__receiptitem__receipt__created'),
+                  last_price=models.Subquery(items.values('price')[:1]),
+                  min_price=models.Min('productalias__receiptitem__price'),
+                  max_price=models.Max('productalias__receiptitem__price'),
+                  avg_price=models.Avg('productalias__receiptitem__price'),
+                  purchase_count=models.Count('productalias__receiptitem')) \
+        .values('id', 'user_friendly_name', 'alias_name', 'last_buy', 'last_price', 'min_price', 'max_price',
+                'avg_price', 'purchase_count')
+    ProductSummary.objects.bulk_create(ProductSummary(
+        product_id=row['id'],
+        name=row['user_friendly_name'] or row['alias_name'] or '?',
+        last_buy=row['last_buy'],
+        last_price=row['last_price'],
+        min_price=row['min_price'],
+        max_price=row['max_price'],
+        avg_price=Decimal(row['avg_price']).quantize(Decimal('0.01')),
+        purchase_count=row['purchase_count'],
+    ) for row in rows if row['purchase_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0003_auto_20190407_0707'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSummary',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='receipt_tracker.Product')),
+                ('name', models.CharField(max_length=100)),
+                ('last_buy', models.DateTimeField()),
+                ('last_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('avg_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('purchase_count', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['-last_buy', '-product'], name='receipt_tra_last_bu_2a8dcf_idx'),
+        ),
+        migrations.RunPython(fill_product_summaries, migrations.RunPython.noop),
+    ]
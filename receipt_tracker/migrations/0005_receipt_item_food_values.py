@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:12
+
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def fill_food_values(apps, schema_editor):
+    FoodProduct = apps.get_model('receipt_tracker', 'FoodProduct')
+    ReceiptItem = apps.get_model('receipt_tracker', 'ReceiptItem')
+
+    food_products = FoodProduct.objects.filter(product__productalias=models.OuterRef('product_alias'))
+
+    def get_value(name):
+        value = models.ExpressionWrapper(
+            Cast(name, models.DecimalField(max_digits=16, decimal_places=4)) * models.F('weight') / 100,
+            output_field=models.DecimalField())
+        return models.Subquery(food_products.annotate(value=value).values('value')[:1])
+
+    ReceiptItem.objects.update(
+        weight=models.ExpressionWrapper(models.F('quantity') * models.Subquery(food_products.values('weight')[:1]),
+                                        output_field=models.DecimalField()),
+        calories=get_value('calories'),
+        protein=get_value('protein'),
+        fat=get_value('fat'),
+        carbohydrate=get_value('carbohydrate'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0004_product_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receiptitem',
+            name='calories',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='receiptitem',
+            name='carbohydrate',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='receiptitem',
+            name='fat',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='receiptitem',
+            name='protein',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=12, null=True),
+        ),
+        migrations.AddField(
+            model_name='receiptitem',
+            name='weight',
+            field=models.DecimalField(blank=True, decimal_places=3, help_text='В граммах', max_digits=12, null=True),
+        ),
+        migrations.RunPython(fill_food_values, migrations.RunPython.noop),
+    ]
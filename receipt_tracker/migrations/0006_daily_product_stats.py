@@ -0,0 +1,77 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import NullIf, TruncDate
+
+
+def fill_daily_product_stats(apps, schema_editor):
+    DailyProductStats = apps.get_model('receipt_tracker', 'DailyProductStats')
+    ReceiptItem = apps.get_model('receipt_tracker', 'ReceiptItem')
+
+    effectivity = models.F('calories') / NullIf('total', models.Value(0))
+    rows = ReceiptItem.objects \
+        .values(buyer_id=models.F('receipt__buyer'), product_id=models.F('product_alias__product'),
+                seller_id=models.F('receipt__seller'), day=TruncDate('receipt__created')) \
+        .annotate(quantity_sum=models.Sum('quantity'),
+                  total_sum=models.Sum('total'),
+                  weight_sum=models.Sum('weight'),
+                  calories_sum=models.Sum('calories'),
+                  protein_sum=models.Sum('protein'),
+                  fat_sum=models.Sum('fat'),
+                  carbohydrate_sum=models.Sum('carbohydrate'),
+                  effectivity_sum=models.Sum(effectivity),
+                  effectivity_count=models.Count(effectivity),
+                  item_count=models.Count('id'))
+    DailyProductStats.objects.bulk_create(DailyProductStats(
+        buyer_id=row['buyer_id'],
+        product_id=row['product_id'],
+        seller_id=row['seller_id'],
+        day=row['day'],
+        quantity=row['quantity_sum'],
+        total=row['total_sum'],
+        weight=row['weight_sum'],
+        calories=row['calories_sum'],
+        protein=row['protein_sum'],
+        fat=row['fat_sum'],
+        carbohydrate=row['carbohydrate_sum'],
+        effectivity_sum=row['effectivity_sum'] or 0,
+        effectivity_count=row['effectivity_count'],
+        item_count=row['item_count'],
+    ) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('receipt_tracker', '0005_receipt_item_food_values'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyProductStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('weight', models.DecimalField(decimal_places=3, help_text='В граммах', max_digits=16, null=True)),
+                ('calories', models.DecimalField(decimal_places=2, max_digits=20, null=True)),
+                ('protein', models.DecimalField(decimal_places=4, max_digits=16, null=True)),
+                ('fat', models.DecimalField(decimal_places=4, max_digits=16, null=True)),
+                ('carbohydrate', models.DecimalField(decimal_places=4, max_digits=16, null=True)),
+                ('effectivity_sum', models.DecimalField(decimal_places=6, max_digits=24)),
+                ('effectivity_count', models.PositiveIntegerField()),
+                ('item_count', models.PositiveIntegerField()),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Product')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Seller')),
+            ],
+            options={
+                'unique_together': {('buyer', 'day', 'product', 'seller')},
+            },
+        ),
+        migrations.RunPython(fill_daily_product_stats, migrations.RunPython.noop),
+    ]
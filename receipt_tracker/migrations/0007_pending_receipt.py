@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:23
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import re
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('receipt_tracker', '0006_daily_product_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReceipt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fiscal_drive_number', models.CharField(max_length=50, validators=[django.core.validators.RegexValidator(re.compile('^-?\\d+\\Z'), code='invalid', message='Enter a valid integer.')])),
+                ('fiscal_document_number', models.CharField(max_length=50, validators=[django.core.validators.RegexValidator(re.compile('^-?\\d+\\Z'), code='invalid', message='Enter a valid integer.')])),
+                ('fiscal_sign', models.CharField(max_length=50, validators=[django.core.validators.RegexValidator(re.compile('^-?\\d+\\Z'), code='invalid', message='Enter a valid integer.')])),
+                ('status', models.CharField(choices=[('pending', 'Добавляется'), ('added', 'Добавлен'), ('failed', 'Не удалось добавить')], default='pending', max_length=10)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('buyer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('fiscal_drive_number', 'fiscal_document_number', 'fiscal_sign')},
+            },
+        ),
+    ]
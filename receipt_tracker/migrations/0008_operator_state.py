@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0007_pending_receipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperatorState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('tokens', models.FloatField(null=True)),
+                ('tokens_updated', models.DateTimeField(null=True)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('opened_until', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0008_operator_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['barcode'], name='receipt_tra_barcode_f62482_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productalias',
+            index=models.Index(fields=['seller', 'name'], name='receipt_tra_seller__56b44e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['buyer', 'created'], name='receipt_tra_buyer_i_e70c05_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='receipt',
+            index=models.Index(fields=['created'], name='receipt_tra_created_dcf056_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0009_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['name', 'product'], name='receipt_tra_name_f74ba6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsummary',
+            index=models.Index(fields=['last_price', 'product'], name='receipt_tra_last_pr_c1f264_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:11
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth, TruncWeek
+
+
+def fill_price_stats(apps, schema_editor):
+    PriceStats = apps.get_model('receipt_tracker', 'PriceStats')
+    ReceiptItem = apps.get_model('receipt_tracker', 'ReceiptItem')
+
+    for period, trunc in (('week', TruncWeek), ('month', TruncMonth)):
+        rows = ReceiptItem.objects \
+            .values(product_id=models.F('product_alias__product'), seller_id=models.F('receipt__seller'),
+                    start=trunc('receipt__created', output_field=models.DateField())) \
+            .annotate(min_price=models.Min('price'),
+                      max_price=models.Max('price'),
+                      avg_price=models.Avg('price'),
+                      item_count=models.Count('id'))
+        PriceStats.objects.bulk_create(PriceStats(
+            product_id=row['product_id'],
+            seller_id=row['seller_id'],
+            period=period,
+            start=row['start'],
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+            avg_price=Decimal(row['avg_price']).quantize(Decimal('0.01')),
+            item_count=row['item_count'],
+        ) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0010_product_summary_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('week', 'Неделя'), ('month', 'Месяц')], max_length=5)),
+                ('start', models.DateField()),
+                ('min_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('max_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('avg_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('item_count', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Product')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Seller')),
+            ],
+            options={
+                'unique_together': {('product', 'period', 'start', 'seller')},
+            },
+        ),
+        migrations.RunPython(fill_price_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:15
+
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+from statistics import median
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_seller_prices(apps, schema_editor):
+    SellerPrice = apps.get_model('receipt_tracker', 'SellerPrice')
+    ReceiptItem = apps.get_model('receipt_tracker', 'ReceiptItem')
+
+    recent_prices = defaultdict(list)
+    for product_id, seller_id, price in ReceiptItem.objects \
+            .filter(receipt__created__gte=datetime.utcnow() - timedelta(days=90)) \
+            .values_list('product_alias__product', 'receipt__seller', 'price'):
+        recent_prices[(product_id, seller_id)].append(price)
+    last_items = ReceiptItem.objects \
+        .order_by('product_alias__product', 'receipt__seller', '-receipt__created', '-id') \
+        .distinct('product_alias__product', 'receipt__seller') \
+        .values_list('product_alias__product', 'receipt__seller', 'price', 'receipt__created')
+    SellerPrice.objects.bulk_create(SellerPrice(
+        product_id=product_id,
+        seller_id=seller_id,
+        last_price=price,
+        last_seen=created,
+        median_price=Decimal(median(recent_prices[(product_id, seller_id)])).quantize(Decimal('0.01'))
+        if (product_id, seller_id) in recent_prices else None,
+    ) for product_id, seller_id, price, created in last_items)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipt_tracker', '0011_price_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerPrice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('last_seen', models.DateTimeField()),
+                ('median_price', models.DecimalField(decimal_places=2, help_text='За последние 90 дней', max_digits=10, null=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Product')),
+                ('seller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='receipt_tracker.Seller')),
+            ],
+            options={
+                'unique_together': {('product', 'seller')},
+            },
+        ),
+        migrations.RunPython(fill_seller_prices, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,12 @@
-from datetime import datetime
+from dataclasses import dataclass
+from datetime import date, datetime
 from decimal import Decimal
-from typing import List, Optional, Union
+from typing import Iterable, List, Optional, Union
 
 from django.contrib.auth import get_user_model
 from django.core.validators import integer_validator
 from django.db import models
+from django.utils.functional import cached_property
 
 User = get_user_model()
 
@@ -27,6 +29,11 @@ class Seller(models.Model):
 
 class Product(models.Model):
 
+    class Meta:
+        indexes = (
+            models.Index(fields=('barcode',)),
+        )
+
     user_friendly_name: str = models.CharField(max_length=100, null=True, blank=True)
     barcode = models.CharField(max_length=20, null=True, blank=True, validators=[integer_validator])
 
@@ -123,6 +130,12 @@ class NonFoodProduct(models.Model):
 
 class ProductAlias(models.Model):
 
+    class Meta:
+        # Не уникальный: в старых данных встречаются повторы, их разрешает выбор самого раннего псевдонима
+        indexes = (
+            models.Index(fields=('seller', 'name')),
+        )
+
     seller = models.ForeignKey(Seller, models.CASCADE)
     product: Product = models.ForeignKey(Product, models.CASCADE)
     name: str = models.CharField(max_length=100)
@@ -131,10 +144,36 @@ class ProductAlias(models.Model):
         return f'ProductAlias(product={self.product}, name={self.name})'
 
 
+class ProductSummary(models.Model):
+
+    class Meta:
+        indexes = (
+            models.Index(fields=('-last_buy', '-product')),
+            models.Index(fields=('name', 'product')),
+            models.Index(fields=('last_price', 'product')),
+        )
+
+    product = models.OneToOneField(Product, models.CASCADE, primary_key=True, related_name='summary')
+    name: str = models.CharField(max_length=100)
+    last_buy: datetime = models.DateTimeField()
+    last_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    min_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    max_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    avg_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    purchase_count: int = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'ProductSummary(product={self.name}, last_buy={self.last_buy}, last_price={self.last_price})'
+
+
 class Receipt(models.Model):
 
     class Meta:
         unique_together = ('fiscal_drive_number', 'fiscal_document_number', 'fiscal_sign')
+        indexes = (
+            models.Index(fields=('buyer', 'created')),
+            models.Index(fields=('created',)),
+        )
 
     seller = models.ForeignKey(Seller, models.CASCADE)
     buyer = models.ForeignKey(get_user_model(), models.CASCADE)
@@ -148,33 +187,82 @@ class Receipt(models.Model):
 
     @property
     def items(self) -> List['ReceiptItem']:
+        if 'receiptitem_set' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.receiptitem_set.all()
         return self.receiptitem_set.order_by('product_alias__name')
 
+    @cached_property
+    def rollup(self) -> 'ReceiptRollup':
+        return ReceiptRollup.from_items(self.items)
+
     @property
     def protein(self) -> Optional[Decimal]:
-        return self._get_food_value('protein')
+        return self.rollup.protein
 
     @property
     def fat(self) -> Optional[Decimal]:
-        return self._get_food_value('fat')
+        return self.rollup.fat
 
     @property
     def carbohydrate(self) -> Optional[Decimal]:
-        return self._get_food_value('carbohydrate')
+        return self.rollup.carbohydrate
 
     @property
     def calories(self) -> Optional[Decimal]:
-        return self._get_food_value('calories')
-
-    def _get_food_value(self, name) -> Optional[Decimal]:
-        values = [value for value in (getattr(item, name) for item in self.items) if value is not None]
-        if values:
-            return sum(values)
-        return None
+        return self.rollup.calories
 
     @property
     def non_checked_product_count(self) -> int:
-        return sum(not item.is_product_checked for item in self.items)
+        return self.rollup.non_checked_product_count
+
+
+class PendingReceipt(models.Model):
+
+    STATUS_PENDING = 'pending'
+    STATUS_ADDED = 'added'
+    STATUS_FAILED = 'failed'
+    STATUSES = (
+        (STATUS_PENDING, 'Добавляется'),
+        (STATUS_ADDED, 'Добавлен'),
+        (STATUS_FAILED, 'Не удалось добавить'),
+    )
+
+    class Meta:
+        unique_together = ('fiscal_drive_number', 'fiscal_document_number', 'fiscal_sign')
+
+    buyer = models.ForeignKey(get_user_model(), models.CASCADE)
+    fiscal_drive_number = models.CharField(max_length=50, validators=[integer_validator])
+    fiscal_document_number = models.CharField(max_length=50, validators=[integer_validator])
+    fiscal_sign = models.CharField(max_length=50, validators=[integer_validator])
+    status: str = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    created: datetime = models.DateTimeField(auto_now_add=True)
+    updated: datetime = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'PendingReceipt(fiscal_document_number={self.fiscal_document_number}, status={self.status})'
+
+
+@dataclass
+class ReceiptRollup:
+
+    protein: Optional[Decimal] = None
+    fat: Optional[Decimal] = None
+    carbohydrate: Optional[Decimal] = None
+    calories: Optional[Decimal] = None
+    non_checked_product_count: int = 0
+
+    @classmethod
+    def from_items(cls, items: Iterable['ReceiptItem']) -> 'ReceiptRollup':
+        rollup = cls()
+        for item in items:
+            if not item.is_product_checked:
+                rollup.non_checked_product_count += 1
+            for name in ('protein', 'fat', 'carbohydrate', 'calories'):
+                value = getattr(item, name)
+                if value is not None:
+                    total = getattr(rollup, name)
+                    setattr(rollup, name, value if total is None else total + value)
+        return rollup
 
 
 class ReceiptItem(models.Model):
@@ -184,32 +272,94 @@ class ReceiptItem(models.Model):
     price = models.DecimalField(decimal_places=2, max_digits=10)
     quantity = models.DecimalField(decimal_places=3, max_digits=6)
     total = models.DecimalField(decimal_places=2, max_digits=10)
+    weight: Optional[Decimal] = models.DecimalField(decimal_places=3, max_digits=12, null=True, blank=True,
+                                                    help_text='В граммах')
+    calories: Optional[Decimal] = models.DecimalField(decimal_places=2, max_digits=16, null=True, blank=True)
+    protein: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=12, null=True, blank=True)
+    fat: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=12, null=True, blank=True)
+    carbohydrate: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=12, null=True, blank=True)
 
     def __str__(self):
         return f'ReceiptItem(product_alias={self.product_alias}, quantity={self.quantity}, price={self.price})'
 
     @property
-    def protein(self) -> Optional[Decimal]:
-        return self._get_food_value('protein')
+    def is_product_checked(self) -> bool:
+        return self.product_alias.product.is_checked
 
-    @property
-    def fat(self) -> Optional[Decimal]:
-        return self._get_food_value('fat')
 
-    @property
-    def carbohydrate(self) -> Optional[Decimal]:
-        return self._get_food_value('carbohydrate')
+class DailyProductStats(models.Model):
 
-    @property
-    def calories(self) -> Optional[Decimal]:
-        return self._get_food_value('calories')
+    class Meta:
+        unique_together = ('buyer', 'day', 'product', 'seller')
 
-    def _get_food_value(self, name) -> Optional[Decimal]:
-        product = self.product_alias.product
-        if not product.is_food:
-            return None
-        return getattr(product.foodproduct, name) * product.foodproduct.weight / 100
+    buyer = models.ForeignKey(get_user_model(), models.CASCADE)
+    product = models.ForeignKey(Product, models.CASCADE)
+    seller = models.ForeignKey(Seller, models.CASCADE)
+    day: date = models.DateField()
+    quantity: Decimal = models.DecimalField(decimal_places=3, max_digits=12)
+    total: Decimal = models.DecimalField(decimal_places=2, max_digits=14)
+    weight: Optional[Decimal] = models.DecimalField(decimal_places=3, max_digits=16, null=True, help_text='В граммах')
+    calories: Optional[Decimal] = models.DecimalField(decimal_places=2, max_digits=20, null=True)
+    protein: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=16, null=True)
+    fat: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=16, null=True)
+    carbohydrate: Optional[Decimal] = models.DecimalField(decimal_places=4, max_digits=16, null=True)
+    # Сумма и количество отношений калорийности к стоимости по позициям, чтобы считать среднее за любой период
+    effectivity_sum: Decimal = models.DecimalField(decimal_places=6, max_digits=24)
+    effectivity_count: int = models.PositiveIntegerField()
+    item_count: int = models.PositiveIntegerField()
 
-    @property
-    def is_product_checked(self) -> bool:
-        return self.product_alias.product.is_checked
+    def __str__(self):
+        return f'DailyProductStats(buyer={self.buyer_id}, product={self.product_id}, day={self.day})'
+
+
+class PriceStats(models.Model):
+
+    PERIOD_WEEK = 'week'
+    PERIOD_MONTH = 'month'
+    PERIODS = (
+        (PERIOD_WEEK, 'Неделя'),
+        (PERIOD_MONTH, 'Месяц'),
+    )
+
+    class Meta:
+        unique_together = ('product', 'period', 'start', 'seller')
+
+    product = models.ForeignKey(Product, models.CASCADE)
+    seller = models.ForeignKey(Seller, models.CASCADE)
+    period: str = models.CharField(max_length=5, choices=PERIODS)
+    start: date = models.DateField()
+    min_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    max_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    avg_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    item_count: int = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'PriceStats(product={self.product_id}, period={self.period}, start={self.start})'
+
+
+class SellerPrice(models.Model):
+
+    class Meta:
+        unique_together = ('product', 'seller')
+
+    product = models.ForeignKey(Product, models.CASCADE)
+    seller = models.ForeignKey(Seller, models.CASCADE)
+    last_price: Decimal = models.DecimalField(decimal_places=2, max_digits=10)
+    last_seen: datetime = models.DateTimeField()
+    median_price: Optional[Decimal] = models.DecimalField(decimal_places=2, max_digits=10, null=True,
+                                                          help_text='За последние 90 дней')
+
+    def __str__(self):
+        return f'SellerPrice(product={self.product_id}, seller={self.seller_id}, last_price={self.last_price})'
+
+
+class OperatorState(models.Model):
+
+    name: str = models.CharField(max_length=100, unique=True)
+    tokens: Optional[float] = models.FloatField(null=True)
+    tokens_updated: Optional[datetime] = models.DateTimeField(null=True)
+    failures: int = models.PositiveIntegerField(default=0)
+    opened_until: Optional[datetime] = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f'OperatorState(name={self.name}, failures={self.failures}, opened_until={self.opened_until})'
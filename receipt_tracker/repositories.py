@@ -1,8 +1,22 @@
-from datetime import datetime, timedelta
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
-from typing import List, Optional
+from functools import partial
+from statistics import median
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 
-from receipt_tracker.models import NonFoodProduct, Product, ProductAlias, Receipt, ReceiptItem, Seller, User
+from django.db import connection
+from django.db.models import Avg, Count, DateField, DecimalField, ExpressionWrapper, F, Max, Min, OuterRef, Prefetch, \
+    Q, Subquery, Sum, Value
+from django.db.models.functions import Cast, NullIf, TruncDate, TruncMonth, TruncWeek
+from django.db.transaction import on_commit
+
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, PRODUCTS_SCOPE, PRODUCT_ALIASES_SCOPE, view_cache
+from receipt_tracker.models import DailyProductStats, FoodProduct, NonFoodProduct, OperatorState, PendingReceipt, \
+    PriceStats, Product, ProductAlias, ProductSummary, Receipt, ReceiptItem, Seller, SellerPrice, User
 
 
 class UserRepository:
@@ -21,31 +35,69 @@ class SellerRepository:
 
 class ProductRepository:
 
-    def create(self) -> Product:
-        return Product.objects.create()
+    def create_many(self, count: int) -> List[Product]:
+        return Product.objects.bulk_create(Product() for _ in range(count))
 
-    def get_all(self) -> List[Product]:
-        # TODO: сортировка
-        return Product.objects.all()
+    def get_all_with_aliases(self) -> List[Product]:
+        return Product.objects.prefetch_related('productalias_set')
 
     def get_by_id(self, product_id: int) -> Optional[Product]:
         return Product.objects.filter(id=product_id).first()
 
+    def get_with_details(self, product_id: int) -> Optional[Product]:
+        aliases = ProductAlias.objects.select_related('seller').order_by('id')
+        return Product.objects \
+            .filter(id=product_id) \
+            .select_related('foodproduct', 'nonfoodproduct') \
+            .prefetch_related(Prefetch('productalias_set', queryset=aliases)) \
+            .first()
+
+    def get_by_ids(self, product_ids: Iterable[int]) -> List[Product]:
+        return Product.objects \
+            .filter(id__in=product_ids) \
+            .select_related('foodproduct', 'nonfoodproduct') \
+            .prefetch_related('productalias_set')
+
+    def lock(self, product_ids: Iterable[int]) -> List[int]:
+        # Пересчёт денормализованных таблиц удаляет и заново вставляет строки продукта, поэтому параллельные
+        # пересчёты одного продукта выстраиваются в очередь на его строке. Порядок по id исключает взаимоблокировки
+        return list(Product.objects
+                    .select_for_update()
+                    .filter(id__in=set(product_ids))
+                    .order_by('id')
+                    .values_list('id', flat=True))
+
     def set_barcode(self, product_id: int, barcode: str) -> Optional[int]:
         product = self.get_by_id(product_id)
         original_product = Product.objects.filter(barcode=barcode).first()
         if not original_product:
             return None
-        ProductAlias.objects.filter(product=product).update(product=original_product)
+        product_alias_repository.repoint(product.id, original_product.id)
         product.delete()
+        self.update_stats([original_product.id])
+        on_commit(partial(view_cache.invalidate, LISTINGS_SCOPE, PRODUCTS_SCOPE))
+        on_commit(partial(similar_product_index.remove, product_id))
         return original_product.id
 
+    def update_stats(self, product_ids: Iterable[int]):
+        # Пересчитываем всё, что хранится по позициям чеков продуктов, за все дни и у всех покупателей
+        product_ids = set(product_ids)
+        product_summary_repository.update(product_ids)
+        receipt_item_repository.update_food_values_by_product_ids(product_ids)
+        daily_product_stats_repository.update_by_product_ids(product_ids)
+        price_stats_repository.update_by_product_ids(product_ids)
+        seller_price_repository.update_by_product_ids(product_ids)
+
     def set_non_food(self, product_id: int) -> bool:
         product = self.get_by_id(product_id)
         if not product.is_food:
             return False
         product.foodproduct.delete()
         NonFoodProduct.objects.create(product=product)
+        product_summary_repository.update([product_id])
+        receipt_item_repository.update_food_values_by_product_ids([product_id])
+        daily_product_stats_repository.update_by_product_ids([product_id])
+        on_commit(partial(view_cache.invalidate, LISTINGS_SCOPE, PRODUCTS_SCOPE))
         return True
 
     def merge(self, product_id: int, another_product_id: int):
@@ -60,17 +112,135 @@ class ProductRepository:
             details.product = product
             details.save()
 
-        ProductAlias.objects.filter(product=another_product).update(product=product)
+        product_alias_repository.repoint(another_product.id, product_id)
         another_product.delete()
+        self.update_stats([product_id])
+        on_commit(partial(view_cache.invalidate, LISTINGS_SCOPE, PRODUCTS_SCOPE))
+
+        on_commit(partial(similar_product_index.remove, another_product_id))
+        on_commit(partial(similar_product_index.add, product_id, product.name))
+
+
+class ProductSummaryRepository:
+
+    ORDERS = ('name', '-name', 'last_buy', '-last_buy', 'last_price', '-last_price')
+
+    def get_page(self, after: Optional[Tuple[object, int]], count: int, order: str = '-last_buy',
+                 search: Optional[str] = None) -> List[ProductSummary]:
+        field = order.lstrip('-')
+        lookup = 'lt' if order.startswith('-') else 'gt'
+        # Продукт в конце сортировки делает порядок однозначным, иначе курсор может пропустить строки
+        summaries = ProductSummary.objects \
+            .select_related('product__foodproduct', 'product__nonfoodproduct') \
+            .order_by(order, order.replace(field, 'product_id'))
+        if search:
+            summaries = summaries.filter(name__icontains=search)
+        if after:
+            value, product_id = after
+            # Последнее условие избыточно, но только его планировщик может отдать индексу
+            summaries = summaries.filter(Q(**{f'{field}__{lookup}': value}) |
+                                         Q(**{field: value, f'product_id__{lookup}': product_id}),
+                                         **{f'{field}__{lookup}e': value})
+        return list(summaries[:count])
+
+    def update(self, product_ids: Iterable[int]):
+        product_ids = product_repository.lock(product_ids)
+        aliases = ProductAlias.objects.filter(product=OuterRef('pk')).order_by('id')
+        items = ReceiptItem.objects.filter(product_alias__product=OuterRef('pk')).order_by('-receipt__created', '-id')
+        rows = Product.objects \
+            .filter(id__in=product_ids) \
+            .annotate(alias_name=Subquery(aliases.values('name')[:1]),
+                      summary_last_buy=Max('productalias__receiptitem__receipt__created'),
+                      summary_last_price=Subquery(items.values('price')[:1]),
+                      min_price=Min('productalias__receiptitem__price'),
+                      max_price=Max('productalias__receiptitem__price'),
+                      avg_price=Avg('productalias__receiptitem__price'),
+                      purchase_count=Count('productalias__receiptitem')) \
+            .values('id', 'user_friendly_name', 'alias_name', 'summary_last_buy', 'summary_last_price', 'min_price',
+                    'max_price', 'avg_price', 'purchase_count')
+        summaries = [ProductSummary(
+            product_id=row['id'],
+            name=row['user_friendly_name'] or row['alias_name'] or '?',
+            last_buy=row['summary_last_buy'],
+            last_price=row['summary_last_price'],
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+            avg_price=Decimal(row['avg_price']).quantize(Decimal('0.01')),
+            purchase_count=row['purchase_count'],
+        ) for row in rows if row['purchase_count']]
+        ProductSummary.objects.filter(product__in=product_ids).delete()
+        ProductSummary.objects.bulk_create(summaries)
+
+
+class CachedProductAlias(NamedTuple):
+
+    id: int
+    product_id: int
 
 
 class ProductAliasRepository:
 
-    def create(self, seller_id: int, product_id: int, name: str) -> ProductAlias:
-        return ProductAlias.objects.create(seller_id=seller_id, product_id=product_id, name=name)
-
-    def get_by_seller_and_name(self, seller_id: int, name: str) -> Optional[ProductAlias]:
-        return ProductAlias.objects.filter(seller=seller_id, name=name).first()
+    # Кэшируем псевдонимы по продавцам: в постоянном магазине почти все позиции чека уже знакомы.
+    # Новые псевдонимы и слияния продуктов сбрасывают кэш продавца во всех процессах через версию в общем кэше
+    CACHE_SIZE = 256
+    CACHE_TTL = timedelta(minutes=5)
+
+    def __init__(self):
+        self._cache: 'OrderedDict[int, Tuple[float, str, Dict[str, CachedProductAlias]]]' = OrderedDict()
+        self._cache_lock = Lock()
+
+    def create_many(self, aliases: Iterable[Tuple[int, int, str]]) -> List[ProductAlias]:
+        aliases = ProductAlias.objects.bulk_create(ProductAlias(seller_id=seller_id, product_id=product_id, name=name)
+                                                   for seller_id, product_id, name in aliases)
+        on_commit(partial(self.invalidate_cache, {alias.seller_id for alias in aliases}))
+        return aliases
+
+    def repoint(self, product_id: int, new_product_id: int):
+        aliases = ProductAlias.objects.filter(product=product_id)
+        seller_ids = set(aliases.values_list('seller_id', flat=True))
+        aliases.update(product=new_product_id)
+        if seller_ids:
+            on_commit(partial(self.invalidate_cache, seller_ids))
+
+    def get_cached_by_sellers_and_names(self, keys: Iterable[Tuple[int, str]]) \
+            -> Dict[Tuple[int, str], CachedProductAlias]:
+        keys = set(keys)
+        aliases = {seller_id: self._get_cached_by_seller(seller_id) for seller_id in {key[0] for key in keys}}
+        return {(seller_id, name): aliases[seller_id][name] for seller_id, name in keys if name in aliases[seller_id]}
+
+    def invalidate_cache(self, seller_ids: Optional[Iterable[int]] = None):
+        with self._cache_lock:
+            if seller_ids is None:
+                self._cache.clear()
+            else:
+                seller_ids = set(seller_ids)
+                for seller_id in seller_ids:
+                    self._cache.pop(seller_id, None)
+        view_cache.invalidate(*([PRODUCT_ALIASES_SCOPE] if seller_ids is None
+                                else map(self._get_seller_cache_scope, seller_ids)))
+
+    def _get_cached_by_seller(self, seller_id: int) -> Dict[str, CachedProductAlias]:
+        # Версию читаем до загрузки: если её сменят во время загрузки, запись просто перечитается в следующий раз
+        version = view_cache.get_version((PRODUCT_ALIASES_SCOPE, self._get_seller_cache_scope(seller_id)))
+        with self._cache_lock:
+            entry = self._cache.get(seller_id)
+            if entry and entry[1] == version and monotonic() - entry[0] < self.CACHE_TTL.total_seconds():
+                self._cache.move_to_end(seller_id)
+                return entry[2]
+        # При повторе имени побеждает самый старый псевдоним
+        aliases = {name: CachedProductAlias(alias_id, product_id) for alias_id, name, product_id in ProductAlias.objects
+                   .filter(seller=seller_id)
+                   .order_by('-id')
+                   .values_list('id', 'name', 'product_id')}
+        with self._cache_lock:
+            self._cache[seller_id] = (monotonic(), version, aliases)
+            self._cache.move_to_end(seller_id)
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return aliases
+
+    def _get_seller_cache_scope(self, seller_id: int) -> str:
+        return f'{PRODUCT_ALIASES_SCOPE}:{seller_id}'
 
 
 class ReceiptRepository:
@@ -81,45 +251,354 @@ class ReceiptRepository:
                                       fiscal_drive_number=fiscal_drive_number,
                                       fiscal_document_number=fiscal_document_number, fiscal_sign=fiscal_sign)
 
+    def create_many_if_not_exist(self, receipts: Iterable[Tuple[int, int, datetime, str, str, str]]) \
+            -> List[Optional[Receipt]]:
+        receipts = [Receipt(seller_id=seller_id, buyer_id=buyer_id, created=created,
+                            fiscal_drive_number=fiscal_drive_number, fiscal_document_number=fiscal_document_number,
+                            fiscal_sign=fiscal_sign)
+                    for seller_id, buyer_id, created, fiscal_drive_number, fiscal_document_number, fiscal_sign
+                    in receipts]
+        if not receipts:
+            return []
+        # bulk_create(ignore_conflicts=True) не возвращает идентификаторы, а без них не понять, чья вставка прошла
+        fields = [Receipt._meta.get_field(name) for name in ('seller', 'buyer', 'created', 'fiscal_drive_number',
+                                                             'fiscal_document_number', 'fiscal_sign')]
+        quote_name = connection.ops.quote_name
+        row = f'({", ".join(["%s"] * len(fields))})'
+        sql = f'''
+            INSERT INTO {quote_name(Receipt._meta.db_table)} ({", ".join(quote_name(f.column) for f in fields)})
+            VALUES {", ".join([row] * len(receipts))}
+            ON CONFLICT DO NOTHING
+            RETURNING {quote_name(Receipt._meta.pk.column)}, {", ".join(quote_name(f.column) for f in fields[3:])}
+        '''
+        params = [field.get_db_prep_save(getattr(receipt, field.attname), connection)
+                  for receipt in receipts for field in fields]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            ids = {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+        result = []
+        for receipt in receipts:
+            # Повтор внутри пачки тоже проигрывает: вставлена только первая строка
+            receipt.id = ids.pop((receipt.fiscal_drive_number, receipt.fiscal_document_number, receipt.fiscal_sign),
+                                 None)
+            receipt._state.adding = False
+            receipt._state.db = connection.alias
+            result.append(receipt if receipt.id else None)
+        return result
+
     def get_by_buyer_id(self, buyer_id: int) -> List[Receipt]:
         return Receipt.objects.filter(buyer=buyer_id)
 
-    def get_last_by_buyer_id(self, buyer_id: int) -> List[Receipt]:
-        now = datetime.utcnow()
-        return Receipt.objects \
-            .filter(buyer=buyer_id, created__range=(now - timedelta(days=30), now)) \
-            .order_by('-created')
+    def get_page_by_buyer_id_and_period(self, buyer_id: int, start: date, end: date,
+                                        after: Optional[Tuple[datetime, int]], count: int) -> List[Receipt]:
+        items = ReceiptItem.objects \
+            .select_related('product_alias__product__foodproduct', 'product_alias__product__nonfoodproduct') \
+            .prefetch_related('product_alias__product__productalias_set') \
+            .order_by('product_alias__name')
+        receipts = Receipt.objects \
+            .filter(buyer=buyer_id, created__gte=datetime.combine(start, time.min),
+                    created__lt=datetime.combine(end + timedelta(days=1), time.min)) \
+            .select_related('seller') \
+            .prefetch_related(Prefetch('receiptitem_set', queryset=items)) \
+            .order_by('-created', '-id')
+        if after:
+            created, receipt_id = after
+            receipts = receipts.filter(Q(created__lt=created) | Q(created=created, id__lt=receipt_id))
+        return list(receipts[:count])
 
     def is_exist(self, fiscal_drive_number: str, fiscal_document_number: str, fiscal_sign: str) -> bool:
         return Receipt.objects.filter(fiscal_drive_number=fiscal_drive_number,
                                       fiscal_document_number=fiscal_document_number, fiscal_sign=fiscal_sign).exists()
 
+    def get_existing_triples(self, triples: Iterable[Tuple[str, str, str]]) -> Set[Tuple[str, str, str]]:
+        triples = set(triples)
+        if not triples:
+            return set()
+        # Составного IN в ORM нет, поэтому выбираем по первым полям уникального индекса и уточняем на месте
+        existing = Receipt.objects \
+            .filter(fiscal_drive_number__in={triple[0] for triple in triples},
+                    fiscal_sign__in={triple[2] for triple in triples}) \
+            .values_list('fiscal_drive_number', 'fiscal_document_number', 'fiscal_sign')
+        return triples.intersection(existing)
+
+
+class PendingReceiptRepository:
+
+    # Задача добавления обновляет запись при каждом переносе, так что дольше этого молчит только потерянная задача
+    PENDING_TIMEOUT = timedelta(hours=6)
+
+    def claim(self, buyer_id: int, fiscal_drive_number: str, fiscal_document_number: str,
+              fiscal_sign: str) -> Optional[PendingReceipt]:
+        keys = {
+            'fiscal_drive_number': fiscal_drive_number,
+            'fiscal_document_number': fiscal_document_number,
+            'fiscal_sign': fiscal_sign,
+        }
+        # Новую запись защищает уникальный ключ, а существующую занимаем условным UPDATE,
+        # поэтому из одновременных добавлений одного чека задачу поставит только одно
+        pending_receipt, created = PendingReceipt.objects.get_or_create(**keys, defaults={'buyer_id': buyer_id})
+        if created:
+            return pending_receipt
+        now = datetime.utcnow()
+        is_claimed = PendingReceipt.objects \
+            .filter(**keys) \
+            .filter(~Q(status=PendingReceipt.STATUS_PENDING) | Q(updated__lt=now - self.PENDING_TIMEOUT)) \
+            .update(buyer_id=buyer_id, status=PendingReceipt.STATUS_PENDING, updated=now)
+        if not is_claimed:
+            return None
+        pending_receipt.refresh_from_db()
+        return pending_receipt
+
+    def get_by_id_and_buyer_id(self, pending_receipt_id: int, buyer_id: int) -> Optional[PendingReceipt]:
+        return PendingReceipt.objects.filter(id=pending_receipt_id, buyer=buyer_id).first()
+
+    def set_status(self, fiscal_drive_number: str, fiscal_document_number: str, fiscal_sign: str, status: str):
+        PendingReceipt.objects \
+            .filter(fiscal_drive_number=fiscal_drive_number, fiscal_document_number=fiscal_document_number,
+                    fiscal_sign=fiscal_sign) \
+            .update(status=status, updated=datetime.utcnow())
+
 
 class ReceiptItemRepository:
 
-    def create(self, receipt_id: int, product_alias_id: int, price: Decimal, quantity: Decimal,
-               total: Decimal) -> ReceiptItem:
-        return ReceiptItem.objects.create(receipt_id=receipt_id, product_alias_id=product_alias_id, price=price,
-                                          quantity=quantity, total=total)
+    def create_many(self, items: Iterable[Tuple[int, int, Decimal, Decimal, Decimal]]) -> List[ReceiptItem]:
+        return ReceiptItem.objects.bulk_create(ReceiptItem(receipt_id=receipt_id, product_alias_id=product_alias_id,
+                                                           price=price, quantity=quantity, total=total)
+                                               for receipt_id, product_alias_id, price, quantity, total in items)
 
     def get_last(self) -> List[ReceiptItem]:
         return ReceiptItem.objects.order_by('-receipt__created')[:50]
 
-    def get_last_by_buyer_id(self, buyer_id: int) -> List[ReceiptItem]:
-        now = datetime.utcnow()
-        return ReceiptItem.objects.filter(receipt__buyer=buyer_id,
-                                          receipt__created__range=(now - timedelta(days=30), now))
-
-    def get_by_product_id(self, product_id: int) -> List[ReceiptItem]:
-        return ReceiptItem.objects.filter(product_alias__product=product_id).order_by('-receipt__created')
+    def get_page_by_product_id(self, product_id: int, after: Optional[Tuple[datetime, int]],
+                               count: int) -> List[ReceiptItem]:
+        items = ReceiptItem.objects \
+            .filter(product_alias__product=product_id) \
+            .select_related('receipt__seller') \
+            .order_by('-receipt__created', '-id')
+        if after:
+            created, item_id = after
+            items = items.filter(Q(receipt__created__lt=created) | Q(receipt__created=created, id__lt=item_id))
+        return list(items[:count])
+
+    def update_food_values_by_product_ids(self, product_ids: Iterable[int]):
+        self._update_food_values(ReceiptItem.objects.filter(product_alias__product__in=product_ids))
+
+    def update_food_values_by_receipt_ids(self, receipt_ids: Iterable[int]):
+        self._update_food_values(ReceiptItem.objects.filter(receipt__in=receipt_ids))
+
+    def _update_food_values(self, items):
+        food_products = FoodProduct.objects.filter(product__productalias=OuterRef('product_alias'))
+
+        def get_value(name: str) -> Subquery:
+            value = ExpressionWrapper(Cast(name, DecimalField(max_digits=16, decimal_places=4)) * F('weight') / 100,
+                                      output_field=DecimalField())
+            return Subquery(food_products.annotate(value=value).values('value')[:1])
+
+        items.update(
+            weight=ExpressionWrapper(F('quantity') * Subquery(food_products.values('weight')[:1]),
+                                     output_field=DecimalField()),
+            calories=get_value('calories'),
+            protein=get_value('protein'),
+            fat=get_value('fat'),
+            carbohydrate=get_value('carbohydrate'),
+        )
 
     def is_exist_by_product_id_and_buyer_id(self, product_id: int, buyer_id: int) -> bool:
         return ReceiptItem.objects.filter(product_alias__product=product_id, receipt__buyer=buyer_id).exists()
 
 
+class DailyProductStatsRepository:
+
+    def get_product_stats(self, buyer_id: int, start: date, end: date) -> List[Dict]:
+        return DailyProductStats.objects \
+            .filter(buyer=buyer_id, day__range=(start, end)) \
+            .values('product_id') \
+            .annotate(total_sum=Sum('total'),
+                      weight_sum=Sum('weight'),
+                      calories_sum=Sum('calories'),
+                      protein_sum=Sum('protein'),
+                      fat_sum=Sum('fat'),
+                      carbohydrate_sum=Sum('carbohydrate'),
+                      effectivity_avg=ExpressionWrapper(
+                          Sum('effectivity_sum') / NullIf(Sum('effectivity_count'), Value(0)),
+                          output_field=DecimalField()))
+
+    def get_totals(self, buyer_id: int, start: date, end: date) -> Dict:
+        return DailyProductStats.objects \
+            .filter(buyer=buyer_id, day__range=(start, end)) \
+            .aggregate(total_sum=Sum('total'),
+                       calories_sum=Sum('calories'),
+                       protein_sum=Sum('protein'),
+                       fat_sum=Sum('fat'),
+                       carbohydrate_sum=Sum('carbohydrate'),
+                       non_checked_count=Sum('item_count', filter=Q(product__foodproduct__isnull=True,
+                                                                    product__nonfoodproduct__isnull=True)))
+
+    def update_by_buyer_id_and_days(self, buyer_id: int, days: Iterable[date]):
+        days = set(days)
+        stats = DailyProductStats.objects.filter(buyer=buyer_id, day__in=days)
+        items = ReceiptItem.objects.filter(receipt__buyer=buyer_id, receipt__created__date__in=days)
+        product_ids = product_repository.lock(
+            set(stats.values_list('product_id', flat=True)) |
+            set(items.values_list('product_alias__product_id', flat=True)))
+        self._update(stats.filter(product__in=product_ids), items.filter(product_alias__product__in=product_ids))
+
+    def update_by_product_ids(self, product_ids: Iterable[int]):
+        product_ids = product_repository.lock(product_ids)
+        self._update(DailyProductStats.objects.filter(product__in=product_ids),
+                     ReceiptItem.objects.filter(product_alias__product__in=product_ids))
+
+    def _update(self, stats, items):
+        rows = items \
+            .values(buyer_id=F('receipt__buyer'), product_id=F('product_alias__product'),
+                    seller_id=F('receipt__seller'), day=TruncDate('receipt__created')) \
+            .annotate(quantity_sum=Sum('quantity'),
+                      total_sum=Sum('total'),
+                      weight_sum=Sum('weight'),
+                      calories_sum=Sum('calories'),
+                      protein_sum=Sum('protein'),
+                      fat_sum=Sum('fat'),
+                      carbohydrate_sum=Sum('carbohydrate'),
+                      effectivity_sum=Sum(F('calories') / NullIf('total', Value(0))),
+                      effectivity_count=Count(F('calories') / NullIf('total', Value(0))),
+                      item_count=Count('id'))
+        new_stats = [DailyProductStats(
+            buyer_id=row['buyer_id'],
+            product_id=row['product_id'],
+            seller_id=row['seller_id'],
+            day=row['day'],
+            quantity=row['quantity_sum'],
+            total=row['total_sum'],
+            weight=row['weight_sum'],
+            calories=row['calories_sum'],
+            protein=row['protein_sum'],
+            fat=row['fat_sum'],
+            carbohydrate=row['carbohydrate_sum'],
+            effectivity_sum=row['effectivity_sum'] or 0,
+            effectivity_count=row['effectivity_count'],
+            item_count=row['item_count'],
+        ) for row in rows]
+        stats.delete()
+        DailyProductStats.objects.bulk_create(new_stats)
+
+
+class PriceStatsRepository:
+
+    PERIODS = {
+        PriceStats.PERIOD_WEEK: TruncWeek,
+        PriceStats.PERIOD_MONTH: TruncMonth,
+    }
+
+    def get_by_product_id(self, product_id: int, period: str) -> List[PriceStats]:
+        return PriceStats.objects \
+            .filter(product=product_id, period=period) \
+            .select_related('seller') \
+            .order_by('start', 'seller_id')
+
+    def update_by_product_ids(self, product_ids: Iterable[int], days: Optional[Iterable[date]] = None):
+        product_ids = product_repository.lock(product_ids)
+        stats = PriceStats.objects.filter(product__in=product_ids)
+        items = ReceiptItem.objects.filter(product_alias__product__in=product_ids)
+        if days is None:
+            new_stats = [stat for period in self.PERIODS for stat in self._get_stats(period, items)]
+        else:
+            # Пересчитываем только недели и месяцы, в которые попали новые чеки
+            days = set(days)
+            stats_filter = Q(pk__in=[])
+            new_stats = []
+            for period in self.PERIODS:
+                periods = {self._get_period(day, period) for day in days}
+                stats_filter |= Q(period=period, start__in=[start for start, _ in periods])
+                new_stats += self._get_stats(period, items.filter(self._get_created_filter(periods)))
+            stats = stats.filter(stats_filter)
+        stats.delete()
+        PriceStats.objects.bulk_create(new_stats)
+
+    def _get_stats(self, period: str, items) -> List[PriceStats]:
+        rows = items \
+            .values(product_id=F('product_alias__product'), seller_id=F('receipt__seller'),
+                    start=self.PERIODS[period]('receipt__created', output_field=DateField())) \
+            .annotate(min_price=Min('price'),
+                      max_price=Max('price'),
+                      avg_price=Avg('price'),
+                      item_count=Count('id'))
+        return [PriceStats(
+            product_id=row['product_id'],
+            seller_id=row['seller_id'],
+            period=period,
+            start=row['start'],
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+            avg_price=Decimal(row['avg_price']).quantize(Decimal('0.01')),
+            item_count=row['item_count'],
+        ) for row in rows]
+
+    def _get_period(self, day: date, period: str) -> Tuple[date, date]:
+        if period == PriceStats.PERIOD_WEEK:
+            start = day - timedelta(days=day.weekday())
+            return start, start + timedelta(days=7)
+        start = day.replace(day=1)
+        return start, (start + timedelta(days=32)).replace(day=1)
+
+    def _get_created_filter(self, periods: Iterable[Tuple[date, date]]) -> Q:
+        query = Q(pk__in=[])
+        for start, end in periods:
+            query |= Q(receipt__created__gte=datetime.combine(start, time.min),
+                       receipt__created__lt=datetime.combine(end, time.min))
+        return query
+
+
+class SellerPriceRepository:
+
+    MEDIAN_PERIOD = timedelta(days=90)
+
+    def get_by_product_ids(self, product_ids: Iterable[int]) -> List[SellerPrice]:
+        return SellerPrice.objects \
+            .filter(product__in=set(product_ids)) \
+            .select_related('seller') \
+            .order_by('product_id', 'last_price', 'seller_id')
+
+    def update_by_product_ids(self, product_ids: Iterable[int]):
+        product_ids = product_repository.lock(product_ids)
+        items = ReceiptItem.objects.filter(product_alias__product__in=product_ids)
+        recent_prices = defaultdict(list)
+        for product_id, seller_id, price in items \
+                .filter(receipt__created__gte=datetime.utcnow() - self.MEDIAN_PERIOD) \
+                .values_list('product_alias__product', 'receipt__seller', 'price'):
+            recent_prices[(product_id, seller_id)].append(price)
+        # DISTINCT ON оставляет по самой свежей позиции на каждую пару продукта и продавца
+        last_items = items \
+            .order_by('product_alias__product', 'receipt__seller', '-receipt__created', '-id') \
+            .distinct('product_alias__product', 'receipt__seller') \
+            .values_list('product_alias__product', 'receipt__seller', 'price', 'receipt__created')
+        new_prices = [SellerPrice(
+            product_id=product_id,
+            seller_id=seller_id,
+            last_price=price,
+            last_seen=created,
+            median_price=Decimal(median(recent_prices[(product_id, seller_id)])).quantize(Decimal('0.01'))
+            if (product_id, seller_id) in recent_prices else None,
+        ) for product_id, seller_id, price, created in last_items]
+        SellerPrice.objects.filter(product__in=product_ids).delete()
+        SellerPrice.objects.bulk_create(new_prices)
+
+
+class OperatorStateRepository:
+
+    def get_for_update(self, name: str) -> OperatorState:
+        OperatorState.objects.get_or_create(name=name)
+        return OperatorState.objects.select_for_update().get(name=name)
+
+
 user_repository = UserRepository()
 seller_repository = SellerRepository()
 product_repository = ProductRepository()
+product_summary_repository = ProductSummaryRepository()
 product_alias_repository = ProductAliasRepository()
 receipt_repository = ReceiptRepository()
+pending_receipt_repository = PendingReceiptRepository()
 receipt_item_repository = ReceiptItemRepository()
+daily_product_stats_repository = DailyProductStatsRepository()
+price_stats_repository = PriceStatsRepository()
+seller_price_repository = SellerPriceRepository()
+operator_state_repository = OperatorStateRepository()
@@ -92,6 +92,19 @@ STATIC_ROOT = os.path.join('..', 'static')
 
 LOGIN_URL = '/'
 
+DATA_DIR = env.str('DATA_DIR', os.path.join(BASE_DIR, 'data'))
+
+SIMILAR_PRODUCT_INDEX_PATH = os.path.join(DATA_DIR, 'similar_products.pickle')
+RECEIPT_CACHE_PATH = os.path.join(DATA_DIR, 'receipts')
+
+# Файловый кеш общий для веб-процессов и воркеров, поэтому сброс версий после загрузки чеков виден везде
+CACHES = {
+    'default': env.cache('CACHE_URL', f'filecache://{os.path.join(DATA_DIR, "cache")}'),
+}
+
+# database или memory
+OPERATOR_STATE_BACKEND = env.str('OPERATOR_STATE_BACKEND', 'database')
+
 CHECKER_LOGIN = env.str('CHECKER_LOGIN')
 CHECKER_PASSWORD = env.str('CHECKER_PASSWORD')
 CHECKER_DEVICE_ID = env.str('CHECKER_DEVICE_ID')
@@ -1,20 +1,33 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import partial
 from logging import getLogger
-from typing import Dict, Union
+from random import uniform
+from typing import Dict, List, Union
 
-from django.db.transaction import atomic
+from django.db.transaction import atomic, on_commit
 
 from receipt_tracker.celery import app
 from receipt_tracker.lib import ReceiptParams
-from receipt_tracker.lib.retrievers import ParsedReceipt, get_receipt_retriever
-from receipt_tracker.repositories import product_alias_repository, product_repository, receipt_item_repository, \
-    receipt_repository, seller_repository
+from receipt_tracker.lib.retrievers import OperatorUnavailable, ParsedReceipt, ReceiptNotReady, \
+    get_receipt_retriever
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, get_user_scope, view_cache
+from receipt_tracker.models import PendingReceipt
+from receipt_tracker.repositories import daily_product_stats_repository, pending_receipt_repository, \
+    price_stats_repository, product_alias_repository, product_repository, product_summary_repository, \
+    receipt_item_repository, receipt_repository, seller_price_repository, seller_repository
 
 logger = getLogger(__name__)
 
 ReceiptParamsDict = Dict[str, Union[str, int]]
 
+RECEIPT_POLL_DELAY = timedelta(seconds=5)
+MAX_RECEIPT_POLLS = 3
+RETRY_DELAY = timedelta(hours=1)
+# Разброс задержки, чтобы отложенные задачи не приходили к операторам разом
+RETRY_JITTER = 0.2
+
 
 def receipt_params_to_dict(params: ReceiptParams) -> ReceiptParamsDict:
     return {
@@ -37,16 +50,54 @@ def dict_to_receipt_params(params: ReceiptParamsDict) -> ReceiptParams:
 
 
 @app.task(bind=True)
-def add_receipt(task, user_id: int, raw_params: ReceiptParamsDict):
+def add_receipt(task, user_id: int, raw_params: ReceiptParamsDict, polls: int = 0):
     params = dict_to_receipt_params(raw_params)
     if receipt_repository.is_exist(params.fiscal_drive_number, params.fiscal_document_number, params.fiscal_sign):
         logger.info('Receipt %s already exists', params)
+        _set_pending_receipt_status(params, PendingReceipt.STATUS_ADDED)
         return
 
     logger.info('Adding receipt by params %s for user %s', params, user_id)
-    if not _retrieve_receipt(user_id, params):
-        logger.info('Receipt not retrieved, rescheduling task')
-        task.retry(countdown=timedelta(hours=1).total_seconds())
+    retry_delay = RETRY_DELAY
+    try:
+        is_retrieved = _retrieve_receipt(user_id, params)
+    except ReceiptNotReady:
+        if polls < MAX_RECEIPT_POLLS:
+            logger.info('Receipt is not ready yet, polling again in %s', RECEIPT_POLL_DELAY)
+            # Не засыпаем в воркере, а ставим задачу заново, сохраняя счётчик повторов
+            add_receipt.apply_async((user_id, raw_params), {'polls': polls + 1},
+                                    countdown=RECEIPT_POLL_DELAY.total_seconds(), retries=task.request.retries)
+            return
+        logger.info('Receipt is still not ready after %s polls', polls)
+        is_retrieved = False
+    except OperatorUnavailable as e:
+        logger.info('Operators are unavailable for %s', e.retry_after)
+        is_retrieved = False
+        retry_delay = max(retry_delay, e.retry_after)
+
+    if is_retrieved:
+        _set_pending_receipt_status(params, PendingReceipt.STATUS_ADDED)
+    elif task.max_retries is not None and task.request.retries >= task.max_retries:
+        logger.info('Receipt not retrieved, giving up after %s retries', task.request.retries)
+        _set_pending_receipt_status(params, PendingReceipt.STATUS_FAILED)
+    else:
+        countdown = retry_delay.total_seconds() * uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+        logger.info('Receipt not retrieved, rescheduling task in %s seconds', round(countdown))
+        # Отмечаем, что задача жива, иначе повторное добавление чека сочтёт её потерянной
+        _set_pending_receipt_status(params, PendingReceipt.STATUS_PENDING)
+        task.retry(kwargs={}, countdown=countdown)
+
+
+@app.task
+def build_similar_product_index():
+    if similar_product_index.build_if_not_built(
+            lambda: [(product.id, product.name) for product in product_repository.get_all_with_aliases()]):
+        logger.info('Similar product index built')
+
+
+def _set_pending_receipt_status(params: ReceiptParams, status: str):
+    pending_receipt_repository.set_status(params.fiscal_drive_number, params.fiscal_document_number,
+                                          params.fiscal_sign, status)
 
 
 def _retrieve_receipt(user_id: int, params: ReceiptParams) -> bool:
@@ -56,29 +107,63 @@ def _retrieve_receipt(user_id: int, params: ReceiptParams) -> bool:
             logger.info('Retriever returned no receipt')
             return False
         logger.info('Receipt retrieved, storing to database')
-        _store_to_db(user_id, parsed_receipt)
+        store_receipts(user_id, [parsed_receipt])
         return True
+    except (ReceiptNotReady, OperatorUnavailable):
+        raise
     except Exception as e:
         logger.warning('Cannot retrieve receipt: %s', e)
     return False
 
 
 @atomic
-def _store_to_db(user_id: int, parsed_receipt: ParsedReceipt):
-    seller = seller_repository.get_or_create(parsed_receipt.seller_individual_number, parsed_receipt.seller_name)
-    receipt = receipt_repository.create(seller.id, user_id, parsed_receipt.created, parsed_receipt.fiscal_drive_number,
-                                        parsed_receipt.fiscal_document_number, parsed_receipt.fiscal_sign)
-
-    for parsed_receipt_item in parsed_receipt.items:
-        product_alias = product_alias_repository.get_by_seller_and_name(seller.id, parsed_receipt_item.name)
-        if not product_alias:
-            logger.debug('No product alias found, creating new one')
-            product = product_repository.create()
-            product_alias = product_alias_repository.create(seller.id, product.id, parsed_receipt_item.name)
-            logger.info('Product %s and product alias %s created', product, product_alias)
-
-        receipt_item = receipt_item_repository.create(receipt.id, product_alias.id, parsed_receipt_item.price,
-                                                      parsed_receipt_item.quantity, parsed_receipt_item.total)
-        logger.debug('Receipt item %s created', receipt_item)
-
-    logger.info('Receipt %s created', receipt)
+def store_receipts(user_id: int, parsed_receipts: List[ParsedReceipt]) -> List[int]:
+    sellers = {}
+    for parsed_receipt in parsed_receipts:
+        if parsed_receipt.seller_individual_number not in sellers:
+            sellers[parsed_receipt.seller_individual_number] = seller_repository.get_or_create(
+                parsed_receipt.seller_individual_number, parsed_receipt.seller_name).id
+    receipts = receipt_repository.create_many_if_not_exist(
+        (sellers[parsed_receipt.seller_individual_number], user_id, parsed_receipt.created,
+         parsed_receipt.fiscal_drive_number, parsed_receipt.fiscal_document_number, parsed_receipt.fiscal_sign)
+        for parsed_receipt in parsed_receipts)
+    # Чеки, которые уже добавил кто-то другой, пропускаем целиком
+    if not all(receipts):
+        logger.info('%s receipts already exist, skipping them', receipts.count(None))
+        parsed_receipts = [parsed_receipt for receipt, parsed_receipt in zip(receipts, parsed_receipts) if receipt]
+        receipts = [receipt for receipt in receipts if receipt]
+        if not receipts:
+            return []
+
+    keys = [(sellers[parsed_receipt.seller_individual_number], parsed_receipt_item.name)
+            for parsed_receipt in parsed_receipts for parsed_receipt_item in parsed_receipt.items]
+    product_aliases = product_alias_repository.get_cached_by_sellers_and_names(keys)
+    new_keys = list(dict.fromkeys(key for key in keys if key not in product_aliases))
+    if new_keys:
+        logger.debug('No product aliases found for %s items, creating new ones', len(new_keys))
+        products = product_repository.create_many(len(new_keys))
+        new_product_aliases = product_alias_repository.create_many(
+            (seller_id, product.id, name) for (seller_id, name), product in zip(new_keys, products))
+        for product_alias in new_product_aliases:
+            product_aliases[(product_alias.seller_id, product_alias.name)] = product_alias
+        on_commit(partial(similar_product_index.add_many, [(product_alias.product_id, product_alias.name)
+                                                           for product_alias in new_product_aliases]))
+        logger.info('%s products and product aliases created', len(new_keys))
+
+    receipt_items = receipt_item_repository.create_many(
+        (receipt.id, product_aliases[(receipt.seller_id, parsed_receipt_item.name)].id, parsed_receipt_item.price,
+         parsed_receipt_item.quantity, parsed_receipt_item.total)
+        for receipt, parsed_receipt in zip(receipts, parsed_receipts) for parsed_receipt_item in parsed_receipt.items)
+    logger.debug('%s receipt items created', len(receipt_items))
+    receipt_item_repository.update_food_values_by_receipt_ids([receipt.id for receipt in receipts])
+    daily_product_stats_repository.update_by_buyer_id_and_days(user_id,
+                                                               {receipt.created.date() for receipt in receipts})
+
+    product_ids = {product_alias.product_id for product_alias in product_aliases.values()}
+    product_summary_repository.update(product_ids)
+    price_stats_repository.update_by_product_ids(product_ids, {receipt.created.date() for receipt in receipts})
+    seller_price_repository.update_by_product_ids(product_ids)
+    on_commit(partial(view_cache.invalidate, LISTINGS_SCOPE, get_user_scope(user_id)))
+
+    logger.info('%s receipts created', len(receipts))
+    return [receipt.id for receipt in receipts]
@@ -4,8 +4,11 @@ import pytest
 from django.urls import reverse
 from pytest import fixture
 
-from receipt_tracker.models import User
-from receipt_tracker.repositories import product_repository
+from receipt_tracker import admin
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, PRODUCTS_SCOPE, view_cache
+from receipt_tracker.models import DailyProductStats, PriceStats, Product, ProductSummary, SellerPrice, User
+from receipt_tracker.repositories import product_alias_repository, product_repository
 
 pytestmark = pytest.mark.django_db
 
@@ -21,6 +24,69 @@ def admin_client(client, staff_user):
     return client
 
 
+class TestViewCacheInvalidatingAdmin:
+
+    def test_change_seller(self, mocker, admin_client, seller):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(view_cache, 'invalidate')
+        response = admin_client.post(reverse('admin:receipt_tracker_seller_change', args=(seller.id,)), {
+            'individual_number': '1234567890',
+            'original_name': seller.original_name,
+            'user_friendly_name': 'foo',
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+
+    def test_delete_receipt_item(self, mocker, admin_client, receipt_item):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(view_cache, 'invalidate')
+        response = admin_client.post(reverse('admin:receipt_tracker_receiptitem_delete', args=(receipt_item.id,)), {
+            'post': 'yes',
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+        assert not DailyProductStats.objects.exists()
+        assert not SellerPrice.objects.exists()
+
+    def test_delete_receipts(self, mocker, admin_client, receipt, receipt_item):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(view_cache, 'invalidate')
+        response = admin_client.post(reverse('admin:receipt_tracker_receipt_changelist'), {
+            'action': 'delete_selected',
+            '_selected_action': [receipt.id],
+            'post': 'yes',
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+        assert not DailyProductStats.objects.exists()
+        assert not PriceStats.objects.exists()
+
+
+class TestProductAliasAdmin:
+
+    def test_change(self, mocker, admin_client, product_alias):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(product_alias_repository, 'invalidate_cache')
+        response = admin_client.post(reverse('admin:receipt_tracker_productalias_change', args=(product_alias.id,)), {
+            'seller': product_alias.seller_id,
+            'product': product_alias.product_id,
+            'name': 'foo',
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        product_alias_repository.invalidate_cache.assert_called_once_with()
+
+    def test_change_if_product_changed(self, mixer, admin_client, product_alias, receipt_item):
+        another_product = mixer.blend(Product)
+        response = admin_client.post(reverse('admin:receipt_tracker_productalias_change', args=(product_alias.id,)), {
+            'seller': product_alias.seller_id,
+            'product': another_product.id,
+            'name': product_alias.name,
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        for model in (ProductSummary, DailyProductStats, PriceStats, SellerPrice):
+            assert set(model.objects.values_list('product', flat=True)) == {another_product.id}
+
+
 class TestProductAdmin:
 
     def test_changelist(self, admin_client, product):
@@ -39,3 +105,46 @@ class TestProductAdmin:
         })
         assert response.status_code == HTTPStatus.FOUND
         assert product_repository.set_non_food.called
+
+    def test_change_if_view_cache_invalidated(self, mocker, admin_client, product):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(view_cache, 'invalidate')
+        response = admin_client.post(reverse('admin:receipt_tracker_product_change', args=(product.id,)), {
+            'user_friendly_name': 'foo',
+            '_save': 'foo',
+            'foodproduct-TOTAL_FORMS': 0,
+            'foodproduct-INITIAL_FORMS': 0,
+            'nonfoodproduct-TOTAL_FORMS': 0,
+            'nonfoodproduct-INITIAL_FORMS': 0,
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+
+    def test_change_if_similar_product_index_updated(self, mocker, admin_client, product):
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'add')
+        response = admin_client.post(reverse('admin:receipt_tracker_product_change', args=(product.id,)), {
+            'user_friendly_name': 'foo',
+            '_save': 'foo',
+            'foodproduct-TOTAL_FORMS': 0,
+            'foodproduct-INITIAL_FORMS': 0,
+            'nonfoodproduct-TOTAL_FORMS': 0,
+            'nonfoodproduct-INITIAL_FORMS': 0,
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        similar_product_index.add.assert_called_once_with(product.id, 'foo')
+
+    def test_change_if_name_not_changed(self, mocker, admin_client, mixer):
+        product = mixer.blend(Product, user_friendly_name='foo')
+        mocker.patch.object(admin, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'add')
+        response = admin_client.post(reverse('admin:receipt_tracker_product_change', args=(product.id,)), {
+            'user_friendly_name': 'foo',
+            '_save': 'foo',
+            'foodproduct-TOTAL_FORMS': 0,
+            'foodproduct-INITIAL_FORMS': 0,
+            'nonfoodproduct-TOTAL_FORMS': 0,
+            'nonfoodproduct-INITIAL_FORMS': 0,
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        assert not similar_product_index.add.called
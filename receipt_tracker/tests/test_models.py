@@ -1,7 +1,9 @@
+from decimal import Decimal
+
 import pytest
 from pytest import fixture
 
-from receipt_tracker.models import Product, ReceiptItem
+from receipt_tracker.models import Product, Receipt, ReceiptItem, ReceiptRollup
 
 pytestmark = pytest.mark.django_db
 
@@ -99,6 +101,38 @@ class TestReceipt:
         result = receipt.calories
         assert result == 1
 
+    def test_calories_if_no_food(self, receipt, receipt_item):
+        result = receipt.calories
+        assert result is None
+
+    def test_non_checked_product_count(self, receipt, receipt_item):
+        result = receipt.non_checked_product_count
+        assert result == 1
+
+    def test_items_if_prefetched(self, django_assert_num_queries, receipt, receipt_item):
+        receipt = Receipt.objects.prefetch_related('receiptitem_set').get(id=receipt.id)
+        with django_assert_num_queries(0):
+            result = receipt.items
+            assert list(result) == [receipt_item]
+
+
+class TestReceiptRollup:
+
+    def test_from_items(self, mocker):
+        items = [
+            mocker.Mock(protein=Decimal(1), fat=Decimal(2), carbohydrate=Decimal(3), calories=4,
+                        is_product_checked=True),
+            mocker.Mock(protein=None, fat=None, carbohydrate=None, calories=None, is_product_checked=False),
+            mocker.Mock(protein=Decimal(1), fat=Decimal(2), carbohydrate=Decimal(3), calories=4,
+                        is_product_checked=True),
+        ]
+        result = ReceiptRollup.from_items(items)
+        assert result == ReceiptRollup(Decimal(2), Decimal(4), Decimal(6), 8, 1)
+
+    def test_from_items_if_no_items(self):
+        result = ReceiptRollup.from_items([])
+        assert result == ReceiptRollup()
+
 
 class TestReceiptItem:
 
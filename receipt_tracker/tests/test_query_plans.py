@@ -0,0 +1,197 @@
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from pytest import fixture
+
+from receipt_tracker import repositories
+from receipt_tracker.models import DailyProductStats, PendingReceipt, PriceStats, Product, ProductAlias, \
+    ProductSummary, Receipt, ReceiptItem
+from receipt_tracker.repositories import daily_product_stats_repository, pending_receipt_repository, \
+    price_stats_repository, product_alias_repository, product_repository, product_summary_repository, \
+    receipt_item_repository, receipt_repository, seller_price_repository, seller_repository, user_repository
+
+pytestmark = pytest.mark.django_db
+
+# Эти узлы отдают строки по мере чтения, поэтому LIMIT над ними останавливает и просмотр
+STREAMING_NODES = {'Limit', 'Nested Loop', 'Result', 'Subquery Scan', 'Unique'}
+SCAN_NODES = {'Seq Scan', 'Index Scan', 'Index Only Scan'}
+
+
+def get_full_scans(node: dict, is_limited: bool = False) -> List[str]:
+    node_type = node['Node Type']
+    scans = []
+    # Просмотр индекса по порядку под LIMIT читает только нужные строки, если ничего не отбрасывает фильтром
+    is_ordered = is_limited and 'Filter' not in node
+    if node_type in SCAN_NODES and not is_ordered and (node_type == 'Seq Scan' or 'Index Cond' not in node):
+        scans.append(f'{node_type} on {node["Relation Name"]}')
+    is_limited = node_type in STREAMING_NODES and (is_limited or node_type == 'Limit')
+    for i, child in enumerate(node.get('Plans', [])):
+        # Внутренняя часть вложенного цикла выполняется для каждой внешней строки, ограничение на неё не действует
+        scans += get_full_scans(child, is_limited and (node_type != 'Nested Loop' or i == 0))
+    return scans
+
+
+@fixture(autouse=True)
+def data(mixer, user, seller, another_seller):
+    products = mixer.cycle(10).blend(Product, barcode=mixer.sequence(lambda i: str(i)))
+    aliases = mixer.cycle(10).blend(ProductAlias, seller=mixer.sequence(seller, another_seller),
+                                    product=(product for product in products))
+    receipts = mixer.cycle(10).blend(Receipt, seller=seller, buyer=user,
+                                     created=mixer.sequence(lambda i: datetime(2019, 6, 1) + timedelta(days=i)))
+    mixer.cycle(10).blend(ReceiptItem, receipt=(receipt for receipt in receipts),
+                          product_alias=(alias for alias in aliases))
+    mixer.cycle(10).blend(ProductSummary, product=(product for product in products))
+    mixer.cycle(10).blend(DailyProductStats, buyer=user, seller=seller, product=(product for product in products))
+    mixer.cycle(10).blend(PendingReceipt, buyer=user)
+
+
+@fixture
+def assert_no_full_scan():
+    def assert_no_full_scan(func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        queries = [query['sql'] for query in context.captured_queries
+                   if query['sql'].split(None, 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE')]
+        assert queries
+        with connection.cursor() as cursor:
+            # На маленьких таблицах полный просмотр всегда дешевле, поэтому запрещаем его и смотрим, остался ли он.
+            # Соединения оставляем только вложенными циклами, чтобы выбор плана не зависел от статистики
+            cursor.execute('SET LOCAL enable_seqscan = off; SET LOCAL enable_hashjoin = off; '
+                           'SET LOCAL enable_mergejoin = off')
+            for sql in queries:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                assert get_full_scans(plan[0]['Plan']) == [], sql
+    return assert_no_full_scan
+
+
+@fixture
+def product_alias():
+    return ProductAlias.objects.first()
+
+
+@fixture
+def receipt():
+    return Receipt.objects.first()
+
+
+@fixture
+def pending_receipt():
+    return PendingReceipt.objects.first()
+
+
+class TestQueryPlans:
+
+    # Выборку всей таблицы (ProductRepository.get_all_with_aliases) намеренно не проверяем
+
+    def test_user_get_by_name(self, assert_no_full_scan, user):
+        assert_no_full_scan(lambda: user_repository.get_by_name(user.username))
+
+    def test_seller_get_or_create(self, assert_no_full_scan, seller):
+        assert_no_full_scan(lambda: seller_repository.get_or_create(seller.individual_number, 'foo'))
+
+    def test_product_get_by_ids(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: list(product_repository.get_by_ids([product_alias.product_id])))
+
+    def test_product_set_barcode(self, mocker, assert_no_full_scan, product_alias):
+        mocker.patch.object(repositories, 'on_commit')
+        assert_no_full_scan(lambda: product_repository.set_barcode(product_alias.product_id, '1'))
+
+    def test_product_merge(self, mocker, assert_no_full_scan):
+        mocker.patch.object(repositories, 'on_commit')
+        product, another_product = Product.objects.all()[:2]
+        assert_no_full_scan(lambda: product_repository.merge(product.id, another_product.id))
+
+    def test_product_set_non_food(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: product_repository.set_non_food(product_alias.product_id))
+
+    def test_product_summary_get_page(self, assert_no_full_scan):
+        assert_no_full_scan(lambda: product_summary_repository.get_page((datetime(2019, 6, 5), 1), 5))
+
+    def test_product_summary_get_page_if_ordered_by_name(self, assert_no_full_scan):
+        assert_no_full_scan(lambda: product_summary_repository.get_page(('foo', 1), 5, 'name'))
+
+    def test_product_summary_get_page_if_ordered_by_last_price(self, assert_no_full_scan):
+        assert_no_full_scan(lambda: product_summary_repository.get_page((Decimal('10'), 1), 5, '-last_price'))
+
+    def test_product_summary_update(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: product_summary_repository.update([product_alias.product_id]))
+
+    def test_product_alias_get_cached_by_sellers_and_names(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: product_alias_repository.get_cached_by_sellers_and_names(
+            [(product_alias.seller_id, product_alias.name)]))
+
+    def test_receipt_get_page_by_buyer_id_and_period(self, assert_no_full_scan, user):
+        assert_no_full_scan(lambda: receipt_repository.get_page_by_buyer_id_and_period(
+            user.id, date(2019, 6, 2), date(2019, 6, 5), (datetime(2019, 6, 4), 1), 50))
+
+    def test_receipt_is_exist(self, assert_no_full_scan, receipt):
+        assert_no_full_scan(lambda: receipt_repository.is_exist(receipt.fiscal_drive_number,
+                                                               receipt.fiscal_document_number, receipt.fiscal_sign))
+
+    def test_receipt_get_existing_triples(self, assert_no_full_scan, receipt):
+        assert_no_full_scan(lambda: receipt_repository.get_existing_triples(
+            [(receipt.fiscal_drive_number, receipt.fiscal_document_number, receipt.fiscal_sign)]))
+
+    def test_pending_receipt_get_by_id_and_buyer_id(self, assert_no_full_scan, user, pending_receipt):
+        assert_no_full_scan(lambda: pending_receipt_repository.get_by_id_and_buyer_id(pending_receipt.id, user.id))
+
+    def test_pending_receipt_claim(self, assert_no_full_scan, user, pending_receipt):
+        assert_no_full_scan(lambda: pending_receipt_repository.claim(
+            user.id, pending_receipt.fiscal_drive_number, pending_receipt.fiscal_document_number,
+            pending_receipt.fiscal_sign))
+
+    def test_pending_receipt_set_status(self, assert_no_full_scan, pending_receipt):
+        assert_no_full_scan(lambda: pending_receipt_repository.set_status(
+            pending_receipt.fiscal_drive_number, pending_receipt.fiscal_document_number, pending_receipt.fiscal_sign,
+            PendingReceipt.STATUS_ADDED))
+
+    def test_receipt_item_get_last(self, assert_no_full_scan):
+        assert_no_full_scan(lambda: list(receipt_item_repository.get_last()))
+
+    def test_receipt_item_get_page_by_product_id(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: receipt_item_repository.get_page_by_product_id(product_alias.product_id,
+                                                                                  (datetime(2019, 6, 5), 1), 5))
+
+    def test_receipt_item_update_food_values_by_receipt_ids(self, assert_no_full_scan, receipt):
+        assert_no_full_scan(lambda: receipt_item_repository.update_food_values_by_receipt_ids([receipt.id]))
+
+    def test_receipt_item_is_exist_by_product_id_and_buyer_id(self, assert_no_full_scan, user, product_alias):
+        assert_no_full_scan(lambda: receipt_item_repository.is_exist_by_product_id_and_buyer_id(
+            product_alias.product_id, user.id))
+
+    def test_daily_product_stats_get_product_stats(self, assert_no_full_scan, user):
+        assert_no_full_scan(lambda: list(daily_product_stats_repository.get_product_stats(
+            user.id, date(2019, 6, 2), date(2019, 6, 5))))
+
+    def test_daily_product_stats_get_totals(self, assert_no_full_scan, user):
+        assert_no_full_scan(lambda: daily_product_stats_repository.get_totals(user.id, date(2019, 6, 2),
+                                                                             date(2019, 6, 5)))
+
+    def test_daily_product_stats_update_by_buyer_id_and_days(self, assert_no_full_scan, user):
+        assert_no_full_scan(lambda: daily_product_stats_repository.update_by_buyer_id_and_days(user.id,
+                                                                                              [date(2019, 6, 2)]))
+
+    def test_daily_product_stats_update_by_product_ids(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: daily_product_stats_repository.update_by_product_ids([product_alias.product_id]))
+
+    def test_price_stats_get_by_product_id(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: list(price_stats_repository.get_by_product_id(product_alias.product_id,
+                                                                                 PriceStats.PERIOD_WEEK)))
+
+    def test_price_stats_update_by_product_ids(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: price_stats_repository.update_by_product_ids([product_alias.product_id],
+                                                                                 [date(2019, 6, 2)]))
+
+    def test_seller_price_get_by_product_ids(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: list(seller_price_repository.get_by_product_ids([product_alias.product_id])))
+
+    def test_seller_price_update_by_product_ids(self, assert_no_full_scan, product_alias):
+        assert_no_full_scan(lambda: seller_price_repository.update_by_product_ids([product_alias.product_id]))
@@ -1,16 +1,57 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from functools import partial
+from threading import Barrier, Thread
+from typing import Callable
 
 import pytest
+from django.db import connection
+from django.db.transaction import atomic
 from pytest import fixture
 
-from receipt_tracker.models import FoodProduct, Product, Receipt, ReceiptItem, User
-from receipt_tracker.repositories import product_alias_repository, product_repository, receipt_item_repository, \
-    receipt_repository, seller_repository, user_repository
+from receipt_tracker import repositories
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, PRODUCTS_SCOPE, PRODUCT_ALIASES_SCOPE, view_cache
+from receipt_tracker.models import DailyProductStats, FoodProduct, PendingReceipt, PriceStats, Product, \
+    ProductAlias, ProductSummary, Receipt, ReceiptItem, SellerPrice, User
+from receipt_tracker.repositories import daily_product_stats_repository, pending_receipt_repository, \
+    price_stats_repository, product_alias_repository, product_repository, product_summary_repository, \
+    receipt_item_repository, receipt_repository, seller_price_repository, seller_repository, user_repository
 
 pytestmark = pytest.mark.django_db
 
 
+def _run_concurrently(prepare: Callable[[int], None], update: Callable[[], None], count: int = 2):
+    # Каждый поток работает в своём соединении, а барьер сводит транзакции до коммита первой из них
+    barrier = Barrier(count, timeout=10)
+    errors = []
+
+    def run(index: int):
+        try:
+            with atomic():
+                prepare(index)
+                barrier.wait()
+                update()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def _add_receipt_item(seller_id: int, buyer_id: int, product_alias_id: int, index: int, created: datetime):
+    receipt = Receipt.objects.create(seller_id=seller_id, buyer_id=buyer_id, created=created,
+                                     fiscal_drive_number='1', fiscal_document_number=str(index), fiscal_sign='1')
+    ReceiptItem.objects.create(receipt=receipt, product_alias_id=product_alias_id, price=Decimal(10),
+                               quantity=Decimal(1), total=Decimal(10))
+
+
 class TestUserRepository:
 
     def test_get_by_name_if_not_exist(self):
@@ -44,15 +85,10 @@ class TestProductRepository:
     def another_food_product(self, mixer, another_product):
         return mixer.blend(FoodProduct, product=another_product)
 
-    def test_create(self):
-        result = product_repository.create()
-        assert result.id
-
-    def test_get_all(self, product, another_product):
-        result = product_repository.get_all()
+    def test_create_many(self):
+        result = product_repository.create_many(2)
         assert len(result) == 2
-        assert result[0].id == product.id
-        assert result[1].id == another_product.id
+        assert all(product.id for product in result)
 
     def test_get_by_id_if_not_found(self):
         result = product_repository.get_by_id(1)
@@ -62,6 +98,20 @@ class TestProductRepository:
         result = product_repository.get_by_id(product.id)
         assert result.id == product.id
 
+    def test_get_with_details(self, django_assert_num_queries, product, food_product, product_alias,
+                              another_product_alias):
+        with django_assert_num_queries(2):
+            result = product_repository.get_with_details(product.id)
+            assert result.is_food
+            assert not result.is_non_food
+            assert result.name == product_alias.name
+            assert [alias.seller.name for alias in result.aliases] == [product_alias.seller.name,
+                                                                       another_product_alias.seller.name]
+
+    def test_get_with_details_if_not_found(self):
+        result = product_repository.get_with_details(1)
+        assert result is None
+
     def test_set_barcode_if_original_product_not_found(self, product):
         result = product_repository.set_barcode(product.id, 1)
         assert result is None
@@ -73,6 +123,28 @@ class TestProductRepository:
         product_alias.refresh_from_db()
         assert product_alias.product.id == product_with_barcode.id
 
+    def test_set_barcode_if_cached_alias_updated(self, mocker, product, product_alias, product_with_barcode):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        product_repository.set_barcode(product.id, product_with_barcode.barcode)
+        result = product_alias_repository.get_cached_by_sellers_and_names(keys)
+        assert result[keys[0]].product_id == product_with_barcode.id
+
+    def test_set_barcode_if_similar_product_index_updated(self, mocker, product, product_with_barcode):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        product_repository.set_barcode(product.id, product_with_barcode.barcode)
+        similar_product_index.remove.assert_called_once_with(product.id)
+
+    def test_set_barcode_if_view_cache_invalidated(self, mocker, product, product_with_barcode):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        mocker.patch.object(view_cache, 'invalidate')
+        product_repository.set_barcode(product.id, product_with_barcode.barcode)
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+
     def test_set_non_food_if_non_food(self, product, non_food_product):
         result = product_repository.set_non_food(product.id)
         assert not result
@@ -81,9 +153,26 @@ class TestProductRepository:
         result = product_repository.set_non_food(product.id)
         assert result
 
+    def test_set_non_food_if_view_cache_invalidated(self, mocker, product, food_product):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(view_cache, 'invalidate')
+        product_repository.set_non_food(product.id)
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
+
+    def test_set_non_food_if_summary_updated(self, mocker, product, food_product):
+        mocker.patch.object(product_summary_repository, 'update')
+        product_repository.set_non_food(product.id)
+        product_summary_repository.update.assert_called_once_with([product.id])
+
         product.refresh_from_db()
         assert product.is_non_food
 
+    def test_set_non_food_if_receipt_item_food_values_cleared(self, product, food_product, receipt_item):
+        product_repository.set_non_food(product.id)
+
+        receipt_item.refresh_from_db()
+        assert receipt_item.calories is None
+
     def test_merge_if_details_copied(self, product, another_product, another_food_product):
         product_repository.merge(product.id, another_product.id)
 
@@ -94,19 +183,195 @@ class TestProductRepository:
         another_food_product.refresh_from_db()
         assert another_food_product.product.id == product.id
 
+    def test_merge_if_receipt_item_food_values_updated(self, mixer, product, another_product, another_food_product):
+        receipt_item = mixer.blend(ReceiptItem, product_alias__product=product)
+        product_repository.merge(product.id, another_product.id)
+
+        receipt_item.refresh_from_db()
+        assert receipt_item.calories == another_food_product.calories * another_food_product.weight / Decimal(100)
+
     def test_merge_if_no_details(self, product, another_product):
         product_repository.merge(product.id, another_product.id)
 
+    def test_merge_if_summary_updated(self, mixer, product, another_product):
+        mixer.blend(ReceiptItem, product_alias__product=product, price=Decimal('1'))
+        mixer.blend(ReceiptItem, product_alias__product=another_product, price=Decimal('3'))
+        product_repository.merge(product.id, another_product.id)
+
+        summary = ProductSummary.objects.get(product=product)
+        assert summary.purchase_count == 2
+        assert summary.avg_price == Decimal('2')
+        assert not ProductSummary.objects.filter(product=another_product).exists()
+
+    def test_merge_if_cached_alias_updated(self, mocker, product, another_product, product_alias):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        product_alias.product = another_product
+        product_alias.save()
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        product_repository.merge(product.id, another_product.id)
+        result = product_alias_repository.get_cached_by_sellers_and_names(keys)
+        assert result[keys[0]].product_id == product.id
 
-class TestProductAliasRepository:
+    def test_merge_if_similar_product_index_updated(self, mocker, product, another_product):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        mocker.patch.object(similar_product_index, 'add')
+        product_repository.merge(product.id, another_product.id)
+        similar_product_index.remove.assert_called_once_with(another_product.id)
+        similar_product_index.add.assert_called_once_with(product.id, 'foo')
+
+    def test_merge_if_view_cache_invalidated(self, mocker, product, another_product):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        mocker.patch.object(similar_product_index, 'remove')
+        mocker.patch.object(similar_product_index, 'add')
+        mocker.patch.object(view_cache, 'invalidate')
+        product_repository.merge(product.id, another_product.id)
+        view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, PRODUCTS_SCOPE)
 
-    def test_create(self, seller, product):
-        result = product_alias_repository.create(seller.id, product.id, 'foo')
-        assert result.id
 
-    def test_get_by_seller_and_name(self, seller, product_alias, another_product_alias):
-        result = product_alias_repository.get_by_seller_and_name(seller.id, product_alias.name)
-        assert result.id == product_alias.id
+class TestProductSummaryRepository:
+
+    @fixture
+    def receipt_items(self, mixer, product, product_alias):
+        return [
+            mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal('10'),
+                        receipt__created=datetime(2019, 1, 1)),
+            mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal('30'),
+                        receipt__created=datetime(2019, 1, 3)),
+            mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal('15'),
+                        receipt__created=datetime(2019, 1, 2)),
+        ]
+
+    @fixture
+    def summaries(self, mixer):
+        return [
+            mixer.blend(ProductSummary, last_buy=datetime(2019, 1, 1)),
+            mixer.blend(ProductSummary, last_buy=datetime(2019, 1, 2)),
+            mixer.blend(ProductSummary, last_buy=datetime(2019, 1, 2)),
+        ]
+
+    def test_update(self, product, product_alias, receipt_items):
+        product_summary_repository.update([product.id])
+
+        summary = ProductSummary.objects.get(product=product)
+        assert summary.name == product.name
+        assert summary.last_buy == datetime(2019, 1, 3)
+        assert summary.last_price == Decimal('30')
+        assert summary.min_price == Decimal('10')
+        assert summary.max_price == Decimal('30')
+        assert summary.avg_price == Decimal('18.33')
+        assert summary.purchase_count == 3
+
+    @pytest.mark.django_db(transaction=True)
+    def test_update_if_concurrent(self, user, seller, product, product_alias):
+        _run_concurrently(partial(_add_receipt_item, seller.id, user.id, product_alias.id, created=datetime.utcnow()),
+                          partial(product_summary_repository.update, [product.id]))
+        assert ProductSummary.objects.get(product=product).purchase_count == 2
+
+    def test_update_if_no_items(self, mixer, product):
+        mixer.blend(ProductSummary, product=product)
+        product_summary_repository.update([product.id])
+        assert not ProductSummary.objects.filter(product=product).exists()
+
+    def test_get_page(self, summaries):
+        result = product_summary_repository.get_page(None, 2)
+        assert [summary.product_id for summary in result] == [summaries[2].product_id, summaries[1].product_id]
+
+    def test_get_page_if_after_set(self, summaries):
+        result = product_summary_repository.get_page((summaries[2].last_buy, summaries[2].product_id), 2)
+        assert [summary.product_id for summary in result] == [summaries[1].product_id, summaries[0].product_id]
+
+    def test_get_page_if_ordered_by_name(self, mixer):
+        summaries = [mixer.blend(ProductSummary, name=name) for name in ('b', 'a', 'b')]
+        result = product_summary_repository.get_page(None, 3, 'name')
+        assert [summary.product_id for summary in result] == [summaries[1].product_id, summaries[0].product_id,
+                                                              summaries[2].product_id]
+
+    def test_get_page_if_ordered_by_last_price_and_after_set(self, mixer):
+        summaries = [mixer.blend(ProductSummary, last_price=Decimal(price)) for price in ('20', '10', '20', '30')]
+        result = product_summary_repository.get_page((Decimal('20'), summaries[2].product_id), 2, '-last_price')
+        assert [summary.product_id for summary in result] == [summaries[0].product_id, summaries[1].product_id]
+
+    def test_get_page_if_search_set(self, mixer):
+        summaries = [mixer.blend(ProductSummary, name=name) for name in ('Молоко', 'Хлеб', 'Молоко топлёное')]
+        result = product_summary_repository.get_page(None, 3, 'name', 'молоко')
+        assert [summary.product_id for summary in result] == [summaries[0].product_id, summaries[2].product_id]
+
+
+class TestProductAliasRepository:
+
+    def test_create_many(self, seller, product):
+        result = product_alias_repository.create_many([(seller.id, product.id, 'foo'), (seller.id, product.id, 'bar')])
+        assert [alias.name for alias in result] == ['foo', 'bar']
+        assert all(alias.id for alias in result)
+
+    def test_get_cached_by_sellers_and_names(self, django_assert_num_queries, seller, another_seller, product_alias,
+                                             another_product_alias):
+        keys = [(seller.id, product_alias.name), (seller.id, another_product_alias.name),
+                (another_seller.id, another_product_alias.name)]
+        with django_assert_num_queries(2):
+            result = product_alias_repository.get_cached_by_sellers_and_names(keys)
+        assert result == {
+            (seller.id, product_alias.name): (product_alias.id, product_alias.product_id),
+            (another_seller.id, another_product_alias.name): (another_product_alias.id,
+                                                              another_product_alias.product_id),
+        }
+        with django_assert_num_queries(0):
+            assert product_alias_repository.get_cached_by_sellers_and_names(keys) == result
+
+    def test_get_cached_by_sellers_and_names_if_expired(self, mocker, django_assert_num_queries, product_alias):
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        mocker.patch.object(repositories, 'monotonic', return_value=repositories.monotonic() + 301)
+        with django_assert_num_queries(1):
+            product_alias_repository.get_cached_by_sellers_and_names(keys)
+
+    def test_get_cached_by_sellers_and_names_if_evicted(self, mocker, django_assert_num_queries, product_alias,
+                                                        another_product_alias):
+        mocker.patch.object(product_alias_repository, 'CACHE_SIZE', 1)
+        keys = [(product_alias.seller_id, product_alias.name)]
+        another_keys = [(another_product_alias.seller_id, another_product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        product_alias_repository.get_cached_by_sellers_and_names(another_keys)
+        with django_assert_num_queries(0):
+            product_alias_repository.get_cached_by_sellers_and_names(another_keys)
+        with django_assert_num_queries(1):
+            product_alias_repository.get_cached_by_sellers_and_names(keys)
+
+    def test_get_cached_by_sellers_and_names_if_invalidated_elsewhere(self, django_assert_num_queries, product_alias):
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        view_cache.invalidate(f'{PRODUCT_ALIASES_SCOPE}:{product_alias.seller_id}')
+        with django_assert_num_queries(1):
+            product_alias_repository.get_cached_by_sellers_and_names(keys)
+
+    def test_create_many_if_cache_invalidated(self, mocker, django_assert_num_queries, seller, product,
+                                              product_alias):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        product_alias_repository.get_cached_by_sellers_and_names([(seller.id, product_alias.name)])
+        alias, = product_alias_repository.create_many([(seller.id, product.id, 'foo')])
+        with django_assert_num_queries(1):
+            result = product_alias_repository.get_cached_by_sellers_and_names([(seller.id, 'foo')])
+        assert result == {(seller.id, 'foo'): (alias.id, product.id)}
+
+    def test_repoint(self, mocker, mixer, product_alias):
+        mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+        another_product = mixer.blend(Product)
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        product_alias_repository.repoint(product_alias.product_id, another_product.id)
+        assert ProductAlias.objects.get(id=product_alias.id).product_id == another_product.id
+        result = product_alias_repository.get_cached_by_sellers_and_names(keys)
+        assert result == {keys[0]: (product_alias.id, another_product.id)}
+
+    def test_invalidate_cache(self, django_assert_num_queries, product_alias):
+        keys = [(product_alias.seller_id, product_alias.name)]
+        product_alias_repository.get_cached_by_sellers_and_names(keys)
+        product_alias_repository.invalidate_cache([product_alias.seller_id])
+        with django_assert_num_queries(1):
+            product_alias_repository.get_cached_by_sellers_and_names(keys)
 
 
 class TestReceiptRepository:
@@ -135,12 +400,55 @@ class TestReceiptRepository:
         result = receipt_repository.create(seller.id, user.id, datetime.utcnow(), 1, 1, 1)
         assert result.id
 
-    def test_get_last_by_buyer_id(self, user, receipt, another_receipt, old_receipt, another_buyer_receipt):
-        result = receipt_repository.get_last_by_buyer_id(user.id)
+    def test_create_many_if_not_exist(self, seller, user, receipt):
+        result = receipt_repository.create_many_if_not_exist([
+            (seller.id, user.id, datetime.utcnow(), '1', '1', '1'),
+            (seller.id, user.id, datetime.utcnow(), receipt.fiscal_drive_number, receipt.fiscal_document_number,
+             receipt.fiscal_sign),
+            (seller.id, user.id, datetime.utcnow(), '1', '2', '1'),
+            (seller.id, user.id, datetime.utcnow(), '1', '1', '1'),
+        ])
+        assert result[0].id
+        assert result[1] is None
+        assert result[2].id
+        assert result[3] is None
+        assert Receipt.objects.get(id=result[0].id).fiscal_document_number == '1'
+        assert Receipt.objects.count() == 3
+
+    def test_create_many_if_not_exist_if_empty(self, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            assert receipt_repository.create_many_if_not_exist([]) == []
+
+    def test_get_existing_triples(self, django_assert_num_queries, receipt, another_receipt):
+        existing = (receipt.fiscal_drive_number, receipt.fiscal_document_number, receipt.fiscal_sign)
+        mixed = (receipt.fiscal_drive_number, another_receipt.fiscal_document_number, another_receipt.fiscal_sign)
+        with django_assert_num_queries(1):
+            result = receipt_repository.get_existing_triples([existing, mixed, ('1', '2', '3')])
+        assert result == {existing}
+
+    def test_get_existing_triples_if_empty(self, django_assert_num_queries):
+        with django_assert_num_queries(0):
+            assert receipt_repository.get_existing_triples([]) == set()
+
+    def test_get_page_by_buyer_id_and_period(self, user, receipt, another_receipt, old_receipt,
+                                             another_buyer_receipt):
+        today = datetime.utcnow().date()
+        result = receipt_repository.get_page_by_buyer_id_and_period(user.id, today - timedelta(days=30), today,
+                                                                    None, 10)
         assert len(result) == 2
         assert result[0].id == another_receipt.id
         assert result[1].id == receipt.id
 
+    def test_get_page_by_buyer_id_and_period_if_after(self, mixer, user):
+        created = datetime.utcnow()
+        receipts = [mixer.blend(Receipt, buyer=user, created=created) for _ in range(3)]
+        today = created.date()
+        result = receipt_repository.get_page_by_buyer_id_and_period(user.id, today, today, None, 2)
+        assert [receipt.id for receipt in result] == [receipts[2].id, receipts[1].id]
+        result = receipt_repository.get_page_by_buyer_id_and_period(user.id, today, today,
+                                                                    (created, receipts[1].id), 2)
+        assert [receipt.id for receipt in result] == [receipts[0].id]
+
     def test_is_exist_if_not_exists(self):
         result = receipt_repository.is_exist('foo', 'bar', 'baz')
         assert not result
@@ -151,6 +459,47 @@ class TestReceiptRepository:
         assert result
 
 
+class TestPendingReceiptRepository:
+
+    @fixture
+    def another_user(self, mixer):
+        return mixer.blend(User)
+
+    def test_claim(self, user):
+        result = pending_receipt_repository.claim(user.id, '1', '2', '3')
+        assert result.status == PendingReceipt.STATUS_PENDING
+        assert result.buyer_id == user.id
+
+    def test_claim_if_pending(self, user, another_user):
+        pending_receipt_repository.claim(user.id, '1', '2', '3')
+        result = pending_receipt_repository.claim(another_user.id, '1', '2', '3')
+        assert result is None
+        assert PendingReceipt.objects.get().buyer_id == user.id
+
+    def test_claim_if_failed(self, user, another_user):
+        pending_receipt = pending_receipt_repository.claim(user.id, '1', '2', '3')
+        pending_receipt_repository.set_status('1', '2', '3', PendingReceipt.STATUS_FAILED)
+
+        result = pending_receipt_repository.claim(another_user.id, '1', '2', '3')
+        assert result.id == pending_receipt.id
+        assert result.status == PendingReceipt.STATUS_PENDING
+        assert result.buyer_id == another_user.id
+
+    def test_claim_if_pending_too_long(self, user):
+        pending_receipt = pending_receipt_repository.claim(user.id, '1', '2', '3')
+        PendingReceipt.objects.update(
+            updated=datetime.utcnow() - pending_receipt_repository.PENDING_TIMEOUT - timedelta(minutes=1))
+
+        result = pending_receipt_repository.claim(user.id, '1', '2', '3')
+        assert result.id == pending_receipt.id
+        assert result.updated > datetime.utcnow() - timedelta(minutes=1)
+
+    def test_get_by_id_and_buyer_id_if_another_buyer(self, mixer, user):
+        pending_receipt = mixer.blend(PendingReceipt)
+        result = pending_receipt_repository.get_by_id_and_buyer_id(pending_receipt.id, user.id)
+        assert result is None
+
+
 class TestReceiptItemRepository:
 
     @fixture
@@ -177,10 +526,34 @@ class TestReceiptItemRepository:
     def old_receipt_item(self, mixer, another_product, old_receipt):
         return mixer.blend(ReceiptItem, receipt=old_receipt, product_alias__product=another_product)
 
-    def test_create(self, receipt, product_alias):
-        result = receipt_item_repository.create(receipt.id, product_alias.id, Decimal('1'),
-                                                Decimal('0.1'), Decimal('0.2'))
-        assert result.id
+    def test_create_many(self, receipt, product_alias):
+        result = receipt_item_repository.create_many([
+            (receipt.id, product_alias.id, Decimal('1'), Decimal('0.1'), Decimal('0.2')),
+        ])
+        assert len(result) == 1
+        assert result[0].id
+
+    def test_update_food_values_by_product_ids(self, mixer, product, receipt_item):
+        food_product = mixer.blend(FoodProduct, product=product, calories=250, protein=Decimal('3.2'),
+                                   fat=Decimal('2.5'), carbohydrate=Decimal('4.7'), weight=900)
+        receipt_item.quantity = Decimal('1.5')
+        receipt_item.save()
+        receipt_item_repository.update_food_values_by_product_ids([product.id])
+
+        receipt_item.refresh_from_db()
+        assert receipt_item.weight == Decimal('1350')
+        assert receipt_item.calories == Decimal('2250')
+        assert receipt_item.protein == Decimal('28.8')
+        assert receipt_item.fat == Decimal('22.5')
+        assert receipt_item.carbohydrate == Decimal('42.3')
+        assert receipt_item.calories == food_product.total_calories
+
+    def test_update_food_values_by_receipt_ids_if_not_food(self, receipt, receipt_item):
+        receipt_item_repository.update_food_values_by_receipt_ids([receipt.id])
+
+        receipt_item.refresh_from_db()
+        assert receipt_item.weight is None
+        assert receipt_item.calories is None
 
     def test_get_last(self, receipt_item, old_receipt_item):
         result = receipt_item_repository.get_last()
@@ -188,15 +561,14 @@ class TestReceiptItemRepository:
         assert result[0].id == receipt_item.id
         assert result[1].id == old_receipt_item.id
 
-    def test_get_last_by_buyer_id(self, user, receipt_item, old_receipt_item):
-        result = receipt_item_repository.get_last_by_buyer_id(user.id)
-        assert len(result) == 1
-        assert result[0].id == receipt_item.id
+    def test_get_page_by_product_id(self, mixer, product, product_alias):
+        created = datetime(2019, 1, 1)
+        items = [mixer.blend(ReceiptItem, product_alias=product_alias, receipt__created=created) for _ in range(3)]
+        result = receipt_item_repository.get_page_by_product_id(product.id, None, 2)
+        assert [item.id for item in result] == [items[2].id, items[1].id]
 
-    def test_get_by_product_id(self, product, receipt_item, old_receipt_item):
-        result = receipt_item_repository.get_by_product_id(product.id)
-        assert len(result) == 1
-        assert result[0].id == receipt_item.id
+        result = receipt_item_repository.get_page_by_product_id(product.id, (created, items[1].id), 2)
+        assert [item.id for item in result] == [items[0].id]
 
     def test_is_exist_by_product_id_and_buyer_id_if_exists(self, user, product, receipt_item):
         result = receipt_item_repository.is_exist_by_product_id_and_buyer_id(product.id, user.id)
@@ -205,3 +577,178 @@ class TestReceiptItemRepository:
     def test_is_exist_by_product_id_and_buyer_id_if_not_exists(self, user, product, old_receipt_item):
         result = receipt_item_repository.is_exist_by_product_id_and_buyer_id(product.id, user.id)
         assert not result
+
+
+class TestDailyProductStatsRepository:
+
+    @fixture
+    def another_product(self, mixer):
+        return mixer.blend(Product)
+
+    @fixture
+    def items(self, mixer, user, receipt, product_alias, food_product):
+        items = [mixer.blend(ReceiptItem, receipt=receipt, product_alias=product_alias, quantity=Decimal(1),
+                             total=Decimal(total)) for total in (10, 20)]
+        receipt_item_repository.update_food_values_by_receipt_ids([receipt.id])
+        for item in items:
+            item.refresh_from_db()
+        return items
+
+    def test_update_by_buyer_id_and_days(self, user, receipt, product, items):
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt.created.date()])
+
+        stats = DailyProductStats.objects.get()
+        assert stats.buyer_id == user.id
+        assert stats.product_id == product.id
+        assert stats.seller_id == receipt.seller_id
+        assert stats.day == receipt.created.date()
+        assert stats.quantity == 2
+        assert stats.total == 30
+        assert stats.calories == sum(item.calories for item in items)
+        assert stats.effectivity_count == 2
+        assert stats.item_count == 2
+
+    def test_update_by_buyer_id_and_days_if_repeated(self, user, receipt, items):
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt.created.date()])
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt.created.date()])
+        assert DailyProductStats.objects.count() == 1
+
+    @pytest.mark.django_db(transaction=True)
+    def test_update_by_buyer_id_and_days_if_concurrent(self, user, seller, product_alias):
+        created = datetime.utcnow()
+        _run_concurrently(partial(_add_receipt_item, seller.id, user.id, product_alias.id, created=created),
+                          partial(daily_product_stats_repository.update_by_buyer_id_and_days, user.id,
+                                  [created.date()]))
+
+        stats = DailyProductStats.objects.get()
+        assert stats.item_count == 2
+        assert stats.total == 20
+
+    def test_update_by_product_ids(self, user, receipt, product, another_product, items):
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt.created.date()])
+        product_repository.merge(another_product.id, product.id)
+
+        stats = DailyProductStats.objects.get()
+        assert stats.product_id == another_product.id
+        assert stats.item_count == 2
+
+    def test_get_product_stats(self, mixer, user, receipt, product, items):
+        mixer.blend(ReceiptItem, receipt__buyer=user, receipt__created=datetime.utcnow() - timedelta(days=100))
+        for day in {receipt.created.date(), (datetime.utcnow() - timedelta(days=100)).date()}:
+            daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [day])
+        today = datetime.utcnow().date()
+
+        result = daily_product_stats_repository.get_product_stats(user.id, today - timedelta(days=30), today)
+
+        assert len(result) == 1
+        assert result[0]['product_id'] == product.id
+        assert result[0]['total_sum'] == 30
+        assert result[0]['effectivity_avg'] == pytest.approx(
+            sum(item.calories / item.total for item in items) / 2)
+
+    def test_get_totals(self, mixer, user, receipt, items):
+        mixer.blend(ReceiptItem, receipt=receipt)
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt.created.date()])
+        today = datetime.utcnow().date()
+
+        result = daily_product_stats_repository.get_totals(user.id, today, today)
+
+        assert result['protein_sum'] == sum(item.protein for item in items)
+        assert result['non_checked_count'] == 1
+
+
+class TestPriceStatsRepository:
+
+    @fixture
+    def items(self, mixer, seller, product_alias):
+        return [mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal(price), receipt__seller=seller,
+                            receipt__created=created)
+                for price, created in (('10', datetime(2019, 1, 1)), ('15', datetime(2019, 1, 3)),
+                                       ('30', datetime(2019, 1, 8)))]
+
+    def test_update_by_product_ids(self, seller, product, items):
+        price_stats_repository.update_by_product_ids([product.id])
+
+        stats = list(PriceStats.objects.order_by('period', 'start').values_list(
+            'period', 'start', 'seller', 'min_price', 'avg_price', 'max_price', 'item_count'))
+        assert stats == [
+            ('month', date(2019, 1, 1), seller.id, Decimal('10'), Decimal('18.33'), Decimal('30'), 3),
+            ('week', date(2018, 12, 31), seller.id, Decimal('10'), Decimal('12.50'), Decimal('15'), 2),
+            ('week', date(2019, 1, 7), seller.id, Decimal('30'), Decimal('30'), Decimal('30'), 1),
+        ]
+
+    def test_update_by_product_ids_if_days_set(self, mixer, seller, product, product_alias, items):
+        price_stats_repository.update_by_product_ids([product.id])
+        # Сдвигаем цену задним числом, чтобы отличить пересчитанные периоды от нетронутых
+        ReceiptItem.objects.filter(id=items[0].id).update(price=Decimal('20'))
+        mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal('40'), receipt__seller=seller,
+                    receipt__created=datetime(2019, 1, 9))
+
+        price_stats_repository.update_by_product_ids([product.id], [date(2019, 1, 9)])
+
+        stats = list(PriceStats.objects.order_by('period', 'start').values_list('start', 'max_price', 'item_count'))
+        assert stats == [
+            (date(2019, 1, 1), Decimal('40'), 4),
+            (date(2018, 12, 31), Decimal('15'), 2),
+            (date(2019, 1, 7), Decimal('40'), 2),
+        ]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_update_by_product_ids_if_concurrent(self, user, seller, product, product_alias):
+        created = datetime.utcnow()
+        _run_concurrently(partial(_add_receipt_item, seller.id, user.id, product_alias.id, created=created),
+                          partial(price_stats_repository.update_by_product_ids, [product.id], [created.date()]))
+        assert set(PriceStats.objects.values_list('item_count', flat=True)) == {2}
+
+    def test_update_by_product_ids_if_merged(self, mixer, product, items):
+        another_product = mixer.blend(Product)
+        price_stats_repository.update_by_product_ids([product.id])
+        product_repository.merge(another_product.id, product.id)
+        assert set(PriceStats.objects.values_list('product', flat=True)) == {another_product.id}
+
+    def test_get_by_product_id(self, product, items):
+        price_stats_repository.update_by_product_ids([product.id])
+        result = price_stats_repository.get_by_product_id(product.id, PriceStats.PERIOD_WEEK)
+        assert [stats.start for stats in result] == [date(2018, 12, 31), date(2019, 1, 7)]
+
+
+class TestSellerPriceRepository:
+
+    @fixture
+    def items(self, mixer, seller, another_seller, product_alias):
+        now = datetime.utcnow()
+        return [mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal(price), receipt__seller=item_seller,
+                            receipt__created=created)
+                for price, item_seller, created in (('50', seller, now - timedelta(days=100)),
+                                                    ('10', seller, now - timedelta(days=3)),
+                                                    ('30', seller, now - timedelta(days=2)),
+                                                    ('12', seller, now - timedelta(days=1)),
+                                                    ('20', another_seller, now - timedelta(days=120)))]
+
+    def test_update_by_product_ids(self, seller, another_seller, product, items):
+        seller_price_repository.update_by_product_ids([product.id])
+
+        prices = list(SellerPrice.objects.order_by('seller_id').values_list(
+            'product', 'seller', 'last_price', 'last_seen', 'median_price'))
+        assert prices == [
+            (product.id, seller.id, Decimal('12'), items[3].receipt.created, Decimal('12')),
+            (product.id, another_seller.id, Decimal('20'), items[4].receipt.created, None),
+        ]
+
+    @pytest.mark.django_db(transaction=True)
+    def test_update_by_product_ids_if_concurrent(self, user, seller, product, product_alias):
+        _run_concurrently(partial(_add_receipt_item, seller.id, user.id, product_alias.id, created=datetime.utcnow()),
+                          partial(seller_price_repository.update_by_product_ids, [product.id]))
+        assert SellerPrice.objects.get(product=product).median_price == Decimal('10')
+
+    def test_update_by_product_ids_if_merged(self, mixer, product, items):
+        another_product = mixer.blend(Product)
+        seller_price_repository.update_by_product_ids([product.id])
+        product_repository.merge(another_product.id, product.id)
+        assert set(SellerPrice.objects.values_list('product', flat=True)) == {another_product.id}
+
+    def test_get_by_product_ids(self, seller, another_seller, product, items):
+        seller_price_repository.update_by_product_ids([product.id])
+        result = seller_price_repository.get_by_product_ids([product.id])
+        assert [price.seller.id for price in result] == [seller.id, another_seller.id]
+
@@ -1,13 +1,18 @@
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from decimal import Decimal
 
 import pytest
 from pytest import fixture
 
-from receipt_tracker import tasks
-from receipt_tracker.lib.retrievers import ParsedReceipt, ParsedReceiptItem
-from receipt_tracker.repositories import receipt_repository
-from receipt_tracker.tasks import add_receipt
+from receipt_tracker import repositories, tasks
+from receipt_tracker.lib.retrievers import OperatorUnavailable, ParsedReceipt, ParsedReceiptItem, ReceiptNotReady
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, get_user_scope, view_cache
+from receipt_tracker.models import DailyProductStats, PendingReceipt, PriceStats, Product, ProductAlias, Receipt, \
+    ReceiptItem, SellerPrice
+from receipt_tracker.repositories import pending_receipt_repository, receipt_repository
+from receipt_tracker.tasks import add_receipt, build_similar_product_index, store_receipts
 
 pytestmark = pytest.mark.django_db
 
@@ -46,6 +51,22 @@ def silent_receipt_retriever(mocker):
     return mock
 
 
+@fixture
+def pending_receipt_retriever(mocker):
+    mock = mocker.Mock()
+    mock.get_receipt.side_effect = ReceiptNotReady
+    mocker.patch.object(tasks, 'get_receipt_retriever', return_value=mock)
+    return mock
+
+
+@fixture
+def unavailable_receipt_retriever(mocker):
+    mock = mocker.Mock()
+    mock.get_receipt.side_effect = OperatorUnavailable('unavailable', timedelta(hours=2))
+    mocker.patch.object(tasks, 'get_receipt_retriever', return_value=mock)
+    return mock
+
+
 @fixture
 def successful_receipt_retriever(mocker, parsed_receipt):
     mock = mocker.Mock()
@@ -73,13 +94,78 @@ def test_add_receipt_if_retriever_silent(mocker, receipt_params, silent_receipt_
     assert mock.called
 
 
+def test_add_receipt_if_retriever_failed_spreads_retries(mocker, receipt_params, failed_receipt_retriever):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    retry = mocker.patch.object(add_receipt, 'retry')
+    countdowns = set()
+    for _ in range(5):
+        add_receipt(1, receipt_params)
+        countdowns.add(retry.call_args[1]['countdown'])
+    delay = tasks.RETRY_DELAY.total_seconds()
+    assert len(countdowns) > 1
+    assert all(delay * (1 - tasks.RETRY_JITTER) <= countdown <= delay * (1 + tasks.RETRY_JITTER)
+               for countdown in countdowns)
+
+
+def test_add_receipt_if_operators_unavailable(mocker, receipt_params, unavailable_receipt_retriever):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    retry = mocker.patch.object(add_receipt, 'retry')
+    add_receipt(1, receipt_params)
+    assert retry.call_args[1]['countdown'] >= timedelta(hours=2).total_seconds() * (1 - tasks.RETRY_JITTER)
+
+
+def test_add_receipt_if_rescheduled(mocker, user, receipt_params, failed_receipt_retriever):
+    pending_receipt = pending_receipt_repository.claim(user.id, '1', '1', '1')
+    PendingReceipt.objects.update(updated=datetime.utcnow() - timedelta(hours=1))
+    mocker.patch.object(add_receipt, 'retry')
+    add_receipt(user.id, receipt_params)
+
+    pending_receipt.refresh_from_db()
+    assert pending_receipt.status == PendingReceipt.STATUS_PENDING
+    assert pending_receipt.updated > datetime.utcnow() - timedelta(minutes=1)
+
+
+def test_add_receipt_if_retriever_failed_too_many_times(mocker, user, receipt_params, failed_receipt_retriever):
+    pending_receipt = pending_receipt_repository.claim(user.id, '1', '1', '1')
+    mocker.patch.object(add_receipt, 'max_retries', 0)
+    retry = mocker.patch.object(add_receipt, 'retry')
+    add_receipt(user.id, receipt_params)
+    assert not retry.called
+
+    pending_receipt.refresh_from_db()
+    assert pending_receipt.status == PendingReceipt.STATUS_FAILED
+
+
+def test_add_receipt_if_receipt_not_ready(mocker, receipt_params, pending_receipt_retriever):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    apply_async = mocker.patch.object(add_receipt, 'apply_async')
+    retry = mocker.patch.object(add_receipt, 'retry')
+    sleep = mocker.patch.object(time, 'sleep')
+    add_receipt(1, receipt_params, polls=1)
+    assert apply_async.call_args[0] == ((1, receipt_params), {'polls': 2})
+    assert apply_async.call_args[1]['countdown'] == tasks.RECEIPT_POLL_DELAY.total_seconds()
+    assert not retry.called
+    assert not sleep.called
+
+
+def test_add_receipt_if_receipt_not_ready_after_polls(mocker, receipt_params, pending_receipt_retriever):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    apply_async = mocker.patch.object(add_receipt, 'apply_async')
+    retry = mocker.patch.object(add_receipt, 'retry')
+    add_receipt(1, receipt_params, polls=tasks.MAX_RECEIPT_POLLS)
+    assert not apply_async.called
+    assert retry.call_args[1]['kwargs'] == {}
+
+
 def test_add_receipt_if_retriever_successful(mocker, receipt_params, successful_receipt_retriever,
                                              parsed_receipt, user):
     mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    pending_receipt = pending_receipt_repository.claim(user.id, '1', '1', '1')
     add_receipt(user.id, receipt_params)
 
     receipts = receipt_repository.get_by_buyer_id(user.id)
     assert len(receipts) == 1
+    assert PendingReceipt.objects.get(id=pending_receipt.id).status == PendingReceipt.STATUS_ADDED
 
     receipt = receipts[0]
     assert str(receipt.seller.individual_number) == parsed_receipt.seller_individual_number
@@ -88,3 +174,108 @@ def test_add_receipt_if_retriever_successful(mocker, receipt_params, successful_
     receipt_item = receipt.items[0]
     assert receipt_item.product_alias.name == parsed_receipt.items[0].name
     assert receipt_item.price == parsed_receipt.items[0].price
+
+    summary = receipt_item.product_alias.product.summary
+    assert summary.name == parsed_receipt.items[0].name
+    assert summary.last_price == parsed_receipt.items[0].price
+
+
+def test_add_receipt_if_similar_product_index_updated(mocker, receipt_params, successful_receipt_retriever,
+                                                      parsed_receipt, user):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    mocker.patch.object(tasks, 'on_commit', side_effect=lambda func: func())
+    mocker.patch.object(similar_product_index, 'add_many')
+    add_receipt(user.id, receipt_params)
+    similar_product_index.add_many.assert_called_once()
+    assert [name for _, name in similar_product_index.add_many.call_args[0][0]] \
+        == [parsed_receipt_item.name for parsed_receipt_item in parsed_receipt.items]
+
+
+def _get_parsed_receipt(fiscal_document_number: str, names):
+    return ParsedReceipt('1', fiscal_document_number, '3', 'foo', '4', datetime.utcnow(), [
+        ParsedReceiptItem(name, Decimal(1), Decimal(2), Decimal(2)) for name in names
+    ])
+
+
+def test_store_receipts(user):
+    result = store_receipts(user.id, [
+        _get_parsed_receipt('1', ['foo', 'bar']),
+        _get_parsed_receipt('2', ['bar', 'baz']),
+    ])
+    assert len(result) == 2
+    assert Receipt.objects.filter(id__in=result).count() == 2
+    assert ReceiptItem.objects.filter(receipt__in=result).count() == 4
+    assert sorted(ProductAlias.objects.values_list('name', flat=True)) == ['bar', 'baz', 'foo']
+    assert Product.objects.count() == 3
+    assert sorted(DailyProductStats.objects.values_list('item_count', flat=True)) == [1, 1, 2]
+    assert sorted(PriceStats.objects.filter(period=PriceStats.PERIOD_WEEK).values_list('item_count', flat=True)) \
+        == [1, 1, 2]
+    assert SellerPrice.objects.count() == 3
+
+
+def test_store_receipts_if_view_cache_invalidated(mocker, user):
+    mocker.patch.object(tasks, 'on_commit', side_effect=lambda func: func())
+    mocker.patch.object(similar_product_index, 'add_many')
+    mocker.patch.object(view_cache, 'invalidate')
+    store_receipts(user.id, [_get_parsed_receipt('1', ['foo'])])
+    view_cache.invalidate.assert_called_once_with(LISTINGS_SCOPE, get_user_scope(user.id))
+
+
+def test_store_receipts_if_product_alias_exists(user, seller, product_alias):
+    parsed_receipt = ParsedReceipt('1', '2', '3', seller.original_name, seller.individual_number, datetime.utcnow(), [
+        ParsedReceiptItem(product_alias.name, Decimal(1), Decimal(2), Decimal(2)),
+    ])
+    result = store_receipts(user.id, [parsed_receipt])
+    assert ReceiptItem.objects.get(receipt=result[0]).product_alias_id == product_alias.id
+    assert Product.objects.count() == 1
+
+
+def test_store_receipts_if_product_merged_elsewhere(mocker, mixer, user):
+    mocker.patch.object(repositories, 'on_commit', side_effect=lambda func: func())
+    store_receipts(user.id, [_get_parsed_receipt('1', ['foo'])])
+    product_alias = ProductAlias.objects.get()
+    another_product = mixer.blend(Product)
+    # Так выглядит слияние из веб-процесса: кэш псевдонимов воркера о нём не знает
+    ProductAlias.objects.filter(id=product_alias.id).update(product=another_product)
+    Product.objects.filter(id=product_alias.product_id).delete()
+    store_receipts(user.id, [_get_parsed_receipt('2', ['foo'])])
+    assert SellerPrice.objects.get().product_id == another_product.id
+    assert Product.objects.get(id=another_product.id).summary.purchase_count == 2
+
+
+def test_store_receipts_if_receipt_exists(user):
+    store_receipts(user.id, [_get_parsed_receipt('1', ['foo'])])
+    result = store_receipts(user.id, [
+        _get_parsed_receipt('1', ['foo', 'bar']),
+        _get_parsed_receipt('2', ['bar']),
+    ])
+    assert len(result) == 1
+    assert Receipt.objects.count() == 2
+    assert ReceiptItem.objects.count() == 2
+
+
+def test_add_receipt_if_receipt_added_concurrently(mocker, receipt_params, successful_receipt_retriever,
+                                                   parsed_receipt, user):
+    mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
+    pending_receipt = pending_receipt_repository.claim(user.id, '1', '1', '1')
+    store_receipts(user.id, [parsed_receipt])
+    retry = mocker.patch.object(add_receipt, 'retry')
+    add_receipt(user.id, receipt_params)
+    assert not retry.called
+    assert Receipt.objects.count() == 1
+    assert PendingReceipt.objects.get(id=pending_receipt.id).status == PendingReceipt.STATUS_ADDED
+
+
+def test_store_receipts_if_many_items(django_assert_max_num_queries, user):
+    store_receipts(user.id, [_get_parsed_receipt('1', ['foo'])])
+    with django_assert_max_num_queries(28):
+        store_receipts(user.id, [_get_parsed_receipt('2', [str(i) for i in range(60)])])
+
+
+def test_build_similar_product_index(mocker, product_alias):
+    build_similar_product_index()
+    assert similar_product_index.is_built()
+
+    mocker.patch.object(similar_product_index, 'build')
+    build_similar_product_index()
+    assert not similar_product_index.build.called
@@ -10,8 +10,13 @@ urlpatterns = (
     path('logout/', LogoutView.as_view(), {'next_page': '/'}, name='logout'),
     path('receipts/add/', general.add_receipt_view, name='add-receipt'),
     path('receipts/added/', general.receipt_added_view, name='receipt-added'),
+    path('receipts/pending/<int:pending_receipt_id>/', general.pending_receipt_status_view,
+         name='pending-receipt-status'),
     path('products/', general.products_view, name='products'),
+    path('api/products/', general.products_api_view, name='products-api'),
+    path('api/prices/', general.price_comparison_view, name='price-comparison'),
     path('product/<int:product_id>/', general.product_view, name='product'),
+    path('product/<int:product_id>/prices/', general.product_prices_view, name='product-prices'),
     path('product/<int:product_id>/merge/<int:another_product_id>', general.merge_product_view, name='merge-product'),
     path('reports/value/', reports.value_report_view, name='value-report'),
     path('reports/top/', reports.top_report_view, name='top-report'),
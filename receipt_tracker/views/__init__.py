@@ -2,9 +2,12 @@ from typing import Dict
 
 from django.conf import settings
 
+from receipt_tracker.lib.view_cache import view_cache
+
 
 def add_common_context(context: Dict) -> Dict:
     context.update({
-        'google_analytics_id': settings.GOOGLE_ANALYTICS_ID if not settings.DEBUG else None
+        'google_analytics_id': settings.GOOGLE_ANALYTICS_ID if not settings.DEBUG else None,
+        'cache_timeout': int(view_cache.TIMEOUT.total_seconds()),
     })
     return context
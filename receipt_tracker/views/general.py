@@ -1,41 +1,76 @@
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from functools import partial
 from logging import getLogger
+from typing import Callable, Dict, List, Optional, Tuple
 
 from django.contrib.auth.decorators import login_required
 from django.db.transaction import atomic
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
 from django.http.response import HttpResponseNotFound
 from django.shortcuts import render, reverse
 from django.views.decorators.csrf import csrf_exempt
 
 from receipt_tracker import forms, tasks
 from receipt_tracker.lib import qr_code
-from receipt_tracker.lib.similar import SimilarProductFinder
-from receipt_tracker.repositories import product_repository, receipt_item_repository, receipt_repository
+from receipt_tracker.lib.similar import SimilarProduct, similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, view_cache
+from receipt_tracker.models import PriceStats, ProductSummary
+from receipt_tracker.repositories import pending_receipt_repository, price_stats_repository, product_repository, \
+    product_summary_repository, receipt_item_repository, receipt_repository, seller_price_repository
 from receipt_tracker.tasks import receipt_params_to_dict
 from receipt_tracker.views import add_common_context
 
 logger = getLogger(__name__)
 
+PRODUCTS_PAGE_SIZE = 100
+PRODUCT_PRICES_COUNT = 20
+PRICES_PAGE_SIZE = 500
+PRICES_RAW_RESOLUTION = 'raw'
+PRICE_COMPARISON_MAX_PRODUCTS = 50
+PRODUCTS_DEFAULT_ORDER = '-last_buy'
+PRODUCTS_CURSOR_PARSERS: Dict[str, Callable[[str], object]] = {
+    'name': str,
+    'last_buy': datetime.fromisoformat,
+    'last_price': Decimal,
+}
+
 
 def is_edit_allowed(product_id: int, user_id: int) -> bool:
     return receipt_item_repository.is_exist_by_product_id_and_buyer_id(product_id, user_id)
 
 
+def find_similar_products(name: str) -> List[SimilarProduct]:
+    if not similar_product_index.is_built():
+        # Индекс строится по всем продуктам, поэтому в запросе его не собираем, а отдаём это воркеру
+        tasks.build_similar_product_index.delay()
+        return []
+    similars = similar_product_index.find(name)
+    products = {product.id: product for product in product_repository.get_by_ids([pair[0] for pair in similars])}
+    return [SimilarProduct(products[product_id], confidence) for product_id, confidence in similars
+            if product_id in products]
+
+
 def index_view(request):
-    receipt_items = receipt_item_repository.get_last()
+    items, cache_version = view_cache.get_or_set('index', (LISTINGS_SCOPE,), _get_last_items)
     context = {
-        'items': [{
-            'product_id': item.product_alias.product.id,
-            'is_product_checked': item.is_product_checked,
-            'name': item.product_alias.name,
-            'seller': item.receipt.seller.name,
-            'price': item.price
-        } for item in receipt_items]
+        'items': items,
+        'cache_version': cache_version,
     }
     context = add_common_context(context)
     return render(request, 'index.html', context)
 
 
+def _get_last_items() -> List[Dict]:
+    return [{
+        'product_id': item.product_alias.product.id,
+        'is_product_checked': item.is_product_checked,
+        'name': item.product_alias.name,
+        'seller': item.receipt.seller.name,
+        'price': item.price
+    } for item in receipt_item_repository.get_last()]
+
+
 @login_required
 @csrf_exempt
 def add_receipt_view(request):
@@ -49,8 +84,13 @@ def add_receipt_view(request):
                                              params.fiscal_sign):
                 form.add_error(None, 'Чек уже добавлен')
             else:
-                tasks.add_receipt.apply(args=(request.user.id, receipt_params_to_dict(params)))
-                return HttpResponseRedirect(reverse('receipt-added'))
+                pending_receipt = pending_receipt_repository.claim(
+                    request.user.id, params.fiscal_drive_number, params.fiscal_document_number, params.fiscal_sign)
+                if not pending_receipt:
+                    form.add_error(None, 'Чек уже добавляется')
+                else:
+                    tasks.add_receipt.apply_async(args=(request.user.id, receipt_params_to_dict(params)))
+                    return HttpResponseRedirect(f'{reverse("receipt-added")}?id={pending_receipt.id}')
     else:
         form = forms.QrForm()
 
@@ -62,28 +102,97 @@ def add_receipt_view(request):
 
 
 def receipt_added_view(request):
-    context = {}
+    pending_receipt_id = request.GET.get('id')
+    context = {
+        'status_url': reverse('pending-receipt-status', args=(int(pending_receipt_id),))
+        if pending_receipt_id and pending_receipt_id.isdigit() else None,
+    }
     context = add_common_context(context)
     return render(request, 'receipt_added.html', context)
 
 
+@login_required
+def pending_receipt_status_view(request, pending_receipt_id: int):
+    pending_receipt = pending_receipt_repository.get_by_id_and_buyer_id(pending_receipt_id, request.user.id)
+    if not pending_receipt:
+        return HttpResponseNotFound()
+    return JsonResponse({
+        'status': pending_receipt.status,
+        'status_display': pending_receipt.get_status_display(),
+    })
+
+
 def products_view(request):
-    products = product_repository.get_all()
-    context = {
-        'products': [{
-            'id': product.id,
-            'name': product.name,
-            'is_checked': product.is_checked,
-            'last_buy': product.last_buy,
-            'last_price': product.last_price
-        } for product in products]
-    }
+    try:
+        context = _get_products_page(request)
+    except ValueError:
+        return HttpResponseBadRequest()
     context = add_common_context(context)
     return render(request, 'products.html', context)
 
 
+def products_api_view(request):
+    try:
+        context = _get_products_page(request)
+    except ValueError:
+        return HttpResponseBadRequest()
+    return JsonResponse({
+        'products': context['products'],
+        'next_cursor': context['next_cursor'],
+    })
+
+
+def _get_products_page(request) -> Dict:
+    order = request.GET.get('sort') or PRODUCTS_DEFAULT_ORDER
+    if order not in product_summary_repository.ORDERS:
+        raise ValueError(f'Unknown products order {order}')
+    search = request.GET.get('q', '').strip()
+    after = _decode_products_cursor(request.GET.get('after'), order)
+
+    page, cache_version = view_cache.get_or_set('products', (LISTINGS_SCOPE,),
+                                                partial(_get_products, after, order, search), after, order, search)
+    page.update({
+        'sort': order,
+        'search': search,
+        'cache_version': cache_version,
+    })
+    return page
+
+
+def _get_products(after: Optional[Tuple[object, int]], order: str, search: str) -> Dict:
+    summaries = product_summary_repository.get_page(after, PRODUCTS_PAGE_SIZE + 1, order, search or None)
+    return {
+        'products': [{
+            'id': summary.product_id,
+            'name': summary.name,
+            'is_checked': summary.product.is_checked,
+            'last_buy': summary.last_buy,
+            'last_price': summary.last_price
+        } for summary in summaries[:PRODUCTS_PAGE_SIZE]],
+        'next_cursor': _encode_products_cursor(summaries[PRODUCTS_PAGE_SIZE - 1], order)
+        if len(summaries) > PRODUCTS_PAGE_SIZE else None,
+    }
+
+
+def _encode_products_cursor(summary: ProductSummary, order: str) -> str:
+    value = getattr(summary, order.lstrip('-'))
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return f'{value}_{summary.product_id}'
+
+
+def _decode_products_cursor(cursor: Optional[str], order: str) -> Optional[Tuple[object, int]]:
+    if not cursor:
+        return None
+    value, product_id = cursor.rsplit('_', 1)
+    try:
+        return PRODUCTS_CURSOR_PARSERS[order.lstrip('-')](value), int(product_id)
+    except InvalidOperation:
+        raise ValueError(f'Bad products cursor {cursor}')
+
+
 def product_view(request, product_id: int):
-    product = product_repository.get_by_id(product_id)
+    product = product_repository.get_with_details(product_id)
     if not product:
         return HttpResponseNotFound()
 
@@ -120,7 +229,20 @@ def product_view(request, product_id: int):
                 'seller': item.receipt.seller.name,
                 'created': item.receipt.created,
                 'value': item.price,
-            } for item in receipt_item_repository.get_by_product_id(product_id)],
+            } for item in receipt_item_repository.get_page_by_product_id(product_id, None, PRODUCT_PRICES_COUNT)],
+            'sellers': [{
+                'seller': price.seller.name,
+                'last_price': price.last_price,
+                'last_seen': price.last_seen,
+                'median_price': price.median_price,
+            } for price in seller_price_repository.get_by_product_ids([product_id])],
+            'monthly_prices': [{
+                'seller': stats.seller.name,
+                'start': stats.start,
+                'min': stats.min_price,
+                'avg': stats.avg_price,
+                'max': stats.max_price,
+            } for stats in price_stats_repository.get_by_product_id(product_id, PriceStats.PERIOD_MONTH)],
             'food': {
                 'calories': details.calories / 1000,
                 'protein': details.protein,
@@ -138,7 +260,7 @@ def product_view(request, product_id: int):
                 'id': similar.product.id,
                 'name': similar.product.name,
                 'confidence': similar.confidence,
-            } for similar in SimilarProductFinder(list(product_repository.get_all())).find(product.name)]
+            } for similar in find_similar_products(product.name)]
         },
         'edit': {
             'is_allowed': edit_allowed,
@@ -150,6 +272,85 @@ def product_view(request, product_id: int):
     return render(request, 'product.html', context)
 
 
+def product_prices_view(request, product_id: int):
+    if not product_repository.get_by_id(product_id):
+        return HttpResponseNotFound()
+    resolution = request.GET.get('resolution') or PriceStats.PERIOD_WEEK
+    if resolution in dict(PriceStats.PERIODS):
+        return JsonResponse({
+            'resolution': resolution,
+            'points': [{
+                'seller_id': stats.seller_id,
+                'seller': stats.seller.name,
+                'start': stats.start,
+                'min': stats.min_price,
+                'avg': stats.avg_price,
+                'max': stats.max_price,
+                'count': stats.item_count,
+            } for stats in price_stats_repository.get_by_product_id(product_id, resolution)],
+        })
+    if resolution != PRICES_RAW_RESOLUTION:
+        return HttpResponseBadRequest()
+
+    try:
+        after = _decode_prices_cursor(request.GET.get('after'))
+    except ValueError:
+        return HttpResponseBadRequest()
+    items = receipt_item_repository.get_page_by_product_id(product_id, after, PRICES_PAGE_SIZE + 1)
+    return JsonResponse({
+        'resolution': resolution,
+        'points': [{
+            'seller_id': item.receipt.seller_id,
+            'seller': item.receipt.seller.name,
+            'created': item.receipt.created,
+            'price': item.price,
+        } for item in items[:PRICES_PAGE_SIZE]],
+        'next_cursor': f'{items[PRICES_PAGE_SIZE - 1].receipt.created.isoformat()}_{items[PRICES_PAGE_SIZE - 1].id}'
+        if len(items) > PRICES_PAGE_SIZE else None,
+    })
+
+
+def _decode_prices_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+    created, item_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(created), int(item_id)
+
+
+def price_comparison_view(request):
+    try:
+        product_ids = list(dict.fromkeys(int(product_id) for product_id in request.GET.getlist('product')))
+    except ValueError:
+        return HttpResponseBadRequest()
+    if not product_ids or len(product_ids) > PRICE_COMPARISON_MAX_PRODUCTS:
+        return HttpResponseBadRequest()
+
+    products = {product_id: [] for product_id in product_ids}
+    baskets: Dict[int, Dict] = {}
+    for price in seller_price_repository.get_by_product_ids(product_ids):
+        products[price.product_id].append({
+            'seller_id': price.seller_id,
+            'seller': price.seller.name,
+            'last_price': price.last_price,
+            'last_seen': price.last_seen,
+            'median_price': price.median_price,
+        })
+        basket = baskets.setdefault(price.seller_id, {
+            'seller_id': price.seller_id,
+            'seller': price.seller.name,
+            'total': Decimal(0),
+            'product_count': 0,
+        })
+        basket['total'] += price.last_price
+        basket['product_count'] += 1
+    return JsonResponse({
+        'products': [{'id': product_id, 'sellers': sellers} for product_id, sellers in products.items()],
+        # Корзину сравниваем только у продавцов, у которых покупали все продукты из неё
+        'baskets': sorted((basket for basket in baskets.values() if basket['product_count'] == len(product_ids)),
+                          key=lambda basket: basket['total']),
+    })
+
+
 def merge_product_view(request, product_id: int, another_product_id: int):
     if not is_edit_allowed(product_id, request.user.id):
         return HttpResponseForbidden()
@@ -1,36 +1,107 @@
+from datetime import date, datetime, timedelta
+from functools import partial
 from logging import getLogger
-from typing import Dict, Tuple
+from typing import Callable, Dict, Optional, Tuple, Union
 
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render
 
+from receipt_tracker.lib.view_cache import PRODUCTS_SCOPE, get_user_scope, view_cache
 from receipt_tracker.models import *
-from receipt_tracker.repositories import receipt_item_repository, receipt_repository
+from receipt_tracker.repositories import daily_product_stats_repository, product_repository, receipt_repository
 from receipt_tracker.views import add_common_context
 
 logger = getLogger(__name__)
 
 TOP_SIZE = 10
+DEFAULT_PERIOD = timedelta(days=30)
+VALUE_REPORT_PAGE_SIZE = 50
+
+Period = Tuple[date, date]
+Report = Union[Dict, List[Dict]]
+
+
+def _get_period(request) -> Period:
+    end = request.GET.get('to')
+    end = date.fromisoformat(end) if end else datetime.utcnow().date()
+    start = request.GET.get('from')
+    start = date.fromisoformat(start) if start else end - DEFAULT_PERIOD
+    if start > end:
+        raise ValueError(f'Period start {start} is after its end {end}')
+    return start, end
+
+
+def _add_period_context(context: Dict, period: Period) -> Dict:
+    start, end = period
+    context.update({
+        'start': start,
+        'end': end,
+    })
+    return context
+
+
+def _get_cached_report(name: str, user_id: int, period: Period, func: Callable[..., Report],
+                       *params) -> Tuple[Report, str]:
+    # Отчёт зависит от чеков пользователя и от общих данных о продуктах
+    return view_cache.get_or_set(name, (PRODUCTS_SCOPE, get_user_scope(user_id)),
+                                 partial(func, user_id, period, *params), user_id, period, *params)
 
 
 @login_required
 def value_report_view(request):
-    receipts = receipt_repository.get_last_by_buyer_id(request.user.id)
+    try:
+        period = _get_period(request)
+        after = _decode_receipts_cursor(request.GET.get('after'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    context, _ = _get_cached_report('value_report', request.user.id, period, _get_value_report)
+    page, cache_version = _get_cached_report('value_report_receipts', request.user.id, period,
+                                             _get_value_report_receipts, after)
+    context = dict(context, **page)
+    context['cache_version'] = cache_version
+    context = _add_period_context(context, period)
+    context = add_common_context(context)
 
-    context = {
-        'receipts': list(map(_get_receipt_info, receipts)),
+    return render(request, 'reports/value.html', context)
+
+
+def _get_value_report(user_id: int, period: Period) -> Dict:
+    # Итоги за период берём только из дневной статистики, чеки для них не читаем
+    totals = daily_product_stats_repository.get_totals(user_id, *period)
+    food = {key: totals[f'{key}_sum'] or 0 for key in ('protein', 'fat', 'carbohydrate', 'calories')}
+
+    return {
         'food': {
-            'protein': sum(receipt.protein for receipt in receipts if receipt.protein is not None),
-            'fat': sum(receipt.fat for receipt in receipts if receipt.fat is not None),
-            'carbohydrate': sum(receipt.carbohydrate for receipt in receipts if receipt.carbohydrate is not None),
-            'calories': sum(receipt.calories for receipt in receipts if receipt.calories is not None) / 1000,
+            'protein': food['protein'],
+            'fat': food['fat'],
+            'carbohydrate': food['carbohydrate'],
+            'calories': food['calories'] / 1000,
         },
-        'food_should_be': _get_food_should_be(receipts),
-        'non_checked_count': sum(receipt.non_checked_product_count for receipt in receipts)
+        'food_should_be': _get_food_should_be(food),
+        'non_checked_count': totals['non_checked_count'] or 0
+    }
+
+
+def _get_value_report_receipts(user_id: int, period: Period, after: Optional[Tuple[datetime, int]]) -> Dict:
+    receipts = receipt_repository.get_page_by_buyer_id_and_period(user_id, *period, after,
+                                                                  VALUE_REPORT_PAGE_SIZE + 1)
+    return {
+        'receipts': list(map(_get_receipt_info, receipts[:VALUE_REPORT_PAGE_SIZE])),
+        'next_cursor': _encode_receipts_cursor(receipts[VALUE_REPORT_PAGE_SIZE - 1])
+        if len(receipts) > VALUE_REPORT_PAGE_SIZE else None,
     }
-    context = add_common_context(context)
 
-    return render(request, 'reports/value.html', context)
+
+def _encode_receipts_cursor(receipt: Receipt) -> str:
+    return f'{receipt.created.isoformat()}_{receipt.id}'
+
+
+def _decode_receipts_cursor(cursor: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    if not cursor:
+        return None
+    created, receipt_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(created), int(receipt_id)
 
 
 def _get_receipt_info(receipt: Receipt) -> Dict:
@@ -56,9 +127,8 @@ def _get_receipt_info(receipt: Receipt) -> Dict:
     }
 
 
-def _get_food_should_be(receipts: List[Receipt]) -> Dict:
-    part = sum(receipt.protein + receipt.fat + receipt.carbohydrate for receipt in receipts
-               if all((receipt.protein, receipt.fat, receipt.carbohydrate))) / 6
+def _get_food_should_be(food: Dict[str, Decimal]) -> Dict:
+    part = (food['protein'] + food['fat'] + food['carbohydrate']) / 6
     return {
         'protein': part,
         'fat': part,
@@ -68,22 +138,23 @@ def _get_food_should_be(receipts: List[Receipt]) -> Dict:
 
 @login_required
 def top_report_view(request):
-    items = receipt_item_repository.get_last_by_buyer_id(request.user.id)
-
-    context = {key: _get_top(func(items)) for key, func in (
-        ('top_by_calories', _get_top_by_calories),
-        ('top_by_total', _get_top_by_total),
-        ('top_by_weight', _get_top_by_weight),
-        ('top_by_protein', _get_top_by_protein),
-        ('top_by_fat', _get_top_by_fat),
-        ('top_by_carbohydrate', _get_top_by_carbohydrate),
-        ('top_by_effectivity', _get_top_by_effectivity),
-    )}
+    try:
+        period = _get_period(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    context, cache_version = _get_cached_report('top_report', request.user.id, period, _get_top_report)
+    context['cache_version'] = cache_version
+    context = _add_period_context(context, period)
     context = add_common_context(context)
 
     return render(request, 'reports/top.html', context)
 
 
+def _get_top_report(user_id: int, period: Period) -> Dict:
+    stats = daily_product_stats_repository.get_product_stats(user_id, *period)
+    return {key: _get_top(products) for key, products in _get_tops(stats).items()}
+
+
 ProductStats = Tuple[Product, Decimal]
 
 
@@ -96,117 +167,34 @@ def _get_top(products: List[ProductStats]) -> List[Dict]:
     } for product, value in products]
 
 
-def _get_top_by_calories(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
-            continue
-        if product not in products:
-            products[product] = 0
-        products[product] += item.calories / 1000
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-def _get_top_by_total(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if product not in products:
-            products[product] = 0
-        products[product] += item.total
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-def _get_top_by_weight(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
-            continue
-        if product not in products:
-            products[product] = 0
-        products[product] += item.quantity * product.foodproduct.weight / 1000
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-def _get_top_by_protein(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
-            continue
-        if product not in products:
-            products[product] = 0
-        products[product] += item.protein / 1000
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-def _get_top_by_fat(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
-            continue
-        if product not in products:
-            products[product] = 0
-        products[product] += item.fat / 1000
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-def _get_top_by_carbohydrate(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
-            continue
-        if product not in products:
-            products[product] = 0
-        products[product] += item.carbohydrate / 1000
-    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
+TOP_KEYS = (
+    'top_by_calories',
+    'top_by_total',
+    'top_by_weight',
+    'top_by_protein',
+    'top_by_fat',
+    'top_by_carbohydrate',
+    'top_by_effectivity',
+)
 
 
-def _get_top_by_effectivity(items: List[ReceiptItem]) -> List[ProductStats]:
-    products = {}
-    for item in items:
-        product = item.product_alias.product
-        if not product.is_food:
+def _get_tops(stats: List[Dict]) -> Dict[str, List[ProductStats]]:
+    values = {key: [] for key in TOP_KEYS}
+    for row in stats:
+        product_id = row['product_id']
+        values['top_by_total'].append((product_id, row['total_sum']))
+        if row['weight_sum'] is None:
             continue
-        if product not in products:
-            products[product] = []
-        products[product].append(item.calories / float(item.total))
-    products = ((product, sum(values) / len(values) / 1000) for product, values in products.items())
-    return sorted(products, key=lambda item: item[1], reverse=True)[:TOP_SIZE]
-
-
-class _FoodStats:
+        values['top_by_weight'].append((product_id, row['weight_sum'] / 1000))
+        for key in ('calories', 'protein', 'fat', 'carbohydrate'):
+            values[f'top_by_{key}'].append((product_id, row[f'{key}_sum'] / 1000))
+        if row['effectivity_avg'] is not None:
+            values['top_by_effectivity'].append((product_id, row['effectivity_avg'] / 1000))
 
-    def __init__(self):
-        self.protein = 0
-        self.fat = 0
-        self.carbohydrate = 0
-        self.calories = 0
-        self.total = 0
-
-    def add(self, item):
-        self.protein += item.protein
-        self.fat += item.fat
-        self.carbohydrate += item.carbohydrate
-        self.calories += item.calories / 1000
-        self.total += item.total
-
-
-class _NonFoodStats:
-
-    def __init__(self):
-        self.protein = None
-        self.fat = None
-        self.carbohydrate = None
-        self.calories = None
-        self.total = 0
-
-    def add(self, item):
-        self.total += item.total
+    tops = {key: sorted(pairs, key=lambda pair: pair[1], reverse=True)[:TOP_SIZE] for key, pairs in values.items()}
+    products = {product.id: product for product in product_repository.get_by_ids(
+        {product_id for pairs in tops.values() for product_id, _ in pairs})}
+    return {key: [(products[product_id], value) for product_id, value in pairs] for key, pairs in tops.items()}
 
 
 COLUMNS = (
@@ -220,39 +208,46 @@ COLUMNS = (
 
 @login_required
 def summary_report_view(request):
-    items = receipt_item_repository.get_last_by_buyer_id(request.user.id)
-    products = _get_summary(items)
+    try:
+        period = _get_period(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    products, cache_version = _get_cached_report('summary_report', request.user.id, period, _get_summary_report)
     sorting_key = request.GET.get('sort')
     if sorting_key in (item[0] for item in COLUMNS):
-        products = sorted(products, key=lambda pair: getattr(pair[1], sorting_key) or 0, reverse=True)
+        products = sorted(products, key=lambda product: product[sorting_key] or 0, reverse=True)
 
     context = {
         'columns': COLUMNS,
         'sorting_key': sorting_key,
-        'products': [{
-            'id': product.id,
-            'name': product.name,
-            'is_food': product.is_food,
-            'is_checked': product.is_checked,
-            'protein': stats.protein,
-            'fat': stats.fat,
-            'carbohydrate': stats.carbohydrate,
-            'calories': stats.calories,
-            'total': stats.total
-        } for product, stats in products]
+        'products': products,
+        'cache_version': cache_version,
     }
+    context = _add_period_context(context, period)
     context = add_common_context(context)
 
     return render(request, 'reports/summary.html', context)
 
 
-def _get_summary(items: List[ReceiptItem]) -> List[Tuple[Product, Union[_FoodStats, _NonFoodStats]]]:
-    products: Dict[Product, Union[_FoodStats, _NonFoodStats]] = {}
-    for item in items:
-        product = item.product_alias.product
-        stats = products.get(product)
-        if stats is None:
-            stats = _FoodStats() if product.is_food else _NonFoodStats()
-            products[product] = stats
-        stats.add(item)
-    return list(products.items())
+def _get_summary_report(user_id: int, period: Period) -> List[Dict]:
+    return _get_summary(daily_product_stats_repository.get_product_stats(user_id, *period))
+
+
+def _get_summary(stats: List[Dict]) -> List[Dict]:
+    products = {product.id: product for product in product_repository.get_by_ids({row['product_id'] for row in stats})}
+    summary = []
+    for row in stats:
+        product = products[row['product_id']]
+        is_food = product.is_food
+        summary.append({
+            'id': product.id,
+            'name': product.name,
+            'is_food': is_food,
+            'is_checked': product.is_checked,
+            'protein': row['protein_sum'] if is_food else None,
+            'fat': row['fat_sum'] if is_food else None,
+            'carbohydrate': row['carbohydrate_sum'] if is_food else None,
+            'calories': row['calories_sum'] / 1000 if is_food and row['calories_sum'] is not None else None,
+            'total': row['total_sum'],
+        })
+    return summary
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
 from http import HTTPStatus
 
@@ -8,7 +8,11 @@ from pytest import fixture
 
 from receipt_tracker import tasks
 from receipt_tracker.lib import ReceiptParams, qr_code
-from receipt_tracker.repositories import product_repository, receipt_item_repository, receipt_repository
+from receipt_tracker.lib.similar import similar_product_index
+from receipt_tracker.lib.view_cache import LISTINGS_SCOPE, view_cache
+from receipt_tracker.models import PendingReceipt, Product, ProductAlias, ProductSummary, ReceiptItem, SellerPrice
+from receipt_tracker.repositories import pending_receipt_repository, price_stats_repository, product_repository, \
+    product_summary_repository, receipt_item_repository, receipt_repository
 from receipt_tracker.views import general
 
 pytestmark = pytest.mark.django_db
@@ -21,6 +25,20 @@ class TestIndexView:
         response = guest_client.get(reverse('index'))
         assert response.status_code == HTTPStatus.OK
 
+    def test_if_cached(self, django_assert_num_queries, guest_client, receipt_item):
+        guest_client.get(reverse('index'))
+        with django_assert_num_queries(0):
+            response = guest_client.get(reverse('index'))
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['items'][0]['product_id'] == receipt_item.product_alias.product_id
+
+    def test_if_listings_invalidated(self, mixer, guest_client, receipt_item):
+        guest_client.get(reverse('index'))
+        mixer.blend(ReceiptItem)
+        view_cache.invalidate(LISTINGS_SCOPE)
+        response = guest_client.get(reverse('index'))
+        assert len(response.context['items']) == 2
+
 
 class TestAddReceiptView:
 
@@ -47,7 +65,29 @@ class TestAddReceiptView:
         })
         assert response.status_code == HTTPStatus.OK
 
-    def test_post(self, mocker, authorized_client, receipt_params):
+    def test_post_if_receipt_pending(self, mocker, authorized_client, user, receipt_params):
+        mocker.patch.object(qr_code, 'decode', return_value=receipt_params)
+        mocker.patch.object(tasks, 'add_receipt')
+        pending_receipt_repository.claim(user.id, '1', '1', '1')
+        response = authorized_client.post(reverse('add-receipt'), {
+            'text': 'foo',
+        })
+        assert response.status_code == HTTPStatus.OK
+        assert not tasks.add_receipt.apply_async.called
+
+    def test_post_if_receipt_pending_too_long(self, mocker, authorized_client, user, receipt_params):
+        mocker.patch.object(qr_code, 'decode', return_value=receipt_params)
+        mocker.patch.object(tasks, 'add_receipt')
+        pending_receipt_repository.claim(user.id, '1', '1', '1')
+        PendingReceipt.objects.update(
+            updated=datetime.utcnow() - pending_receipt_repository.PENDING_TIMEOUT - timedelta(minutes=1))
+        response = authorized_client.post(reverse('add-receipt'), {
+            'text': 'foo',
+        })
+        assert response.status_code == HTTPStatus.FOUND
+        assert tasks.add_receipt.apply_async.called
+
+    def test_post(self, mocker, authorized_client, user, receipt_params):
         mocker.patch.object(qr_code, 'decode', return_value=receipt_params)
         mocker.patch.object(receipt_repository, 'is_exist', return_value=False)
         mocker.patch.object(tasks, 'add_receipt')
@@ -55,6 +95,13 @@ class TestAddReceiptView:
             'text': 'foo',
         })
         assert response.status_code == HTTPStatus.FOUND
+        assert tasks.add_receipt.apply_async.called
+        assert not tasks.add_receipt.apply.called
+
+        pending_receipt = PendingReceipt.objects.get()
+        assert pending_receipt.buyer_id == user.id
+        assert pending_receipt.status == PendingReceipt.STATUS_PENDING
+        assert response.url.endswith(f'?id={pending_receipt.id}')
 
 
 class TestReceiptAddedView:
@@ -62,48 +109,212 @@ class TestReceiptAddedView:
     def test(self, guest_client):
         response = guest_client.get(reverse('receipt-added'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['status_url'] is None
+
+    def test_if_pending_receipt_set(self, guest_client):
+        response = guest_client.get(f'{reverse("receipt-added")}?id=1')
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['status_url'] == reverse('pending-receipt-status', args=(1,))
+
+
+class TestPendingReceiptStatusView:
+
+    def test(self, authorized_client, user):
+        pending_receipt = pending_receipt_repository.claim(user.id, '1', '2', '3')
+        response = authorized_client.get(reverse('pending-receipt-status', args=(pending_receipt.id,)))
+        assert response.status_code == HTTPStatus.OK
+        assert response.json()['status'] == PendingReceipt.STATUS_PENDING
+
+    def test_if_another_buyer(self, mixer, authorized_client):
+        pending_receipt = mixer.blend(PendingReceipt)
+        response = authorized_client.get(reverse('pending-receipt-status', args=(pending_receipt.id,)))
+        assert response.status_code == HTTPStatus.NOT_FOUND
 
 
 class TestProductsView:
 
-    def test(self, mocker, guest_client, product, receipt_item):
-        mocker.patch.object(product_repository, 'get_all', return_value=[product])
+    def test(self, guest_client, product, receipt_item):
+        product_summary_repository.update([product.id])
         response = guest_client.get(reverse('products'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['products'][0]['id'] == product.id
+        assert response.context['next_cursor'] is None
+
+    def test_if_next_page_exists(self, mocker, mixer, guest_client, product, receipt_item):
+        mocker.patch.object(general, 'PRODUCTS_PAGE_SIZE', 1)
+        another_receipt_item = mixer.blend(ReceiptItem, receipt__created=datetime(2019, 1, 1))
+        product_summary_repository.update([product.id, another_receipt_item.product_alias.product_id])
+        response = guest_client.get(reverse('products'))
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['products']) == 1
+        assert response.context['next_cursor'] == f'{receipt_item.receipt.created.isoformat()}_{product.id}'
+
+    def test_if_after_set(self, guest_client, product, receipt_item):
+        product_summary_repository.update([product.id])
+        response = guest_client.get(reverse('products'), {
+            'after': f'{receipt_item.receipt.created.isoformat()}_{product.id}',
+        })
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['products'] == []
+
+    def test_if_bad_cursor(self, guest_client):
+        response = guest_client.get(reverse('products'), {
+            'after': 'foo',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_sort_and_search_set(self, mocker, guest_client):
+        mocker.patch.object(product_summary_repository, 'get_page', return_value=[])
+        response = guest_client.get(reverse('products'), {
+            'after': '10.50_1',
+            'sort': '-last_price',
+            'q': ' foo ',
+        })
+        assert response.status_code == HTTPStatus.OK
+        product_summary_repository.get_page.assert_called_once_with((Decimal('10.50'), 1),
+                                                                     general.PRODUCTS_PAGE_SIZE + 1, '-last_price',
+                                                                     'foo')
+
+    def test_if_next_page_ordered_by_name(self, mocker, mixer, guest_client):
+        mocker.patch.object(general, 'PRODUCTS_PAGE_SIZE', 1)
+        summaries = [mixer.blend(ProductSummary, name=name) for name in ('foo_bar', 'foo_baz')]
+        response = guest_client.get(reverse('products'), {
+            'sort': 'name',
+        })
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['next_cursor'] == f'foo_bar_{summaries[0].product_id}'
+
+        response = guest_client.get(reverse('products'), {
+            'after': response.context['next_cursor'],
+            'sort': 'name',
+        })
+        assert [product['id'] for product in response.context['products']] == [summaries[1].product_id]
+
+    def test_if_bad_sort(self, guest_client):
+        response = guest_client.get(reverse('products'), {
+            'sort': 'id',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_bad_price_cursor(self, guest_client):
+        response = guest_client.get(reverse('products'), {
+            'after': 'foo_1',
+            'sort': 'last_price',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestProductsApiView:
+
+    def test(self, mixer, guest_client, product, product_alias):
+        mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal('10.50'),
+                    receipt__created=datetime(2019, 1, 1, 12))
+        product_summary_repository.update([product.id])
+        response = guest_client.get(reverse('products-api'), {
+            'sort': 'last_price',
+        })
+        assert response.status_code == HTTPStatus.OK
+        assert response.json() == {
+            'products': [{
+                'id': product.id,
+                'name': product.name,
+                'is_checked': False,
+                'last_buy': '2019-01-01T12:00:00',
+                'last_price': '10.50',
+            }],
+            'next_cursor': None,
+        }
+
+    def test_if_many_products(self, mixer, django_assert_num_queries, guest_client):
+        mixer.cycle(20).blend(ProductSummary)
+        with django_assert_num_queries(1):
+            response = guest_client.get(reverse('products-api'))
+        assert len(response.json()['products']) == 20
+
+    def test_if_cached(self, mixer, django_assert_num_queries, guest_client):
+        mixer.cycle(20).blend(ProductSummary)
+        guest_client.get(reverse('products'), {'sort': 'name'})
+        with django_assert_num_queries(0):
+            response = guest_client.get(reverse('products-api'), {'sort': 'name'})
+        assert len(response.json()['products']) == 20
+
+    def test_if_listings_invalidated(self, mixer, guest_client):
+        mixer.blend(ProductSummary)
+        guest_client.get(reverse('products-api'))
+        mixer.blend(ProductSummary)
+        view_cache.invalidate(LISTINGS_SCOPE)
+        response = guest_client.get(reverse('products-api'))
+        assert len(response.json()['products']) == 2
+
+    def test_if_bad_cursor(self, guest_client):
+        response = guest_client.get(reverse('products-api'), {
+            'after': 'foo',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
 
 
 class TestProductView:
 
     def test_if_get_and_product_not_found(self, mocker, guest_client):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=None)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=None)
         response = guest_client.get(reverse('product', args=(1,)))
         assert response.status_code == HTTPStatus.NOT_FOUND
 
     def test_if_get_and_product_found(self, mocker, guest_client, product, food_product, receipt_item):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=product)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=product)
         mocker.patch.object(receipt_item_repository, 'is_exist_by_product_id_and_buyer_id', return_value=False)
-        mocker.patch.object(receipt_item_repository, 'get_by_product_id', return_value=[receipt_item])
+        mocker.patch.object(receipt_item_repository, 'get_page_by_product_id', return_value=[receipt_item])
         response = guest_client.get(reverse('product', args=(product.id,)))
         assert response.status_code == HTTPStatus.OK
 
     def test_if_get_and_non_food_product_found(self, mocker, guest_client, product, non_food_product, receipt_item):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=product)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=product)
         mocker.patch.object(receipt_item_repository, 'is_exist_by_product_id_and_buyer_id', return_value=False)
-        mocker.patch.object(receipt_item_repository, 'get_by_product_id', return_value=[receipt_item])
+        mocker.patch.object(receipt_item_repository, 'get_page_by_product_id', return_value=[receipt_item])
         response = guest_client.get(reverse('product', args=(product.id,)))
         assert response.status_code == HTTPStatus.OK
 
+    @pytest.mark.parametrize('item_count', (1, 20))
+    def test_if_get_and_query_count_fixed(self, mixer, django_assert_num_queries, guest_client, product,
+                                          food_product, item_count):
+        aliases = mixer.cycle(2).blend(ProductAlias, product=product)
+        mixer.cycle(item_count).blend(ReceiptItem, product_alias=mixer.sequence(*aliases))
+        similar_product_index.build([])
+        with django_assert_num_queries(6):
+            response = guest_client.get(reverse('product', args=(product.id,)))
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['product']['prices']) == item_count
+
+    def test_if_get_and_similar_product_index_not_built(self, mocker, guest_client, product, receipt_item):
+        mocker.patch.object(tasks, 'build_similar_product_index')
+        mocker.patch.object(product_repository, 'get_all_with_aliases')
+        response = guest_client.get(reverse('product', args=(product.id,)))
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['product']['similars'] == []
+        assert tasks.build_similar_product_index.delay.called
+        assert not product_repository.get_all_with_aliases.called
+
+    def test_if_get_and_similar_products_found(self, mocker, mixer, guest_client, product, receipt_item):
+        product.user_friendly_name = 'foo bar baz'
+        product.save()
+        similar_product = mixer.blend(Product, user_friendly_name='foo bar')
+        similar_product_index.build([(similar_product.id, similar_product.name)])
+        mocker.patch.object(tasks, 'build_similar_product_index')
+        response = guest_client.get(reverse('product', args=(product.id,)))
+        assert response.context['product']['similars'][0]['id'] == similar_product.id
+        assert not tasks.build_similar_product_index.delay.called
+
     def test_if_post_and_edit_not_allowed(self, mocker, guest_client, product):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=product)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=product)
         mocker.patch.object(receipt_item_repository, 'is_exist_by_product_id_and_buyer_id', return_value=False)
         response = guest_client.post(reverse('product', args=(product.id,)))
         assert response.status_code == HTTPStatus.FORBIDDEN
 
     def test_if_post_and_product_not_updated(self, mocker, authorized_client, product, food_product, receipt_item):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=product)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=product)
         mocker.patch.object(receipt_item_repository, 'is_exist_by_product_id_and_buyer_id', return_value=True)
         mocker.patch.object(product_repository, 'set_barcode', return_value=None)
-        mocker.patch.object(receipt_item_repository, 'get_by_product_id', return_value=[receipt_item])
+        mocker.patch.object(receipt_item_repository, 'get_page_by_product_id', return_value=[receipt_item])
         response = authorized_client.post(reverse('product', args=(product.id,)), {
             'barcode': '1',
         })
@@ -111,16 +322,160 @@ class TestProductView:
 
     def test_if_post_and_product_updated(self, mocker, authorized_client, product, product_with_barcode,
                                          food_product, receipt_item):
-        mocker.patch.object(product_repository, 'get_by_id', return_value=product)
+        mocker.patch.object(product_repository, 'get_with_details', return_value=product)
         mocker.patch.object(receipt_item_repository, 'is_exist_by_product_id_and_buyer_id', return_value=True)
         mocker.patch.object(product_repository, 'set_barcode', return_value=product_with_barcode.id)
-        mocker.patch.object(receipt_item_repository, 'get_by_product_id', return_value=[receipt_item])
+        mocker.patch.object(receipt_item_repository, 'get_page_by_product_id', return_value=[receipt_item])
         response = authorized_client.post(reverse('product', args=(product.id,)), {
             'barcode': product_with_barcode.barcode,
         })
         assert response.status_code == HTTPStatus.FOUND
 
 
+class TestProductPricesView:
+
+    @fixture
+    def receipt_items(self, mixer, product_alias):
+        return [mixer.blend(ReceiptItem, product_alias=product_alias, price=Decimal(price),
+                            receipt__seller=product_alias.seller, receipt__created=created)
+                for price, created in (('10', datetime(2019, 1, 1)), ('20', datetime(2019, 1, 3)),
+                                       ('30', datetime(2019, 2, 1)))]
+
+    def test(self, guest_client, product, product_alias, receipt_items):
+        price_stats_repository.update_by_product_ids([product.id])
+        response = guest_client.get(reverse('product-prices', args=(product.id,)))
+        assert response.status_code == HTTPStatus.OK
+        assert response.json() == {
+            'resolution': 'week',
+            'points': [{
+                'seller_id': product_alias.seller_id,
+                'seller': product_alias.seller.name,
+                'start': '2018-12-31',
+                'min': '10.00',
+                'avg': '15.00',
+                'max': '20.00',
+                'count': 2,
+            }, {
+                'seller_id': product_alias.seller_id,
+                'seller': product_alias.seller.name,
+                'start': '2019-01-28',
+                'min': '30.00',
+                'avg': '30.00',
+                'max': '30.00',
+                'count': 1,
+            }],
+        }
+
+    def test_if_month(self, guest_client, product, receipt_items):
+        price_stats_repository.update_by_product_ids([product.id])
+        response = guest_client.get(reverse('product-prices', args=(product.id,)), {
+            'resolution': 'month',
+        })
+        assert [point['start'] for point in response.json()['points']] == ['2019-01-01', '2019-02-01']
+
+    def test_if_raw(self, mocker, guest_client, product, receipt_items):
+        mocker.patch.object(general, 'PRICES_PAGE_SIZE', 2)
+        response = guest_client.get(reverse('product-prices', args=(product.id,)), {
+            'resolution': 'raw',
+        })
+        assert response.status_code == HTTPStatus.OK
+        result = response.json()
+        assert [point['price'] for point in result['points']] == ['30.00', '20.00']
+        assert result['next_cursor'] == f'2019-01-03T00:00:00_{receipt_items[1].id}'
+
+        response = guest_client.get(reverse('product-prices', args=(product.id,)), {
+            'resolution': 'raw',
+            'after': result['next_cursor'],
+        })
+        result = response.json()
+        assert [point['price'] for point in result['points']] == ['10.00']
+        assert result['next_cursor'] is None
+
+    def test_if_product_not_found(self, guest_client):
+        response = guest_client.get(reverse('product-prices', args=(1,)))
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_if_bad_resolution(self, guest_client, product):
+        response = guest_client.get(reverse('product-prices', args=(product.id,)), {
+            'resolution': 'day',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_bad_cursor(self, guest_client, product):
+        response = guest_client.get(reverse('product-prices', args=(product.id,)), {
+            'resolution': 'raw',
+            'after': 'foo',
+        })
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+class TestPriceComparisonView:
+
+    @fixture
+    def prices(self, mixer, seller, another_seller, product, another_product):
+        return [mixer.blend(SellerPrice, product=price_product, seller=price_seller, last_price=Decimal(price),
+                            last_seen=datetime(2019, 1, 1), median_price=None)
+                for price_product, price_seller, price in ((product, seller, '10'), (product, another_seller, '8'),
+                                                           (another_product, seller, '5'))]
+
+    @fixture
+    def another_product(self, mixer):
+        return mixer.blend(Product)
+
+    def test(self, django_assert_num_queries, guest_client, seller, another_seller, product, prices):
+        with django_assert_num_queries(1):
+            response = guest_client.get(reverse('price-comparison'), {
+                'product': product.id,
+            })
+        assert response.status_code == HTTPStatus.OK
+        assert response.json() == {
+            'products': [{
+                'id': product.id,
+                'sellers': [{
+                    'seller_id': another_seller.id,
+                    'seller': another_seller.name,
+                    'last_price': '8.00',
+                    'last_seen': '2019-01-01T00:00:00',
+                    'median_price': None,
+                }, {
+                    'seller_id': seller.id,
+                    'seller': seller.name,
+                    'last_price': '10.00',
+                    'last_seen': '2019-01-01T00:00:00',
+                    'median_price': None,
+                }],
+            }],
+            'baskets': [{
+                'seller_id': another_seller.id,
+                'seller': another_seller.name,
+                'total': '8.00',
+                'product_count': 1,
+            }, {
+                'seller_id': seller.id,
+                'seller': seller.name,
+                'total': '10.00',
+                'product_count': 1,
+            }],
+        }
+
+    def test_if_basket(self, guest_client, seller, product, another_product, prices):
+        response = guest_client.get(f'{reverse("price-comparison")}?product={product.id}&product={another_product.id}')
+        assert response.status_code == HTTPStatus.OK
+        assert [(basket['seller_id'], basket['total']) for basket in response.json()['baskets']] == [
+            (seller.id, '15.00'),
+        ]
+
+    @pytest.mark.parametrize('params', ({}, {'product': 'foo'}))
+    def test_if_bad_products(self, guest_client, params):
+        response = guest_client.get(reverse('price-comparison'), params)
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_too_many_products(self, mocker, guest_client):
+        mocker.patch.object(general, 'PRICE_COMPARISON_MAX_PRODUCTS', 1)
+        response = guest_client.get(f'{reverse("price-comparison")}?product=1&product=2')
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
 class TestMergeProductView:
 
     def test_if_product_edit_not_allowed(self, mocker, guest_client):
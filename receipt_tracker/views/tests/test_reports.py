@@ -1,9 +1,17 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
 from http import HTTPStatus
+from typing import Dict, List
 
 import pytest
 from django.urls import reverse
+from pytest import approx, fixture
 
-from receipt_tracker.repositories import receipt_item_repository, receipt_repository
+from receipt_tracker.lib.view_cache import PRODUCTS_SCOPE, get_user_scope, view_cache
+from receipt_tracker.models import FoodProduct, NonFoodProduct, Receipt, ReceiptItem, User
+from receipt_tracker.repositories import daily_product_stats_repository, receipt_item_repository, receipt_repository
+from receipt_tracker.views import reports
+from receipt_tracker.views.reports import ProductStats, TOP_SIZE
 
 pytestmark = pytest.mark.django_db
 
@@ -11,37 +19,236 @@ pytestmark = pytest.mark.django_db
 class TestValueReportView:
 
     def test(self, mocker, authorized_client, receipt, receipt_item):
-        mocker.patch.object(receipt_repository, 'get_last_by_buyer_id', return_value=[receipt])
+        mocker.patch.object(receipt_repository, 'get_page_by_buyer_id_and_period', return_value=[receipt])
         response = authorized_client.get(reverse('value-report'))
         assert response.status_code == HTTPStatus.OK
 
+    def test_if_period_set(self, authorized_client, food_product, receipt, receipt_item):
+        day = receipt.created.date().isoformat()
+        response = authorized_client.get(f'{reverse("value-report")}?from={day}&to={day}')
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['receipts']) == 1
+        assert response.context['food']['calories'] == receipt_item.calories / 1000
+
+    def test_if_period_before_receipts(self, authorized_client, receipt_item):
+        response = authorized_client.get(f'{reverse("value-report")}?from=2019-01-01&to=2019-01-31')
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['receipts'] == []
+        assert response.context['non_checked_count'] == 0
+
+    def test_if_period_invalid(self, authorized_client):
+        response = authorized_client.get(f'{reverse("value-report")}?from=2019-02-01&to=2019-01-01')
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_paginated(self, mocker, mixer, authorized_client, user):
+        mocker.patch.object(reports, 'VALUE_REPORT_PAGE_SIZE', 2)
+        receipts = mixer.cycle(3).blend(Receipt, buyer=user, created=datetime.utcnow())
+        response = authorized_client.get(reverse('value-report'))
+        assert [receipt['id'] for receipt in response.context['receipts']] == [receipts[2].id, receipts[1].id]
+        assert response.context['next_cursor']
+
+        response = authorized_client.get(reverse('value-report'), {'after': response.context['next_cursor']})
+        assert [receipt['id'] for receipt in response.context['receipts']] == [receipts[0].id]
+        assert response.context['next_cursor'] is None
+
+    def test_if_cursor_invalid(self, authorized_client):
+        response = authorized_client.get(reverse('value-report'), {'after': 'foo'})
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_totals_not_limited_by_page(self, mocker, mixer, authorized_client, user, food_product, receipt_item):
+        mocker.patch.object(reports, 'VALUE_REPORT_PAGE_SIZE', 1)
+        mixer.blend(Receipt, buyer=user, created=datetime.utcnow())
+        response = authorized_client.get(reverse('value-report'))
+        assert len(response.context['receipts']) == 1
+        assert response.context['food']['calories'] == receipt_item.calories / 1000
+
+    def test_query_count(self, django_assert_num_queries, mixer, authorized_client, user, receipt):
+        for i in range(5):
+            mixer.blend(FoodProduct, product=mixer.blend(ReceiptItem, receipt=receipt).product_alias.product)
+            mixer.blend(ReceiptItem, receipt__buyer=user, receipt__created=datetime.utcnow())
+        with django_assert_num_queries(6):
+            response = authorized_client.get(reverse('value-report'))
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['receipts']) == 6
+
+    def test_if_cached(self, django_assert_num_queries, authorized_client, receipt_item):
+        authorized_client.get(reverse('value-report'))
+        # Остаются только запросы сессии и пользователя
+        with django_assert_num_queries(2):
+            response = authorized_client.get(reverse('value-report'))
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['receipts']) == 1
+
+    def test_if_user_scope_invalidated(self, mixer, authorized_client, user, receipt_item):
+        authorized_client.get(reverse('value-report'))
+        mixer.blend(ReceiptItem, receipt__buyer=user, receipt__created=datetime.utcnow())
+        view_cache.invalidate(get_user_scope(user.id))
+        response = authorized_client.get(reverse('value-report'))
+        assert len(response.context['receipts']) == 2
+
+    def test_if_another_user_cached(self, mixer, client, user, receipt_item):
+        client.force_login(user)
+        client.get(reverse('value-report'))
+        client.force_login(mixer.blend(User))
+        response = client.get(reverse('value-report'))
+        assert response.context['receipts'] == []
+
 
 class TestTopReportView:
 
-    def test_if_food(self, mocker, authorized_client, food_product, receipt_item):
-        mocker.patch.object(receipt_item_repository, 'get_last_by_buyer_id', return_value=[receipt_item])
+    def test_if_food(self, authorized_client, food_product, receipt_item):
         response = authorized_client.get(reverse('top-report'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['top_by_calories'][0]['id'] == food_product.product.id
 
-    def test_if_non_food(self, mocker, authorized_client, non_food_product, receipt_item):
-        mocker.patch.object(receipt_item_repository, 'get_last_by_buyer_id', return_value=[receipt_item])
+    def test_if_non_food(self, authorized_client, non_food_product, receipt_item):
         response = authorized_client.get(reverse('top-report'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['top_by_total'][0]['id'] == non_food_product.product.id
+        assert response.context['top_by_calories'] == []
+
+    def test_if_period_set(self, authorized_client, food_product, receipt_item):
+        response = authorized_client.get(f'{reverse("top-report")}?from=2019-01-01&to=2019-01-31')
+        assert response.status_code == HTTPStatus.OK
+        assert response.context['top_by_total'] == []
+
+    def test_if_period_invalid(self, authorized_client):
+        response = authorized_client.get(f'{reverse("top-report")}?from=foo')
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_if_cached(self, django_assert_num_queries, authorized_client, food_product, receipt_item):
+        authorized_client.get(reverse('top-report'))
+        with django_assert_num_queries(2):
+            response = authorized_client.get(reverse('top-report'))
+        assert response.context['top_by_total'][0]['id'] == food_product.product_id
+
+
+def _get_reference_top(items: List[ReceiptItem], get_value, is_food_only: bool = True) -> List[ProductStats]:
+    products = {}
+    for item in items:
+        product = item.product_alias.product
+        if is_food_only and not product.is_food:
+            continue
+        if product not in products:
+            products[product] = 0
+        products[product] += get_value(item)
+    return sorted(products.items(), key=lambda item: item[1], reverse=True)[:TOP_SIZE]
+
+
+def _get_reference_top_by_effectivity(items: List[ReceiptItem]) -> List[ProductStats]:
+    products = {}
+    for item in items:
+        product = item.product_alias.product
+        if not product.is_food:
+            continue
+        if product not in products:
+            products[product] = []
+        # Эталон считаем во float, как до хранения калорий в чеках
+        products[product].append(float(item.calories) / float(item.total))
+    products = ((product, sum(values) / len(values) / 1000) for product, values in products.items())
+    return sorted(products, key=lambda item: item[1], reverse=True)[:TOP_SIZE]
+
+
+def _get_product_stats(user_id: int) -> List[Dict]:
+    today = datetime.utcnow().date()
+    return daily_product_stats_repository.get_product_stats(user_id, today - reports.DEFAULT_PERIOD, today)
+
+
+class TestGetTops:
+
+    @fixture
+    def items(self, mixer, user):
+        items = []
+        for i in range(TOP_SIZE + 3):
+            alias = mixer.blend('receipt_tracker.ProductAlias')
+            if i % 4 == 0:
+                mixer.blend(NonFoodProduct, product=alias.product)
+            else:
+                mixer.blend(FoodProduct, product=alias.product, calories=100 + i * 37, weight=50 + i * 13,
+                            protein=Decimal(i % 7 + 1), fat=Decimal(i % 5 + 2), carbohydrate=Decimal(i % 3 + 3))
+            for j in range(i % 3 + 1):
+                items.append(mixer.blend(ReceiptItem, product_alias=alias, receipt__buyer=user,
+                                         receipt__created=datetime.utcnow() - timedelta(days=j),
+                                         quantity=Decimal('0.5') * (j + 1), total=Decimal(10 + i * 3 + j)))
+        mixer.blend(ReceiptItem, receipt__buyer=user, receipt__created=datetime.utcnow() - timedelta(days=100))
+        receipt_item_repository.update_food_values_by_receipt_ids(item.receipt_id for item in items)
+        daily_product_stats_repository.update_by_product_ids(item.product_alias.product_id for item in items)
+        for item in items:
+            item.refresh_from_db()
+        return items
+
+    def test_equivalence(self, user, items):
+        expected = {
+            'top_by_calories': _get_reference_top(items, lambda item: item.calories / 1000),
+            'top_by_total': _get_reference_top(items, lambda item: item.total, False),
+            'top_by_weight': _get_reference_top(
+                items, lambda item: item.quantity * item.product_alias.product.foodproduct.weight / 1000),
+            'top_by_protein': _get_reference_top(items, lambda item: item.protein / 1000),
+            'top_by_fat': _get_reference_top(items, lambda item: item.fat / 1000),
+            'top_by_carbohydrate': _get_reference_top(items, lambda item: item.carbohydrate / 1000),
+            'top_by_effectivity': _get_reference_top_by_effectivity(items),
+        }
+
+        result = reports._get_tops(_get_product_stats(user.id))
+
+        assert result.keys() == expected.keys()
+        for key, pairs in expected.items():
+            assert [product.id for product, _ in result[key]] == [product.id for product, _ in pairs], key
+            for (_, value), (_, expected_value) in zip(result[key], pairs):
+                if key == 'top_by_effectivity':
+                    # Калории хранятся в чеках как Decimal, поэтому и эффективность теперь Decimal, а не float
+                    assert type(value) == Decimal, key
+                    assert float(value) == approx(expected_value), key
+                else:
+                    assert type(value) == type(expected_value), key
+                    assert value == approx(expected_value), key
+
+    def test_query_count(self, django_assert_num_queries, user, items):
+        with django_assert_num_queries(3):
+            reports._get_tops(_get_product_stats(user.id))
 
 
 class TestSummaryReportView:
 
-    def test_if_food(self, mocker, authorized_client, food_product, receipt_item):
-        mocker.patch.object(receipt_item_repository, 'get_last_by_buyer_id', return_value=[receipt_item])
+    def test_if_food(self, authorized_client, food_product, receipt_item):
         response = authorized_client.get(reverse('summary-report'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['products'][0]['calories'] == receipt_item.calories / 1000
 
-    def test_if_non_food(self, mocker, authorized_client, non_food_product, receipt_item):
-        mocker.patch.object(receipt_item_repository, 'get_last_by_buyer_id', return_value=[receipt_item])
+    def test_if_non_food(self, authorized_client, non_food_product, receipt_item):
         response = authorized_client.get(reverse('summary-report'))
         assert response.status_code == HTTPStatus.OK
+        assert response.context['products'][0]['calories'] is None
 
-    def test_if_food_and_sorting_key_set(self, mocker, authorized_client, food_product, receipt_item):
-        mocker.patch.object(receipt_item_repository, 'get_last_by_buyer_id', return_value=[receipt_item])
+    def test_if_food_and_sorting_key_set(self, authorized_client, food_product, receipt_item):
         response = authorized_client.get(f'{reverse("summary-report")}?sort=protein')
         assert response.status_code == HTTPStatus.OK
+
+    def test_if_period_set(self, authorized_client, receipt, receipt_item):
+        day = receipt.created.date().isoformat()
+        response = authorized_client.get(f'{reverse("summary-report")}?from={day}&to={day}')
+        assert response.status_code == HTTPStatus.OK
+        assert len(response.context['products']) == 1
+
+    def test_query_count(self, django_assert_num_queries, mixer, authorized_client, user, receipt_item):
+        for i in range(5):
+            mixer.blend(ReceiptItem, receipt=receipt_item.receipt)
+        daily_product_stats_repository.update_by_buyer_id_and_days(user.id, [receipt_item.receipt.created.date()])
+        with django_assert_num_queries(5):
+            response = authorized_client.get(reverse('summary-report'))
+        assert len(response.context['products']) == 6
+
+    def test_if_cached(self, django_assert_num_queries, authorized_client, receipt_item):
+        authorized_client.get(reverse('summary-report'))
+        with django_assert_num_queries(2):
+            response = authorized_client.get(f'{reverse("summary-report")}?sort=total')
+        assert response.context['sorting_key'] == 'total'
+        assert len(response.context['products']) == 1
+
+    def test_if_products_scope_invalidated(self, authorized_client, product, receipt_item):
+        authorized_client.get(reverse('summary-report'))
+        product.user_friendly_name = 'bar'
+        product.save()
+        view_cache.invalidate(PRODUCTS_SCOPE)
+        response = authorized_client.get(reverse('summary-report'))
+        assert response.context['products'][0]['name'] == 'bar'